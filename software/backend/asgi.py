@@ -2,6 +2,8 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+WebSocket connections are routed to chat.websocket; everything else is served
+by Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -13,4 +15,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after the app registry is ready
+from chat.websocket import chat_socket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """HTTP goes to Django; WebSockets go to the live chat endpoint"""
+    if scope['type'] == 'websocket':
+        return await chat_socket(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,4 @@
+"""Helpers shared by the benchmark management commands"""
+
+class RollbackBenchmark(Exception):
+    """Raised to discard the rows a benchmark run created"""
@@ -86,6 +86,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 
 # Database
@@ -95,6 +96,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Writers (requests and the outbox worker's threads) queue for the
+            # write lock at BEGIN instead of failing midway through a transaction
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # A file, not shared-cache memory, so threaded tests get real locking
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -158,6 +169,16 @@ yQIDAQAB
 CLERK_JWT_AUDIENCE = 'brave-lark-25.clerk.accounts.dev'
 CLERK_ISSUER = 'https://brave-lark-25.clerk.accounts.dev'
 CLERK_SECRET_KEY = 'sk_test_Z6pVmTLgiTkZ0FpVU0gH1gibhWLpws9ljg99AV36lA'
+# Verified session tokens kept in memory (until their exp) and the lifetime
+# of cached clerk_id -> User lookups, see users.tokens
+CLERK_TOKEN_CACHE_SIZE = 1024
+CLERK_USER_CACHE_TIMEOUT = 300
+# Clerk backend API client (users.clerk_api); point CLERK_API_URL at a local
+# stand-in for tests. Timeout is (connect, read) seconds.
+CLERK_API_URL = os.environ.get('CLERK_API_URL', 'https://api.clerk.com/v1')
+CLERK_API_TIMEOUT = (3.05, 10)
+CLERK_API_RETRIES = 3
+CLERK_API_POOL_SIZE = 10
 
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
 CORS_ALLOW_CREDENTIALS = True
@@ -202,6 +223,26 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Delivers new chat messages to open WebSockets (chat.pubsub). The in-memory
+# backend only reaches sockets served by the same process.
+CHAT_PUBSUB_BACKEND = 'chat.pubsub.InMemoryPubSub'
+# Read receipts (chat.receipts) are written in one UPDATE at most this many
+# seconds after the chat was opened, or once this many members are waiting.
+# 0 writes each receipt immediately.
+CHAT_READ_RECEIPT_MAX_DELAY = 2.0
+CHAT_READ_RECEIPT_MAX_PENDING = 1000
+# Delta sync (chat.sync): messages per response, and how many seconds the
+# returned watermark trails the clock to cover in-flight transactions
+CHAT_SYNC_LIMIT = 500
+CHAT_SYNC_OVERLAP = 2
+# Done outbox events (notifications.outbox) are deleted this many days
+# after they were applied
+OUTBOX_RETENTION_DAYS = 7
+# Lifetime of each user's cached friend-id set (friends.models.Friendship).
+# Accepting or removing a friend drops it at once; the timeout bounds how
+# long other processes can serve a stale set with a per-process cache.
+FRIEND_IDS_CACHE_TIMEOUT = 60
+
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_SECURE = False  # Set to True in production
 SESSION_COOKIE_HTTPONLY = True
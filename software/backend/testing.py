@@ -0,0 +1,32 @@
+"""Factories shared by the apps' test suites"""
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.utils import timezone
+from games.models import Game
+from users.models import ClerkUser
+
+def make_game(host, **kwargs):
+    """An upcoming game hosted by host; kwargs override the defaults"""
+    defaults = {
+        'title': 'Friday Night Holdem',
+        'location': 'LBC',
+        'scheduled_time': timezone.now() + timedelta(days=1),
+        'buy_in': 20,
+        'slots': 8,
+        'blinds': 1,
+    }
+    defaults.update(kwargs)
+    return Game.objects.create(host=host, **defaults)
+
+def make_users(prefix, start, stop, image_url=None):
+    """
+    Bulk-create users named prefix<start> to prefix<stop - 1>, each with a
+    ClerkUser carrying image_url as avatar when one is given
+    """
+    users = User.objects.bulk_create(User(username=f'{prefix}{i}') for i in range(start, stop))
+    if image_url:
+        ClerkUser.objects.bulk_create(
+            ClerkUser(user=user, clerk_id=f'user_{user.username}', profile_image_url=image_url)
+            for user in users
+        )
+    return users
@@ -0,0 +1,112 @@
+import asyncio
+import time
+import tracemalloc
+from datetime import timedelta
+import jwt
+from asgiref.sync import async_to_sync
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+from backend.benchmarks import RollbackBenchmark
+from chat.models import Chat, ChatMember
+from chat.pubsub import chat_channel, get_pubsub
+from chat.websocket import InProcessClient
+from games.models import Game
+from users.models import ClerkUser, Profile
+from users.tokens import verified_tokens
+
+class Command(BaseCommand):
+    help = (
+        'Opens many in-process chat WebSocket connections to one chat and reports connect '
+        'time, memory per connection and broadcast latency (all rows are rolled back)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, nargs='+', default=[100, 1000, 5000])
+
+    def handle(self, *args, **options):
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        public_pem = self.private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+
+        self.stdout.write(
+            f"{'sockets':>8} {'connect s':>10} {'KiB/socket':>11} {'broadcast ms':>13}"
+        )
+        with override_settings(CLERK_PUBLIC_KEY=public_pem):
+            for connections in options['connections']:
+                connect, per_socket, broadcast = self.measure(connections)
+                self.stdout.write(
+                    f"{connections:>8} {connect:>10.2f} {per_socket / 1024:>11.1f} {broadcast * 1000:>13.1f}"
+                )
+
+    def measure(self, connections):
+        try:
+            with transaction.atomic():
+                chat, tokens = self.seed(connections)
+                verified_tokens.clear()
+                result = async_to_sync(self.run)(chat, tokens)
+                raise RollbackBenchmark(result)
+        except RollbackBenchmark as result:
+            return result.args[0]
+
+    async def run(self, chat, tokens):
+        path = f'/ws/chats/{chat.pk}/'
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        clients = [InProcessClient(path, token) for token in tokens]
+        accepted = await asyncio.gather(*(client.connect(timeout=300) for client in clients))
+        connect = time.perf_counter() - started
+        per_socket = (tracemalloc.get_traced_memory()[0] - baseline) / len(clients)
+        tracemalloc.stop()
+        assert all(event['type'] == 'websocket.accept' for event in accepted)
+
+        started = time.perf_counter()
+        get_pubsub().publish(chat_channel(chat.pk), {'type': 'message', 'message': {'content': 'hi'}})
+        await asyncio.gather(*(client.receive(timeout=30) for client in clients))
+        broadcast = time.perf_counter() - started
+
+        await asyncio.gather(*(client.disconnect(timeout=60) for client in clients))
+        return connect, per_socket, broadcast
+
+    def seed(self, connections):
+        tag = f'sock{time.monotonic_ns()}'
+        users = User.objects.bulk_create(
+            User(username=f'{tag}_{i}') for i in range(connections)
+        )
+        ClerkUser.objects.bulk_create(
+            ClerkUser(user=user, clerk_id=f'user_{user.username}') for user in users
+        )
+        Profile.objects.bulk_create(
+            Profile(user=user, clerk_id=f'user_{user.username}') for user in users
+        )
+        game = Game.objects.create(
+            host=users[0],
+            title='Load test game',
+            location='Benchmark',
+            scheduled_time=timezone.now(),
+            buy_in=0,
+            slots=connections,
+            blinds=0
+        )
+        chat = Chat.objects.create(game=game)
+        ChatMember.objects.bulk_create(ChatMember(chat=chat, user=user) for user in users)
+
+        now = timezone.now()
+        tokens = [
+            jwt.encode({
+                'sub': f'user_{user.username}',
+                'iat': now,
+                'exp': now + timedelta(hours=1),
+                'iss': settings.CLERK_ISSUER,
+            }, self.private_key, algorithm='RS256')
+            for user in users
+        ]
+        return chat, tokens
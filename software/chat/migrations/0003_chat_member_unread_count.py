@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:07
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_unread_count(apps, schema_editor):
+    ChatMember = apps.get_model('chat', 'ChatMember')
+    Message = apps.get_model('chat', 'Message')
+    unread = Message.objects.filter(
+        chat=OuterRef('chat'),
+        created_at__gt=OuterRef('last_read')
+    ).exclude(
+        sender=OuterRef('user')
+    ).order_by().values('chat').annotate(c=Count('id')).values('c')
+    ChatMember.objects.update(
+        unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_chat_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmember',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_unread_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:09
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_changed_at(apps, schema_editor):
+    # Existing rows last changed when they were last read
+    ChatMember = apps.get_model('chat', 'ChatMember')
+    ChatMember.objects.update(changed_at=F('last_read'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_chat_member_unread_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmember',
+            name='changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_changed_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chatmember',
+            index=models.Index(fields=['chat', 'changed_at'], name='chat_member_changed_idx'),
+        ),
+    ]
@@ -1,9 +1,14 @@
-from django.db import models
+from collections import Counter, defaultdict
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, NullIf
 from django.contrib.auth.models import User
 from games.models import Game, GamePlayer
 from django.utils import timezone
 from django.db.models.signals import post_save, m2m_changed
 from django.dispatch import receiver
+from notifications.outbox import enqueue, handler
+from games.signals import games_archived
 
 from django.db import models
 from games.models import Game
@@ -21,14 +26,53 @@ class Chat(models.Model):
     def __str__(self):
         return f"Chat for {self.game.title}"
 
+    @classmethod
+    def for_member(cls, user):
+        """
+        Chats user belongs to, annotated with the member row's id, last_read
+        and unread_count (kept current by ChatMember.bump_unread)
+        """
+        return cls.objects.filter(members__user=user).annotate(
+            member_id=F('members__id'),
+            member_last_read=F('members__last_read'),
+            unread_count=F('members__unread_count')
+        )
+
+    @classmethod
+    def inbox(cls, user):
+        """
+        for_member() plus what the chat list shows: game title, host image,
+        member count and a preview of the last message, most recent first
+        """
+        last = Message.objects.filter(chat=OuterRef('pk')).order_by('-created_at', '-id')
+        members = ChatMember.objects.filter(
+            chat=OuterRef('pk')
+        ).order_by().values('chat').annotate(n=Count('pk')).values('n')
+        return cls.for_member(user).annotate(
+            game_title=F('game__title'),
+            image_url=Coalesce(
+                NullIf(F('game__host__profile__profile_image_url'), Value('')),
+                F('game__host__clerkuser__profile_image_url')
+            ),
+            member_count=Coalesce(Subquery(members), 0),
+            last_message_id=Subquery(last.values('id')[:1]),
+            last_message_content=Subquery(last.values('content')[:1]),
+            last_message_sender=Subquery(last.values('sender__username')[:1]),
+            last_message_at=Subquery(last.values('created_at')[:1]),
+            last_message_is_system=Subquery(last.values('is_system_message')[:1])
+        ).order_by(F('last_message_at').desc(nulls_last=True), '-id')
+
     def add_message(self, sender, content, is_system_message=False):
         """Helper method to add a message to the chat"""
-        return Message.objects.create(
+        message = Message.objects.create(
             chat=self,
             sender=sender,
             content=content,
             is_system_message=is_system_message
         )
+        ChatMember.bump_unread([message])
+        Message.publish([message])
+        return message
 
 class ChatMember(models.Model):
     chat = models.ForeignKey(
@@ -43,17 +87,42 @@ class ChatMember(models.Model):
     )
     joined_at = models.DateTimeField(auto_now_add=True)
     last_read = models.DateTimeField(default=timezone.now)
+    # Messages from others since last_read; bumped on insert, reset on read
+    unread_count = models.PositiveIntegerField(default=0)
+    # When the membership or its read state last changed; chat.sync reads it.
+    # Unread bumps do not touch it.
+    changed_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         unique_together = ('chat', 'user')
+        indexes = [
+            models.Index(fields=['chat', 'changed_at'], name='chat_member_changed_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} in {self.chat}"
 
     def mark_as_read(self):
-        """Mark all messages as read up to now"""
-        self.last_read = timezone.now()
-        self.save()
+        """Mark all messages as read up to now (see chat.receipts for the coalesced path)"""
+        self.last_read = self.changed_at = timezone.now()
+        self.unread_count = 0
+        self.save(update_fields=['last_read', 'unread_count', 'changed_at'])
+
+    @classmethod
+    def bump_unread(cls, messages):
+        """
+        Count new messages against every member except their sender. Runs
+        one UPDATE per distinct (sender, messages per chat) pair, so a batch
+        of one message in each of many chats is a single statement per sender.
+        """
+        per_chat = Counter((message.sender_id, message.chat_id) for message in messages)
+        groups = defaultdict(list)
+        for (sender_id, chat_id), count in per_chat.items():
+            groups[sender_id, count].append(chat_id)
+        for (sender_id, count), chat_ids in groups.items():
+            cls.objects.filter(chat_id__in=chat_ids).exclude(user_id=sender_id).update(
+                unread_count=F('unread_count') + count
+            )
 
 class Message(models.Model):
     chat = models.ForeignKey(
@@ -72,66 +141,140 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # History pages are range scans on this key (chat.pagination)
+            models.Index(fields=['chat', 'created_at', 'id'], name='message_chat_created_idx'),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender.username} in {self.chat}"
 
-# Signals
+    def as_event(self):
+        """The payload pushed to chat WebSockets (see chat.websocket)"""
+        return {
+            'type': 'message',
+            'message': {
+                'id': self.id,
+                'chat': self.chat_id,
+                'sender': {'id': self.sender_id, 'username': self.sender.username},
+                'content': self.content,
+                'created_at': self.created_at.isoformat(),
+                'is_system_message': self.is_system_message,
+            },
+        }
+
+    @staticmethod
+    def publish(messages):
+        """Push messages to connected members once the transaction commits"""
+        from .pubsub import chat_channel, get_pubsub
+
+        def push():
+            pubsub = get_pubsub()
+            for message in messages:
+                pubsub.publish(chat_channel(message.chat_id), message.as_event())
+        transaction.on_commit(push)
+
+# Signals: chat side effects of game changes are recorded in the outbox in
+# the same transaction and applied by the outbox worker (notifications.outbox)
 @receiver(post_save, sender=GamePlayer)
 def manage_chat_membership(sender, instance, created, **kwargs):
-    """Add/remove players from chat when they join/leave the game"""
+    """Add players to the chat when they join the game"""
     if created:
-        # Player joined the game
-        chat, _ = Chat.objects.get_or_create(game=instance.game)
-        member, member_created = ChatMember.objects.get_or_create(
-            chat=chat,
-            user=instance.user
+        enqueue(
+            'chat.join',
+            {'game_id': instance.game_id, 'user_id': instance.user_id},
+            key=f'chat.join:{instance.game_id}:{instance.user_id}'
         )
-        if member_created:
-            # Add system message only if this is a new member
-            chat.add_message(
-                sender=instance.user,
-                content=f"{instance.user.username} joined the game",
-                is_system_message=True
-            )
-    else:
-        # Handle player leaving in pre_delete signal
-        pass
 
 @receiver(post_save, sender=Game)
 def create_game_chat(sender, instance, created, **kwargs):
     """Create a chat when a game is created"""
     if created:
-        chat = Chat.objects.create(game=instance)
-        # Add host as first member
-        ChatMember.objects.create(chat=chat, user=instance.host)
+        enqueue('chat.create', {'game_id': instance.pk}, key=f'chat.create:{instance.pk}')
+
+@receiver(post_save, sender=Game)
+def handle_game_status_change(sender, instance, created, **kwargs):
+    """Handle game status changes"""
+    if not created and instance.tracker.has_changed('status') and \
+            instance.status in ['in_progress', 'completed']:
+        enqueue('chat.status', {'game_id': instance.pk, 'status': instance.status})
+
+@receiver(games_archived)
+def handle_games_archived(sender, game_ids, **kwargs):
+    """Announce the end of a chunk of archived games in their chats"""
+    enqueue('chat.archived', {'game_ids': game_ids})
+
+def _game_chat(game):
+    """The game's chat, created with the host as first member if missing"""
+    chat, created = Chat.objects.get_or_create(game=game)
+    if game.host_id:
+        ChatMember.objects.get_or_create(chat=chat, user_id=game.host_id)
+    return chat, created
+
+@handler('chat.create')
+def apply_chat_create(payload):
+    game = Game.objects.select_related('host').filter(pk=payload['game_id']).first()
+    if game is None:
+        return
+    chat, created = _game_chat(game)
+    if created and game.host:
         # Add system message
         chat.add_message(
-            sender=instance.host,
-            content=f"Game chat created by {instance.host.username}",
+            sender=game.host,
+            content=f"Game chat created by {game.host.username}",
             is_system_message=True
         )
 
-@receiver(post_save, sender=Game)
-def handle_game_status_change(sender, instance, **kwargs):
-    """Handle game status changes"""
-    if instance.tracker.has_changed('status'):
-        try:
-            chat = instance.chat
-            if instance.status == 'completed':
-                chat.add_message(
-                    sender=instance.host,
-                    content="Game has ended",
-                    is_system_message=True
-                )
-                # Schedule chat deletion (we'll implement this later)
-            elif instance.status == 'in_progress':
-                chat.add_message(
-                    sender=instance.host,
-                    content="Game has started",
-                    is_system_message=True
-                )
-        except Game.chat.RelatedObjectDoesNotExist:
-            # Chat doesn't exist yet, create it
-            chat = Chat.objects.create(game=instance)
-            ChatMember.objects.create(chat=chat, user=instance.host)
+@handler('chat.join')
+def apply_chat_join(payload):
+    game = Game.objects.filter(pk=payload['game_id']).first()
+    user = User.objects.filter(pk=payload['user_id']).first()
+    if game is None or user is None:
+        return
+    chat, _ = _game_chat(game)
+    member, member_created = ChatMember.objects.get_or_create(chat=chat, user=user)
+    if member_created:
+        # Add system message only if this is a new member
+        chat.add_message(
+            sender=user,
+            content=f"{user.username} joined the game",
+            is_system_message=True
+        )
+
+def open_game_chat(game, user):
+    """
+    Apply the game's chat.create, and user's chat.join if they hold a seat,
+    now instead of when the outbox worker gets to them, so a new game's chat
+    can be opened at once. The queued events then find nothing left to do.
+    """
+    with transaction.atomic():
+        if not Chat.objects.filter(game=game).exists():
+            apply_chat_create({'game_id': game.pk})
+        if GamePlayer.objects.filter(game=game, user=user).exists():
+            apply_chat_join({'game_id': game.pk, 'user_id': user.pk})
+
+@handler('chat.status')
+def apply_chat_status(payload):
+    game = Game.objects.select_related('host').filter(pk=payload['game_id']).first()
+    if game is None or game.host is None:
+        return
+    chat, _ = _game_chat(game)
+    content = "Game has ended" if payload['status'] == 'completed' else "Game has started"
+    chat.add_message(sender=game.host, content=content, is_system_message=True)
+
+@handler('chat.archived')
+def apply_chat_archived(payload):
+    games = Game.objects.filter(pk__in=payload['game_ids'], host__isnull=False)
+    chats = {chat.game_id: chat for chat in Chat.objects.filter(game__in=games)}
+    messages = []
+    for game in games.select_related('host'):
+        chat = chats.get(game.pk) or _game_chat(game)[0]
+        messages.append(Message(
+            chat=chat,
+            sender=game.host,
+            content="Game has ended",
+            is_system_message=True
+        ))
+    messages = Message.objects.bulk_create(messages)
+    ChatMember.bump_unread(messages)
+    Message.publish(messages)
@@ -0,0 +1,93 @@
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination for chat history over (created_at, id), backed by the
+    (chat, created_at, id) index on Message.
+
+    ?before=<message id> pages back through older messages, ?after=<message
+    id> fetches newer ones, and no cursor returns the newest page. Pages are
+    always returned oldest first. Every page is one indexed range scan of at
+    most page_size + 1 rows, so the cost does not grow with the chat's
+    history and no COUNT is run.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        before = self.get_cursor(request, 'before')
+        after = self.get_cursor(request, 'after')
+        if before is not None and after is not None:
+            raise ValidationError({'error': 'Use either before or after, not both'})
+
+        if after is not None:
+            created_at, pk = self.get_anchor(queryset, after)
+            rows = list(queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            ).order_by('created_at', 'id')[:page_size + 1])
+            self.has_older = True
+            self.has_newer = len(rows) > page_size
+            self.page = rows[:page_size]
+            return self.page
+
+        if before is not None:
+            created_at, pk = self.get_anchor(queryset, before)
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+        rows = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+        self.has_older = len(rows) > page_size
+        self.has_newer = before is not None
+        self.page = rows[:page_size][::-1]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_cursor(self, request, name):
+        value = request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({'error': f'{name} must be a message id'})
+
+    def get_anchor(self, queryset, pk):
+        anchor = queryset.filter(pk=pk).values_list('created_at', 'id').first()
+        if anchor is None:
+            raise NotFound(f'Message {pk} is not in this chat')
+        return anchor
+
+    def get_link(self, name, pk):
+        url = remove_query_param(self.request.build_absolute_uri(), 'before')
+        url = remove_query_param(url, 'after')
+        return replace_query_param(url, name, pk)
+
+    def get_next_link(self):
+        if not (self.has_newer and self.page):
+            return None
+        return self.get_link('after', self.page[-1].pk)
+
+    def get_previous_link(self):
+        if not (self.has_older and self.page):
+            return None
+        return self.get_link('before', self.page[0].pk)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
@@ -0,0 +1,100 @@
+"""
+Pub/sub used to push chat events to open WebSocket connections. One
+channel per chat ('chat.<id>'). The backend is chosen with
+CHAT_PUBSUB_BACKEND; InMemoryPubSub delivers within one process, which is
+enough for a single node and for tests. A multi-node deployment plugs in a
+backend with the same three methods on top of a shared broker.
+"""
+import asyncio
+import logging
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def chat_channel(chat_id):
+    return f'chat.{chat_id}'
+
+class PubSub:
+    """Interface every backend implements"""
+
+    def subscribe(self, channel):
+        """Return a Subscription whose queue receives the channel's messages"""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        """Deliver message to every subscriber; callable from sync code in any thread"""
+        raise NotImplementedError
+
+class Subscription:
+    """An asyncio queue bound to the event loop that is consuming it"""
+
+    def __init__(self, channel, max_pending):
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.loop = asyncio.get_running_loop()
+        self.dropped = 0
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A consumer this far behind reloads history when it catches up
+            self.dropped += 1
+
+class InMemoryPubSub(PubSub):
+    def __init__(self, max_pending=256):
+        self.max_pending = max_pending
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, self.max_pending)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # The consumer's loop has closed; it unsubscribes on its way out
+                logger.debug(f"Skipped closed subscriber on {channel}")
+        return len(subscribers)
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(subscribers) for subscribers in self._channels.values())
+
+def get_pubsub():
+    """The process-wide backend named by CHAT_PUBSUB_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = import_string(settings.CHAT_PUBSUB_BACKEND)()
+        return _backend
+
+def reset_pubsub():
+    global _backend
+    with _backend_lock:
+        _backend = None
@@ -0,0 +1,116 @@
+"""
+Coalesced read receipts. Opening a chat screen records a receipt in
+memory instead of writing the member row; the receipts pending in this
+process are written together in one UPDATE at most
+CHAT_READ_RECEIPT_MAX_DELAY seconds later, or as soon as
+CHAT_READ_RECEIPT_MAX_PENDING members are waiting. A burst of opens of the
+same chat costs one write. With a max delay of 0 receipts are written
+immediately.
+"""
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, Count, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.lookups import Exact
+from django.utils import timezone
+from .models import ChatMember, Message
+
+logger = logging.getLogger(__name__)
+
+def flush_receipts(receipts):
+    """
+    Write {member id: read at} in one UPDATE: last_read moves forward to the
+    receipt, changed_at marks the row for chat.sync, and unread_count is recounted from the messages that arrived
+    after it, so messages bumped in while the receipt waited still count.
+    """
+    if not receipts:
+        return 0
+    read_at = Case(
+        *[When(Exact(OuterRef('pk'), pk), then=Value(at)) for pk, at in receipts.items()]
+    )
+    unread = Message.objects.filter(
+        chat=OuterRef('chat'),
+        created_at__gt=Greatest(OuterRef('last_read'), read_at)
+    ).exclude(
+        sender=OuterRef('user')
+    ).order_by().values('chat').annotate(n=Count('pk')).values('n')
+    return ChatMember.objects.filter(pk__in=receipts).update(
+        last_read=Greatest('last_read', Case(
+            *[When(pk=pk, then=Value(at)) for pk, at in receipts.items()]
+        )),
+        unread_count=Coalesce(Subquery(unread), 0),
+        changed_at=Value(timezone.now())
+    )
+
+class ReadReceiptBuffer:
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    @property
+    def max_delay(self):
+        return settings.CHAT_READ_RECEIPT_MAX_DELAY
+
+    def record(self, member_id, at=None):
+        at = at or timezone.now()
+        if self.max_delay <= 0:
+            flush_receipts({member_id: at})
+            return
+        with self._lock:
+            if member_id not in self._pending or at > self._pending[member_id]:
+                self._pending[member_id] = at
+            full = len(self._pending) >= settings.CHAT_READ_RECEIPT_MAX_PENDING
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._run, name='read-receipts', daemon=True
+                )
+                self._flusher.start()
+        if full:
+            self.flush()
+
+    def pending(self):
+        """{member id: read at} not written yet"""
+        with self._lock:
+            return dict(self._pending)
+
+    def is_pending(self, member_id):
+        """Whether member_id has read the chat in this process since its last flush"""
+        with self._lock:
+            return member_id in self._pending
+
+    def flush(self):
+        with self._lock:
+            receipts, self._pending = self._pending, {}
+        try:
+            return flush_receipts(receipts)
+        except Exception:
+            # Put them back; a newer receipt for the same member wins
+            with self._lock:
+                for pk, at in receipts.items():
+                    if pk not in self._pending or at > self._pending[pk]:
+                        self._pending[pk] = at
+            raise
+
+    def _run(self):
+        while True:
+            time.sleep(self.max_delay)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush read receipts")
+            finally:
+                close_old_connections()
+
+read_receipts = ReadReceiptBuffer()
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        read_receipts.flush()
+    except Exception:
+        logger.exception("Failed to flush read receipts on exit")
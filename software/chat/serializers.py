@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Chat, ChatMember, Message
+from .receipts import read_receipts
 from users.serializers import UserSerializer
 from games.models import Game
 
@@ -15,7 +16,7 @@ class MessageSerializer(serializers.ModelSerializer):
     def get_is_from_me(self, obj):
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            return obj.sender == request.user
+            return obj.sender_id == request.user.id
         return False
 
 class ChatMemberSerializer(serializers.ModelSerializer):
@@ -26,24 +27,74 @@ class ChatMemberSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'joined_at', 'last_read']
         read_only_fields = ['joined_at']
 
+class SyncMessageSerializer(MessageSerializer):
+    class Meta(MessageSerializer.Meta):
+        fields = ['chat'] + MessageSerializer.Meta.fields
+
+class SyncMemberSerializer(ChatMemberSerializer):
+    """A member row from chat.sync; the unread count is only shown to its owner"""
+    unread_count = serializers.SerializerMethodField()
+
+    class Meta(ChatMemberSerializer.Meta):
+        fields = ['chat'] + ChatMemberSerializer.Meta.fields + ['unread_count']
+
+    def get_unread_count(self, obj):
+        if obj.user_id != self.context['request'].user.id:
+            return None
+        return obj.unread_count
+
+def unread_count(chat):
+    """The annotated count, or 0 while the member's read receipt waits to be flushed"""
+    if read_receipts.is_pending(chat.member_id):
+        return 0
+    return chat.unread_count
+
 class ChatSerializer(serializers.ModelSerializer):
-    messages = MessageSerializer(many=True, read_only=True)
     members = ChatMemberSerializer(many=True, read_only=True)
     unread_count = serializers.SerializerMethodField()
     game_title = serializers.SerializerMethodField()
     
     class Meta:
         model = Chat
-        fields = ['id', 'game', 'game_title', 'created_at', 'is_active', 'messages', 'members', 'unread_count']
+        fields = ['id', 'game', 'game_title', 'created_at', 'is_active', 'members', 'unread_count']
         read_only_fields = ['created_at', 'is_active']
 
     def get_unread_count(self, obj):
+        # Annotated by Chat.for_member()
+        if hasattr(obj, 'unread_count'):
+            return unread_count(obj)
         user = self.context['request'].user
         try:
-            member = obj.members.get(user=user)
-            return obj.messages.filter(created_at__gt=member.last_read).count()
+            return obj.members.get(user=user).unread_count
         except ChatMember.DoesNotExist:
             return 0
 
     def get_game_title(self, obj):
-        return obj.game.title if obj.game else None 
\ No newline at end of file
+        return obj.game.title if obj.game else None
+
+class ChatInboxSerializer(serializers.ModelSerializer):
+    """One chat list row, read entirely from the annotations of Chat.inbox()"""
+    game_title = serializers.CharField(read_only=True)
+    image_url = serializers.CharField(read_only=True)
+    member_count = serializers.IntegerField(read_only=True)
+    unread_count = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Chat
+        fields = ['id', 'game', 'game_title', 'image_url', 'created_at', 'is_active',
+                  'member_count', 'unread_count', 'last_message']
+
+    def get_unread_count(self, obj):
+        return unread_count(obj)
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            'id': obj.last_message_id,
+            'content': obj.last_message_content,
+            'sender': obj.last_message_sender,
+            'created_at': serializers.DateTimeField().to_representation(obj.last_message_at),
+            'is_system_message': obj.last_message_is_system,
+        }
@@ -0,0 +1,140 @@
+"""
+Delta sync across all of a user's chats. The client keeps one opaque cursor
+and asks for everything that changed after it: new messages, and member
+rows whose membership or read state changed (ChatMember.changed_at).
+Members are never removed from a chat, so there are no deletions to report.
+
+A poll with nothing new is a single query that probes each of the user's
+chats with two indexed range scans, (chat, created_at, id) on Message and
+(chat, changed_at) on ChatMember.
+
+The cursor holds a floor that trails the server clock by CHAT_SYNC_OVERLAP
+seconds, so that rows committed just after the poll by transactions that
+started before it are not skipped. Rows above the floor that were already
+delivered are listed in the cursor (message ids, and member ids with the
+changed_at that was sent) and left out of the next response, so nothing is
+sent twice. A backlog larger than CHAT_SYNC_LIMIT is paged on
+(created_at, id), which stays exact when many messages share a timestamp.
+"""
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .models import ChatMember, Message
+
+SyncResult = namedtuple('SyncResult', 'cursor messages members has_more')
+
+# floor: datetime; after: (created_at, id) of the last message of a page
+# or None; messages: {id: created_at} and members: {id: changed_at} of rows
+# above the floor that were already sent
+SyncCursor = namedtuple('SyncCursor', 'floor after messages members')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def _to_us(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+def _from_us(value):
+    return EPOCH + timedelta(microseconds=int(value))
+
+def encode_cursor(cursor):
+    data = {
+        'f': _to_us(cursor.floor),
+        'm': {pk: _to_us(moment) for pk, moment in cursor.messages.items()},
+        'c': {pk: _to_us(moment) for pk, moment in cursor.members.items()},
+    }
+    if cursor.after:
+        data['a'] = [_to_us(cursor.after[0]), cursor.after[1]]
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    return urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(value):
+    """The SyncCursor encoded in value; ValueError if it is not one"""
+    try:
+        data = json.loads(urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+        after = data.get('a')
+        return SyncCursor(
+            _from_us(data['f']),
+            (_from_us(after[0]), int(after[1])) if after else None,
+            {int(pk): _from_us(moment) for pk, moment in data['m'].items()},
+            {int(pk): _from_us(moment) for pk, moment in data['c'].items()},
+        )
+    except (binascii.Error, AttributeError, IndexError, KeyError, OverflowError, TypeError) as e:
+        raise ValueError('not a sync cursor') from e
+
+def new_messages(cursor):
+    """Messages the cursor has not seen"""
+    condition = Q(created_at__gt=cursor.floor)
+    if cursor.after:
+        created_at, pk = cursor.after
+        condition &= Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+    if cursor.messages:
+        condition &= ~Q(id__in=list(cursor.messages))
+    return condition
+
+def new_members(cursor):
+    """Member rows changed since the cursor saw them"""
+    condition = Q(changed_at__gt=cursor.floor)
+    for pk, changed_at in cursor.members.items():
+        condition &= ~Q(id=pk, changed_at=changed_at)
+    return condition
+
+def changed_chat_ids(user, cursor):
+    """Ids of the user's chats with a message or member change the cursor has not seen"""
+    return list(ChatMember.objects.filter(user=user).filter(
+        Q(Exists(Message.objects.filter(new_messages(cursor), chat=OuterRef('chat')))) |
+        Q(Exists(ChatMember.objects.filter(new_members(cursor), chat=OuterRef('chat'))))
+    ).values_list('chat_id', flat=True))
+
+def sync_changes(user, since=None, limit=None):
+    """
+    Changes after the since cursor, oldest first. At most limit messages
+    are returned; when there are more, has_more is set and the returned
+    cursor continues after the last message, with member changes held back
+    until the last page. Without since, nothing is returned but a starting
+    cursor: the initial state comes from the inbox and the paged messages
+    endpoint.
+    """
+    limit = limit or settings.CHAT_SYNC_LIMIT
+    floor = timezone.now() - timedelta(seconds=settings.CHAT_SYNC_OVERLAP)
+    if since is None:
+        return SyncResult(SyncCursor(floor, None, {}, {}), [], [], False)
+
+    chat_ids = changed_chat_ids(user, since)
+    messages = []
+    if chat_ids:
+        messages = list(
+            Message.objects.filter(new_messages(since), chat_id__in=chat_ids)
+            .select_related('sender__profile', 'sender__clerkuser')
+            .order_by('created_at', 'id')[:limit + 1]
+        )
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    sent = {**since.messages, **{message.id: message.created_at for message in messages}}
+
+    if has_more:
+        last = messages[-1]
+        sent = {pk: created_at for pk, created_at in sent.items() if created_at > floor}
+        cursor = SyncCursor(since.floor, (last.created_at, last.id), sent, since.members)
+        return SyncResult(cursor, messages, [], True)
+
+    members = []
+    if chat_ids:
+        members = list(
+            ChatMember.objects.filter(new_members(since), chat_id__in=chat_ids)
+            .select_related('user__profile', 'user__clerkuser')
+            .order_by('changed_at', 'id')
+        )
+    floor = max(floor, since.floor)
+    cursor = SyncCursor(
+        floor, None,
+        {pk: created_at for pk, created_at in sent.items() if created_at > floor},
+        {pk: changed_at for pk, changed_at in {
+            **since.members, **{member.id: member.changed_at for member in members}
+        }.items() if changed_at > floor},
+    )
+    return SyncResult(cursor, messages, members, False)
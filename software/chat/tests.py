@@ -1,3 +1,464 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from backend.testing import make_game, make_users
+from notifications import outbox
+from users.models import ClerkUser, Profile
+from users.tests import PUBLIC_PEM, make_token
+from users.tokens import verified_tokens
+from .models import Chat, ChatMember, Message, apply_chat_archived
+from .pubsub import InMemoryPubSub, get_pubsub
+from .receipts import read_receipts
+from .websocket import InProcessClient, CLOSE_FORBIDDEN, CLOSE_UNAUTHORIZED
+
+
+def make_clerk_user(username):
+    user = User.objects.create_user(username=username)
+    ClerkUser.objects.create(user=user, clerk_id=f'user_{username}')
+    Profile.objects.create(user=user, clerk_id=f'user_{username}')
+    return user
+
+
+@override_settings(CLERK_PUBLIC_KEY=PUBLIC_PEM)
+class ChatWebSocketTests(TransactionTestCase):
+    def setUp(self):
+        verified_tokens.clear()
+        cache.clear()
+        self.host = make_clerk_user('host')
+        self.player = make_clerk_user('player')
+        self.stranger = make_clerk_user('stranger')
+        game = make_game(self.host)
+        game.reserve_seat(self.player)
+        outbox.drain()
+        self.chat = Chat.objects.get(game=game)
+        self.path = f'/ws/chats/{self.chat.pk}/'
+
+    def test_members_receive_new_messages(self):
+        async def scenario():
+            socket = InProcessClient(self.path, make_token('user_player'))
+            self.assertEqual((await socket.connect())['type'], 'websocket.accept')
+
+            await socket.send_json({'type': 'ping'})
+            self.assertEqual(await socket.receive_json(), {'type': 'pong'})
+
+            # Posted elsewhere (e.g. the REST endpoint) and pushed to the socket
+            await sync_to_async(self.chat.add_message)(sender=self.host, content='Shuffle up and deal')
+            event = await socket.receive_json()
+            self.assertEqual(event['message']['content'], 'Shuffle up and deal')
+            self.assertEqual(event['message']['sender']['id'], self.host.id)
+
+            await socket.send_json({'type': 'message', 'content': 'gl all'})
+            event = await socket.receive_json()
+            self.assertEqual(event['message']['sender']['username'], 'player')
+            await socket.disconnect()
+        async_to_sync(scenario)()
+
+        self.assertTrue(Message.objects.filter(chat=self.chat, content='gl all').exists())
+        self.assertEqual(get_pubsub().subscriber_count(), 0)
+
+    def test_malformed_frames_get_an_error_and_keep_the_socket(self):
+        async def scenario():
+            socket = InProcessClient(self.path, make_token('user_player'))
+            await socket.connect()
+            for frame in ({'type': 'message'}, {'type': 'message', 'content': 42}, ['message']):
+                await socket.send_json(frame)
+                self.assertEqual((await socket.receive_json())['type'], 'error')
+            await socket.send_json({'type': 'ping'})
+            self.assertEqual(await socket.receive_json(), {'type': 'pong'})
+            await socket.disconnect()
+        async_to_sync(scenario)()
+        self.assertFalse(Message.objects.filter(chat=self.chat, is_system_message=False).exists())
+
+    def test_posting_to_a_deleted_chat_gets_an_error(self):
+        async def scenario():
+            socket = InProcessClient(self.path, make_token('user_player'))
+            await socket.connect()
+            await sync_to_async(self.chat.delete)()
+            await socket.send_json({'type': 'message', 'content': 'anyone here?'})
+            self.assertEqual(
+                await socket.receive_json(), {'type': 'error', 'error': 'This chat no longer exists'}
+            )
+            await socket.send_json({'type': 'ping'})
+            self.assertEqual(await socket.receive_json(), {'type': 'pong'})
+            await socket.disconnect()
+        async_to_sync(scenario)()
+
+    def test_connect_is_refused_for_strangers_and_bad_tokens(self):
+        async def close_code(token):
+            socket = InProcessClient(self.path, token)
+            return (await socket.connect()).get('code')
+
+        self.assertEqual(async_to_sync(close_code)(make_token('user_stranger')), CLOSE_FORBIDDEN)
+        self.assertEqual(async_to_sync(close_code)('not-a-token'), CLOSE_UNAUTHORIZED)
+        self.assertEqual(async_to_sync(close_code)(None), CLOSE_UNAUTHORIZED)
+
+
+class InMemoryPubSubTests(TestCase):
+    def test_publish_from_another_thread_reaches_each_subscriber(self):
+        pubsub = InMemoryPubSub(max_pending=2)
+
+        async def scenario():
+            first = pubsub.subscribe('chat.1')
+            second = pubsub.subscribe('chat.1')
+            other = pubsub.subscribe('chat.2')
+            thread = threading.Thread(target=pubsub.publish, args=('chat.1', {'n': 1}))
+            thread.start()
+            thread.join()
+            self.assertEqual(await asyncio.wait_for(first.queue.get(), 1), {'n': 1})
+            self.assertEqual(await asyncio.wait_for(second.queue.get(), 1), {'n': 1})
+            self.assertTrue(other.queue.empty())
+
+            # A subscriber that stops reading drops messages instead of growing
+            for n in range(5):
+                pubsub.publish('chat.1', {'n': n})
+            await asyncio.sleep(0)
+            self.assertEqual((first.queue.qsize(), first.dropped), (2, 3))
+            for subscription in (first, second, other):
+                pubsub.unsubscribe(subscription)
+            self.assertEqual(pubsub.subscriber_count(), 0)
+        async_to_sync(scenario)()
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='host')
+        self.player = User.objects.create_user(username='player')
+        self.chat = Chat.objects.create(game=make_game(self.host))
+        ChatMember.objects.bulk_create([
+            ChatMember(chat=self.chat, user=self.host),
+            ChatMember(chat=self.chat, user=self.player),
+        ])
+        self.url = f'/api/chat/chats/{self.chat.pk}/messages/'
+        self.client.force_login(self.player)
+
+    def seed(self, total):
+        Message.objects.bulk_create(
+            Message(chat=self.chat, sender=(self.host, self.player)[i % 2], content=f'm{i}')
+            for i in range(total)
+        )
+        # Give half the history one timestamp so paging has to break ties on id
+        ids = list(Message.objects.filter(chat=self.chat).values_list('id', flat=True))
+        Message.objects.filter(id__in=ids[:total // 2]).update(created_at=timezone.now())
+        return list(
+            Message.objects.filter(chat=self.chat)
+            .order_by('created_at', 'id').values_list('id', flat=True)
+        )
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+        return response.json(), len(ctx.captured_queries)
+
+    def test_scrolling_back_covers_history_at_constant_cost(self):
+        expected = self.seed(250)
+
+        body, newest_queries = self.get(f'{self.url}?page_size=40')
+        self.assertEqual([m['id'] for m in body['results']], expected[-40:])
+        self.assertIsNone(body['next'])
+        pages = [body['results']]
+        while body['previous']:
+            body, queries = self.get(body['previous'])
+            # One extra query resolves the cursor message
+            self.assertEqual(queries, newest_queries + 1)
+            pages.insert(0, body['results'])
+
+        seen = [m['id'] for page in pages for m in page]
+        self.assertEqual(seen, expected)
+        self.assertTrue(all(
+            m['is_from_me'] == (m['sender']['id'] == self.player.id)
+            for page in pages for m in page
+        ))
+
+    def test_after_returns_newer_messages(self):
+        expected = self.seed(30)
+        body, _ = self.get(f'{self.url}?after={expected[9]}&page_size=15')
+        self.assertEqual([m['id'] for m in body['results']], expected[10:25])
+        self.assertIn(f'after={expected[24]}', body['next'])
+
+        body, _ = self.get(body['next'])
+        self.assertEqual([m['id'] for m in body['results']], expected[25:])
+        self.assertIsNone(body['next'])
+        self.assertIn(f'before={expected[25]}', body['previous'])
+
+    def test_page_size_is_bounded_and_cursors_are_checked(self):
+        expected = self.seed(150)
+        body, _ = self.get(f'{self.url}?page_size=1000')
+        self.assertEqual(len(body['results']), 100)
+
+        other = Chat.objects.create(game=make_game(self.host))
+        foreign = Message.objects.create(chat=other, sender=self.host, content='elsewhere')
+        self.assertEqual(self.client.get(f'{self.url}?before={foreign.id}').status_code, 404)
+        self.assertEqual(self.client.get(f'{self.url}?before=abc').status_code, 400)
+        self.assertEqual(
+            self.client.get(f'{self.url}?before={expected[1]}&after={expected[0]}').status_code, 400
+        )
+
+
+class ChatInboxTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer')
+        self.client.force_login(self.viewer)
+
+    def seed(self, start, stop):
+        for host in make_users('host', start, stop, image_url='https://img.example/a.png'):
+            chat = Chat.objects.create(game=make_game(host, title=f'{host.username} game'))
+            ChatMember.objects.bulk_create([
+                ChatMember(chat=chat, user=host),
+                ChatMember(chat=chat, user=self.viewer),
+            ])
+            ChatMember.bump_unread(Message.objects.bulk_create(
+                Message(chat=chat, sender=host, content=f'{host.username} says {n}')
+                for n in range(3)
+            ))
+
+    def get_inbox(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/chat/chats/inbox/')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_inbox_uses_constant_queries(self):
+        self.seed(0, 3)
+        _, small = self.get_inbox()
+        self.seed(3, 40)
+        inbox, large = self.get_inbox()
+        self.assertEqual(len(inbox), 40)
+        self.assertEqual(large, small)
+
+    def test_inbox_rows(self):
+        self.seed(0, 2)
+        quiet, busy = Chat.objects.order_by('id')
+        ChatMember.objects.get(chat=busy, user=self.viewer).mark_as_read()
+        busy.add_message(sender=busy.game.host, content='Seat open')
+        busy.add_message(sender=self.viewer, content='Count me in')
+        ChatMember.objects.create(chat=busy, user=User.objects.create_user(username='third'))
+
+        inbox, _ = self.get_inbox()
+        self.assertEqual([row['id'] for row in inbox], [busy.id, quiet.id])
+        row = inbox[0]
+        self.assertEqual(row['game_title'], 'host1 game')
+        self.assertEqual(row['image_url'], 'https://img.example/a.png')
+        self.assertEqual(row['member_count'], 3)
+        self.assertEqual(row['unread_count'], 1)
+        self.assertEqual(row['last_message']['content'], 'Count me in')
+        self.assertEqual(row['last_message']['sender'], 'viewer')
+        self.assertEqual(inbox[1]['unread_count'], 3)
+
+        # The full chat no longer embeds its history
+        response = self.client.get(f'/api/chat/chats/{busy.id}/')
+        self.assertNotIn('messages', response.json())
+        self.assertEqual(response.json()['unread_count'], 1)
+
+
+class ReadReceiptTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='host')
+        self.player = User.objects.create_user(username='player')
+        self.chat = Chat.objects.create(game=make_game(self.host))
+        self.host_member, self.player_member = ChatMember.objects.bulk_create([
+            ChatMember(chat=self.chat, user=self.host),
+            ChatMember(chat=self.chat, user=self.player),
+        ])
+        self.url = f'/api/chat/chats/{self.chat.pk}/mark_as_read/'
+        self.client.force_login(self.player)
+
+    def tearDown(self):
+        read_receipts.flush()
+
+    def unread(self, member):
+        member.refresh_from_db()
+        return member.unread_count
+
+    def test_counters_follow_inserts_except_the_senders_own(self):
+        self.chat.add_message(sender=self.host, content='Seats are open')
+        self.chat.add_message(sender=self.host, content='Bring cash')
+        self.chat.add_message(sender=self.player, content='On my way')
+        self.assertEqual(self.unread(self.player_member), 2)
+        self.assertEqual(self.unread(self.host_member), 1)
+
+        apply_chat_archived({'game_ids': [self.chat.game_id]})
+        self.assertEqual(self.unread(self.player_member), 3)
+        self.assertEqual(self.unread(self.host_member), 1)
+
+    @override_settings(CHAT_READ_RECEIPT_MAX_DELAY=60)
+    def test_burst_of_reads_is_one_update(self):
+        self.chat.add_message(sender=self.host, content='Seats are open')
+        with CaptureQueriesContext(connection) as ctx:
+            for _ in range(5):
+                self.assertEqual(self.client.post(self.url).status_code, 204)
+        self.assertFalse(any(q['sql'].startswith('UPDATE') for q in ctx.captured_queries))
+        # Shown as read before the receipt reaches the database
+        inbox = self.client.get('/api/chat/chats/inbox/').json()
+        self.assertEqual(inbox[0]['unread_count'], 0)
+        self.assertEqual(self.unread(self.player_member), 1)
+
+        # Arrives after the receipt was taken, so it stays unread after the flush
+        self.chat.add_message(sender=self.host, content='Starting soon')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(read_receipts.flush(), 1)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(self.unread(self.player_member), 1)
+        self.assertGreater(self.player_member.last_read, self.player_member.joined_at)
+
+    @override_settings(CHAT_READ_RECEIPT_MAX_DELAY=60, CHAT_READ_RECEIPT_MAX_PENDING=2)
+    def test_pending_receipts_are_bounded(self):
+        self.chat.add_message(sender=self.player, content='Hi')
+        read_receipts.record(self.host_member.pk)
+        self.assertEqual(self.unread(self.host_member), 1)
+        read_receipts.record(self.player_member.pk)
+        self.assertEqual(read_receipts.pending(), {})
+        self.assertEqual(self.unread(self.host_member), 0)
+
+    @override_settings(CHAT_READ_RECEIPT_MAX_DELAY=0)
+    def test_zero_delay_writes_through(self):
+        self.chat.add_message(sender=self.host, content='Seats are open')
+        self.client.post(self.url)
+        self.assertEqual(self.unread(self.player_member), 0)
+        self.assertEqual(read_receipts.pending(), {})
+
+
+class GameChatTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='host')
+        self.player = User.objects.create_user(username='player')
+        self.game = make_game(self.host)
+        self.game.reserve_seat(self.player)
+
+    def open(self, user):
+        self.client.force_login(user)
+        return self.client.get('/api/chat/chats/game_chat/', {'game_id': self.game.pk})
+
+    def test_new_game_chat_opens_before_the_worker_runs(self):
+        self.assertEqual(self.open(self.host).status_code, 200)
+        response = self.open(self.player)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {m['user']['username'] for m in response.json()['members']}, {'host', 'player'}
+        )
+        stranger = User.objects.create_user(username='stranger')
+        self.assertEqual(self.open(stranger).status_code, 403)
+
+        # The queued events find the chat and seats already in place
+        outbox.drain()
+        chat = Chat.objects.get(game=self.game)
+        self.assertEqual(chat.members.count(), 2)
+        self.assertEqual(
+            list(chat.messages.values_list('content', flat=True)),
+            ['Game chat created by host', 'player joined the game']
+        )
+
+    def test_unknown_game_is_404(self):
+        self.client.force_login(self.host)
+        response = self.client.get('/api/chat/chats/game_chat/', {'game_id': 0})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CHAT_SYNC_OVERLAP=0, CHAT_READ_RECEIPT_MAX_DELAY=0)
+class ChatSyncTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='host')
+        self.viewer = User.objects.create_user(username='viewer')
+        self.chats = [Chat.objects.create(game=make_game(self.host)) for _ in range(3)]
+        # The viewer is in the first two chats only
+        ChatMember.objects.bulk_create(
+            [ChatMember(chat=chat, user=self.host) for chat in self.chats] +
+            [ChatMember(chat=chat, user=self.viewer) for chat in self.chats[:2]]
+        )
+        self.client.force_login(self.viewer)
+
+    def sync(self, watermark=None):
+        params = {'since': watermark} if watermark else {}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/chat/chats/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def drain(self, watermark):
+        """Follow has_more to the end: (message contents, last watermark)"""
+        contents = []
+        while True:
+            body, _ = self.sync(watermark)
+            contents.extend(m['content'] for m in body['messages'])
+            watermark = body['watermark']
+            if not body['has_more']:
+                return contents, watermark
+
+    def test_idle_poll_is_one_query(self):
+        body, baseline = self.sync()
+        self.assertEqual((body['messages'], body['members']), ([], []))
+        body, queries = self.sync(body['watermark'])
+        self.assertEqual((body['messages'], body['members']), ([], []))
+        self.assertEqual(queries, baseline + 1)
+
+    def test_returns_messages_members_and_read_state_since_watermark(self):
+        first, second, elsewhere = self.chats
+        watermark = self.sync()[0]['watermark']
+
+        first.add_message(sender=self.host, content='Seats are open')
+        elsewhere.add_message(sender=self.host, content='Not for you')
+        newcomer = User.objects.create_user(username='newcomer')
+        ChatMember.objects.create(chat=second, user=newcomer)
+        self.client.post(f'/api/chat/chats/{first.pk}/mark_as_read/')
+
+        body, _ = self.sync(watermark)
+        self.assertEqual(
+            [(m['chat'], m['content']) for m in body['messages']],
+            [(first.pk, 'Seats are open')]
+        )
+        members = {(m['chat'], m['user']['username']): m for m in body['members']}
+        self.assertEqual(set(members), {(second.pk, 'newcomer'), (first.pk, 'viewer')})
+        self.assertEqual(members[first.pk, 'viewer']['unread_count'], 0)
+        self.assertIsNone(members[second.pk, 'newcomer']['unread_count'])
+
+        body, _ = self.sync(body['watermark'])
+        self.assertEqual((body['messages'], body['members']), ([], []))
+
+    @override_settings(CHAT_SYNC_LIMIT=2)
+    def test_large_backlog_is_paged(self):
+        watermark = self.sync()[0]['watermark']
+        for n in range(5):
+            self.chats[n % 2].add_message(sender=self.host, content=f'm{n}')
+
+        self.assertEqual(self.drain(watermark)[0], [f'm{n}' for n in range(5)])
+
+    @override_settings(CHAT_SYNC_LIMIT=2)
+    def test_paging_through_messages_sharing_a_timestamp(self):
+        watermark = self.sync()[0]['watermark']
+        for n in range(5):
+            self.chats[0].add_message(sender=self.host, content=f'm{n}')
+        Message.objects.update(created_at=timezone.now())
+
+        self.assertEqual(self.drain(watermark)[0], [f'm{n}' for n in range(5)])
+
+    @override_settings(CHAT_SYNC_OVERLAP=60)
+    def test_overlap_window_is_not_sent_twice(self):
+        watermark = self.sync()[0]['watermark']
+        self.chats[0].add_message(sender=self.host, content='once')
+        self.client.post(f'/api/chat/chats/{self.chats[0].pk}/mark_as_read/')
+
+        contents, watermark = self.drain(watermark)
+        self.assertEqual(contents, ['once'])
+        body, _ = self.sync(watermark)
+        self.assertEqual((body['messages'], body['members']), ([], []))
+
+        # A member row changed again inside the window is sent again
+        self.chats[0].add_message(sender=self.host, content='twice')
+        self.client.post(f'/api/chat/chats/{self.chats[0].pk}/mark_as_read/')
+        body, _ = self.sync(body['watermark'])
+        self.assertEqual([m['content'] for m in body['messages']], ['twice'])
+        self.assertEqual([m['user']['username'] for m in body['members']], ['viewer'])
+
+    def test_rejects_malformed_watermark(self):
+        response = self.client.get('/api/chat/chats/sync/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
@@ -2,9 +2,14 @@ from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Chat, ChatMember, Message
-from .serializers import ChatSerializer, MessageSerializer
-from django.shortcuts import get_object_or_404
+from .models import Chat, ChatMember, Message, open_game_chat
+from .pagination import MessageCursorPagination
+from .receipts import read_receipts
+from .serializers import (
+    ChatInboxSerializer, ChatSerializer, MessageSerializer, SyncMemberSerializer, SyncMessageSerializer
+)
+from .sync import decode_cursor, encode_cursor, sync_changes
+from rest_framework.generics import get_object_or_404
 from games.models import Game
 
 class ChatViewSet(viewsets.ModelViewSet):
@@ -13,8 +18,51 @@ class ChatViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # Return only chats that the user is a member of
+        if self.action in ('list', 'retrieve'):
+            return self.with_related(Chat.for_member(self.request.user))
         return Chat.objects.filter(members__user=self.request.user)
 
+    @staticmethod
+    def with_related(queryset):
+        return queryset.select_related('game').prefetch_related(
+            'members__user__profile', 'members__user__clerkuser'
+        )
+
+    @action(detail=False, methods=['get'])
+    def inbox(self, request):
+        """
+        The chat list: per chat the game title, last message preview, member
+        count and unread count, in one query. History comes from messages/.
+        """
+        serializer = ChatInboxSerializer(Chat.inbox(request.user), many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        Everything that changed in the user's chats after ?since=<watermark>:
+        new messages and member rows whose membership or read state changed,
+        plus the watermark (an opaque cursor) to send next time. See chat.sync.
+        """
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = decode_cursor(since)
+            except ValueError:
+                return Response(
+                    {"error": "since must be a watermark returned by this endpoint"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        result = sync_changes(request.user, since)
+        context = {'request': request}
+        return Response({
+            'watermark': encode_cursor(result.cursor),
+            'messages': SyncMessageSerializer(result.messages, many=True, context=context).data,
+            'members': SyncMemberSerializer(result.members, many=True, context=context).data,
+            'has_more': result.has_more,
+        })
+
     @action(detail=True, methods=['post'])
     def send_message(self, request, pk=None):
         chat = self.get_object()
@@ -44,13 +92,14 @@ class ChatViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
-        chat = self.get_object()
-        member = get_object_or_404(ChatMember, chat=chat, user=request.user)
-        member.mark_as_read()
+        """Recorded as a coalesced read receipt; see chat.receipts"""
+        member = get_object_or_404(ChatMember.objects.only('id'), chat_id=pk, user=request.user)
+        read_receipts.record(member.pk)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
+        """Chat history, newest page first; see MessageCursorPagination"""
         chat = self.get_object()
         if not chat.members.filter(user=request.user).exists():
             return Response(
@@ -58,14 +107,11 @@ class ChatViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        messages = chat.messages.all()
-        page = self.paginate_queryset(messages)
-        if page is not None:
-            serializer = MessageSerializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
-
-        serializer = MessageSerializer(messages, many=True, context={'request': request})
-        return Response(serializer.data)
+        messages = chat.messages.select_related('sender__profile', 'sender__clerkuser')
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(messages, request, view=self)
+        serializer = MessageSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def game_chat(self, request):
@@ -78,23 +124,24 @@ class ChatViewSet(viewsets.ModelViewSet):
 
         try:
             game = Game.objects.get(id=game_id)
-            chat = Chat.objects.get(game=game)
-            
-            if not chat.members.filter(user=request.user).exists():
-                return Response(
-                    {"error": "You are not a member of this chat"},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-
-            serializer = self.get_serializer(chat)
-            return Response(serializer.data)
         except Game.DoesNotExist:
             return Response(
                 {"error": f"Game with id {game_id} does not exist"},
                 status=status.HTTP_404_NOT_FOUND
             )
-        except Chat.DoesNotExist:
+
+        chats = self.with_related(Chat.for_member(request.user)).filter(game=game)
+        chat = chats.first()
+        if chat is None:
+            # The chat of a new game, or this player's seat in it, may still
+            # be waiting for the outbox worker
+            open_game_chat(game, request.user)
+            chat = chats.first()
+        if chat is None:
             return Response(
-                {"error": f"Chat for game {game_id} does not exist"},
-                status=status.HTTP_404_NOT_FOUND
+                {"error": "You are not a member of this chat"},
+                status=status.HTTP_403_FORBIDDEN
             )
+
+        serializer = self.get_serializer(chat)
+        return Response(serializer.data)
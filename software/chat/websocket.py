@@ -0,0 +1,146 @@
+"""
+WebSocket endpoint for live game chat, served by backend/asgi.py next to
+the Django HTTP application: ws(s)://<host>/ws/chats/<chat id>/
+
+The client authenticates with its Clerk session token, either in an
+Authorization: Bearer header or as ?token=. The token and the chat
+membership are checked once, when the socket connects. After that the
+socket is subscribed to the chat's pub/sub channel and receives every new
+message as {"type": "message", "message": {...}}. Clients can send
+{"type": "message", "content": "..."} to post, and {"type": "ping"}. A frame
+that cannot be applied is answered with {"type": "error", "error": "..."}
+and the socket stays open.
+"""
+import asyncio
+import json
+import logging
+import re
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from .models import Chat, ChatMember
+from .pubsub import chat_channel, get_pubsub
+
+logger = logging.getLogger(__name__)
+
+PATH = re.compile(r'^/ws/chats/(?P<chat_id>\d+)/?$')
+
+# Close codes in the application range (4000-4999)
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+
+def socket_token(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'authorization' and value.startswith(b'Bearer '):
+            return value[len(b'Bearer '):].decode()
+    query = parse_qs(scope.get('query_string', b'').decode())
+    return query.get('token', [None])[0]
+
+def authorize(token, chat_id):
+    """(user, None) for a member of chat_id, else (None, close code)"""
+    from users.backends import ClerkAuthBackend
+
+    if not token:
+        return None, CLOSE_UNAUTHORIZED
+    user = ClerkAuthBackend().resolve(token).user
+    if user is None:
+        return None, CLOSE_UNAUTHORIZED
+    if not ChatMember.objects.filter(chat_id=chat_id, user=user).exists():
+        return None, CLOSE_FORBIDDEN
+    return user, None
+
+def post_message(chat_id, user, content):
+    chat = Chat.objects.get(pk=chat_id)
+    return chat.add_message(sender=user, content=content)
+
+async def chat_socket(scope, receive, send):
+    """ASGI application for one chat WebSocket connection"""
+    match = PATH.match(scope['path'])
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    if match is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+
+    chat_id = int(match['chat_id'])
+    user, close_code = await sync_to_async(authorize)(socket_token(scope), chat_id)
+    if user is None:
+        await send({'type': 'websocket.close', 'code': close_code})
+        return
+
+    pubsub = get_pubsub()
+    subscription = pubsub.subscribe(chat_channel(chat_id))
+    await send({'type': 'websocket.accept'})
+
+    async def send_json(payload):
+        await send({'type': 'websocket.send', 'text': json.dumps(payload)})
+
+    async def push():
+        while True:
+            await send_json(await subscription.queue.get())
+
+    pusher = asyncio.create_task(push())
+    try:
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+            if event['type'] != 'websocket.receive':
+                continue
+            try:
+                data = json.loads(event.get('text') or '{}')
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                await send_json({'type': 'error', 'error': 'Frames must be JSON objects'})
+            elif data.get('type') == 'ping':
+                await send_json({'type': 'pong'})
+            elif data.get('type') == 'message':
+                content = data.get('content')
+                if not isinstance(content, str) or not content.strip():
+                    await send_json({'type': 'error', 'error': 'Message content is required'})
+                    continue
+                try:
+                    # Delivered back to this socket through the channel like everyone else's
+                    await sync_to_async(post_message)(chat_id, user, content)
+                except Chat.DoesNotExist:
+                    await send_json({'type': 'error', 'error': 'This chat no longer exists'})
+    finally:
+        pusher.cancel()
+        pubsub.unsubscribe(subscription)
+
+class InProcessClient:
+    """
+    Drives chat_socket in-process the way an ASGI server would, without a
+    network socket. Used by the tests and the chat_socket_load_test command.
+    """
+    def __init__(self, path, token=None):
+        self.scope = {
+            'type': 'websocket',
+            'path': path,
+            'query_string': f'token={token}'.encode() if token else b'',
+            'headers': [],
+        }
+        self.to_app = asyncio.Queue()
+        self.from_app = asyncio.Queue()
+        self.task = None
+
+    async def connect(self, timeout=2):
+        """Open the connection; returns the accept or close event"""
+        self.task = asyncio.create_task(chat_socket(self.scope, self.to_app.get, self.from_app.put))
+        await self.to_app.put({'type': 'websocket.connect'})
+        return await self.receive(timeout)
+
+    async def receive(self, timeout=2):
+        return await asyncio.wait_for(self.from_app.get(), timeout)
+
+    async def receive_json(self, timeout=2):
+        return json.loads((await self.receive(timeout))['text'])
+
+    async def send_json(self, data):
+        await self.to_app.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def disconnect(self, timeout=2):
+        await self.to_app.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, timeout)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FriendsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'friends'
+
+    def ready(self):
+        import friends.signals
+        import friends.suggestions  # Registers the 'suggestions.*' outbox handlers
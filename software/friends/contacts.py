@@ -0,0 +1,109 @@
+"""
+Contact matching and bulk friend requests for onboarding. The client uploads
+its address book as hashed phone numbers (users.models.hash_phone: SHA-256
+of the digits) and/or usernames; they are matched against the partial
+index on Profile.phone_hash and username in two queries, and a request is
+sent to every matched user who is not already a friend or in a request with
+the sender.
+
+All requests and their notifications are written with one bulk insert each
+inside a single transaction, so a whole address book costs the same number
+of queries as one contact. Requests that lost a race with a concurrent one
+are reported as already requested.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from notifications.models import Notification
+from users.models import Profile
+from .models import FriendRequest
+
+MAX_CONTACTS = 500
+
+# Per-contact outcomes
+SENT = 'sent'
+MATCHED = 'matched'
+NOT_FOUND = 'not_found'
+SELF = 'self'
+FRIENDS = 'already_friends'
+REQUESTED = 'already_requested'
+
+def match_contacts(phone_hashes=(), usernames=()):
+    """
+    [(kind, value, user id or None)] in input order, kind being 'phone' or
+    'username'. A phone number shared by several accounts matches the
+    oldest one.
+    """
+    by_hash = {}
+    if phone_hashes:
+        for phone_hash, user_id in Profile.objects.filter(
+            phone_hash__in=set(phone_hashes)
+        ).order_by('-user_id').values_list('phone_hash', 'user_id'):
+            by_hash[phone_hash] = user_id
+    by_username = {}
+    if usernames:
+        by_username = dict(
+            User.objects.filter(username__in=set(usernames)).values_list('username', 'id')
+        )
+    return [
+        ('phone', value, by_hash.get(value)) for value in phone_hashes
+    ] + [
+        ('username', value, by_username.get(value)) for value in usernames
+    ]
+
+def send_requests(sender, phone_hashes=(), usernames=(), send=True):
+    """
+    Match the contacts and, if send, create a pending request and a
+    notification for every newly matched user. Returns
+    [(kind, value, user id or None, status)] in input order.
+    """
+    matches = match_contacts(phone_hashes, usernames)
+    targets = {user_id for _, _, user_id in matches if user_id not in (None, sender.pk)}
+
+    with transaction.atomic():
+        # Existing requests in either direction, read in the same transaction
+        # as the inserts so the unique (sender, receiver) check holds
+        existing = {}
+        if targets:
+            for sender_id, receiver_id, status in FriendRequest.objects.filter(
+                Q(sender=sender, receiver_id__in=targets) |
+                Q(sender_id__in=targets, receiver=sender)
+            ).values_list('sender_id', 'receiver_id', 'status'):
+                other = receiver_id if sender_id == sender.pk else sender_id
+                if existing.get(other) != FRIENDS:
+                    existing[other] = FRIENDS if status == 'accepted' else REQUESTED
+
+        new = sorted(targets - existing.keys())
+        if send and new:
+            # A concurrent request for the same pair may commit first; its row
+            # stands in for ours rather than failing the whole batch
+            requests = FriendRequest.objects.bulk_create(
+                [FriendRequest(sender=sender, receiver_id=user_id) for user_id in new],
+                ignore_conflicts=True
+            )
+            # bulk_create stamped created_at on our objects; a row that kept
+            # another stamp was not ours, so its receiver is not notified
+            stamps = {request.receiver_id: request.created_at for request in requests}
+            for receiver_id, created_at in FriendRequest.objects.filter(
+                sender=sender, receiver_id__in=new
+            ).values_list('receiver_id', 'created_at'):
+                if created_at != stamps[receiver_id]:
+                    existing[receiver_id] = REQUESTED
+            new = [user_id for user_id in new if user_id not in existing]
+            Notification.fan_out(
+                new,
+                type='FRIEND_REQUEST',
+                title='New Friend Request',
+                message=f'{sender.username} sent you a friend request'
+            )
+
+    results = []
+    for kind, value, user_id in matches:
+        if user_id is None:
+            status = NOT_FOUND
+        elif user_id == sender.pk:
+            status = SELF
+        else:
+            status = existing.get(user_id, SENT if send else MATCHED)
+        results.append((kind, value, user_id, status))
+    return results
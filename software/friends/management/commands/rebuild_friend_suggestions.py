@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from friends.suggestions import rebuild_suggestions
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the friend suggestion index from the friendship and game player '
+        'tables; run it periodically (e.g. nightly from cron) to correct drift'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Only rebuild this user id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Users rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = rebuild_suggestions(options['user_ids'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} friend suggestions in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_edges(apps, schema_editor):
+    # Accepted friendships from both old stores: friend requests and the
+    # unused games.Friendship table. Edges are only ever removed by deleting
+    # or declining a FriendRequest, so every games.Friendship pair first
+    # gets an accepted request of its own.
+    Friendship = apps.get_model('friends', 'Friendship')
+    FriendRequest = apps.get_model('friends', 'FriendRequest')
+    GameFriendship = apps.get_model('games', 'Friendship')
+
+    requests = {
+        (sender_id, receiver_id): (pk, status)
+        for pk, sender_id, receiver_id, status in FriendRequest.objects.values_list(
+            'pk', 'sender_id', 'receiver_id', 'status'
+        )
+    }
+    to_accept, to_create = set(), []
+    for a, b in set(
+        GameFriendship.objects.filter(status='accepted').values_list('user1_id', 'user2_id')
+    ):
+        existing = [requests[pair] for pair in ((a, b), (b, a)) if pair in requests]
+        if a == b or any(status == 'accepted' for _, status in existing):
+            continue
+        if existing:
+            pk = existing[0][0]
+            to_accept.add(pk)
+        else:
+            pk = None
+            to_create.append(FriendRequest(sender_id=a, receiver_id=b, status='accepted'))
+        requests[a, b] = (pk, 'accepted')
+    FriendRequest.objects.filter(pk__in=to_accept).update(status='accepted')
+    FriendRequest.objects.bulk_create(to_create, batch_size=1000)
+
+    pairs = set(
+        FriendRequest.objects.filter(status='accepted').values_list('sender_id', 'receiver_id')
+    )
+    Friendship.objects.bulk_create(
+        [Friendship(user_id=a, friend_id=b) for a, b in pairs if a != b] +
+        [Friendship(user_id=b, friend_id=a) for a, b in pairs if a != b],
+        ignore_conflicts=True,
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('friends', '0001_initial'),
+        ('games', '0006_user_daily_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('friend', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friend_edges', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'friend'), name='friendship_edge_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_edges, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,79 @@
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.db.models import Q
+from model_utils import FieldTracker
+
+def _user_id(user):
+    return getattr(user, 'pk', user)
+
+class Friendship(models.Model):
+    """
+    An accepted friendship, stored as two directed edges (a -> b and b -> a)
+    so that a user's friends and "are a and b friends" are both prefix
+    lookups on the (user, friend) unique index, with no OR over two
+    orientations. Kept in step with FriendRequest by friends.signals.
+    """
+    user = models.ForeignKey(User, related_name='friend_edges', on_delete=models.CASCADE)
+    friend = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'friend'], name='friendship_edge_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} <-> {self.friend_id}"
+
+    @staticmethod
+    def cache_key(user_id):
+        return f'friends:ids:{user_id}'
+
+    @classmethod
+    def link(cls, user1, user2):
+        a, b = _user_id(user1), _user_id(user2)
+        cls.objects.bulk_create(
+            [cls(user_id=a, friend_id=b), cls(user_id=b, friend_id=a)],
+            ignore_conflicts=True
+        )
+        cls.forget(a, b)
+
+    @classmethod
+    def unlink(cls, user1, user2):
+        a, b = _user_id(user1), _user_id(user2)
+        cls.objects.filter(
+            Q(user_id=a, friend_id=b) | Q(user_id=b, friend_id=a)
+        ).delete()
+        cls.forget(a, b)
+
+    @classmethod
+    def forget(cls, *user_ids):
+        """
+        Drop the cached sets now, for reads later in this transaction, and
+        again once it commits: a concurrent reader may re-cache the old set
+        in between and would otherwise serve it until the timeout.
+        """
+        keys = [cls.cache_key(user_id) for user_id in user_ids]
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @classmethod
+    def friend_ids(cls, user):
+        """frozenset of the user's friends' ids, cached until a friendship of theirs changes"""
+        key = cls.cache_key(_user_id(user))
+        ids = cache.get(key)
+        if ids is None:
+            ids = frozenset(
+                cls.objects.filter(user_id=_user_id(user)).values_list('friend_id', flat=True)
+            )
+            cache.set(key, ids, settings.FRIEND_IDS_CACHE_TIMEOUT)
+        return ids
+
+    @classmethod
+    def are_friends(cls, user1, user2):
+        return _user_id(user2) in cls.friend_ids(user1)
 
 class FriendRequest(models.Model):
     sender = models.ForeignKey(User, related_name='sent_requests', on_delete=models.CASCADE)
@@ -15,6 +88,7 @@ class FriendRequest(models.Model):
         default='pending'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    tracker = FieldTracker(fields=['status'])
 
     class Meta:
         unique_together = ('sender', 'receiver')
@@ -25,7 +99,36 @@ class FriendRequest(models.Model):
 
     @classmethod
     def are_friends(cls, user1, user2):
-        return cls.objects.filter(
-            (Q(sender=user1, receiver=user2) | Q(sender=user2, receiver=user1)),
-            status='accepted'
-        ).exists()
\ No newline at end of file
+        return Friendship.are_friends(user1, user2)
+
+    @classmethod
+    def friend_ids(cls, user):
+        """Ids of every user with an accepted request to or from user"""
+        return set(Friendship.friend_ids(user))
+
+class FriendSuggestion(models.Model):
+    """
+    A precomputed "people you may know" row: candidate is not yet a friend of
+    user, and is ranked by score, a weighted sum of mutual friends and games
+    both have played in. friends.suggestions patches the counts as
+    friendships are accepted and players join games; rebuild everything with
+    `manage.py rebuild_friend_suggestions`.
+    """
+    user = models.ForeignKey(User, related_name='friend_suggestions', on_delete=models.CASCADE)
+    candidate = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    mutual_friends = models.PositiveIntegerField(default=0)
+    shared_games = models.PositiveIntegerField(default=0)
+    score = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'candidate'], name='friend_suggestion_unique'),
+        ]
+        indexes = [
+            # Top-K per user is a prefix scan in rank order
+            models.Index(fields=['user', '-score', 'candidate'], name='friend_suggestion_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.candidate_id} for {self.user_id} ({self.score})"
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+class FriendCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (username, id) for friends lists. username is
+    unique and indexed, so each page is a range scan from an opaque cursor
+    and page N costs the same as page 1.
+    """
+    ordering = ('username', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
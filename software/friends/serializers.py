@@ -1,19 +1,35 @@
 from rest_framework import serializers
-from django.contrib.auth.models import User
-from .models import FriendRequest
-from users.serializers import ProfileSerializer
+from .models import FriendRequest, FriendSuggestion
+from users.serializers import UserSerializer
+
+# Related rows a user card reads its avatar from
+CARD_RELATED = ('profile', 'clerkuser')
+
+class UserCardSerializer(UserSerializer):
+    """
+    The compact user shown by friend endpoints: id, username and avatar.
+    poker_stats is added only when the view loaded them in bulk into
+    context['stats'] ({user id: stats}, see FriendViewSet.card_context).
+    """
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        stats = self.context.get('stats')
+        if stats is not None:
+            data['poker_stats'] = stats.get(instance.id)
+        return data
 
 class FriendRequestSerializer(serializers.ModelSerializer):
-    sender = ProfileSerializer(source='sender.profile', read_only=True)
-    receiver = ProfileSerializer(source='receiver.profile', read_only=True)
+    sender = UserCardSerializer(read_only=True)
+    receiver = UserCardSerializer(read_only=True)
     
     class Meta:
         model = FriendRequest
         fields = ['id', 'sender', 'receiver', 'status', 'created_at']
         read_only_fields = ['status', 'created_at']
 
-class FriendListSerializer(serializers.ModelSerializer):
+class FriendSuggestionSerializer(serializers.ModelSerializer):
+    user = UserCardSerializer(source='candidate', read_only=True)
+
     class Meta:
-        model = User
-        fields = ['id', 'username', 'profile']
-        depth = 1
\ No newline at end of file
+        model = FriendSuggestion
+        fields = ['user', 'mutual_friends', 'shared_games']
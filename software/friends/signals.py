@@ -0,0 +1,51 @@
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from games.models import GamePlayer
+from notifications.outbox import enqueue
+from .models import FriendRequest, Friendship
+
+def _friendship_changed(friend_request):
+    # Patched into the suggestion index by friends.suggestions
+    enqueue('suggestions.friendship', {
+        'user_id': friend_request.sender_id,
+        'friend_id': friend_request.receiver_id,
+    })
+
+def _unlink_unless_still_friends(friend_request):
+    # Both users may have sent each other a request that was accepted; the
+    # friendship lasts until neither of them is accepted any more
+    a, b = friend_request.sender_id, friend_request.receiver_id
+    if FriendRequest.objects.filter(
+        Q(sender_id=a, receiver_id=b) | Q(sender_id=b, receiver_id=a),
+        status='accepted'
+    ).exclude(pk=friend_request.pk).exists():
+        return
+    Friendship.unlink(a, b)
+    _friendship_changed(friend_request)
+
+@receiver(post_save, sender=FriendRequest)
+def sync_friendship(sender, instance, created, **kwargs):
+    """Add the friendship edges when a request is accepted, drop them if it is undone"""
+    if not (created or instance.tracker.has_changed('status')):
+        return
+    if instance.status == 'accepted':
+        Friendship.link(instance.sender_id, instance.receiver_id)
+        _friendship_changed(instance)
+    elif not created and instance.tracker.previous('status') == 'accepted':
+        _unlink_unless_still_friends(instance)
+
+@receiver(post_delete, sender=FriendRequest)
+def remove_friendship(sender, instance, **kwargs):
+    if instance.status == 'accepted':
+        _unlink_unless_still_friends(instance)
+
+@receiver(post_save, sender=GamePlayer)
+def record_game_join(sender, instance, created, **kwargs):
+    """Players who share a game become better suggestions for each other"""
+    if created:
+        enqueue(
+            'suggestions.join',
+            {'game_id': instance.game_id, 'user_id': instance.user_id},
+            key=f'suggestions.join:{instance.game_id}:{instance.user_id}'
+        )
@@ -0,0 +1,167 @@
+"""
+Maintenance of friends.FriendSuggestion, the "people you may know" index.
+A candidate's score is a weighted sum of the friends they have in common
+with the user and the games both have played in; friends themselves are
+never suggested.
+
+friends.signals records accepted or removed friendships and game joins in
+the outbox, and the handlers here recompute only the rows those changes
+touch instead of re-walking the graph. They run in the worker process,
+whose Friendship.friend_ids cache is not cleared by writes in the web
+processes, so they read friend sets from the table (current_friend_ids).
+rebuild_suggestions recomputes rows from the raw friendship and player
+tables; run `manage.py rebuild_friend_suggestions` periodically to correct
+drift, e.g. from players leaving games.
+"""
+from collections import defaultdict
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Q
+from games.models import GamePlayer
+from notifications.outbox import handler
+from .models import Friendship, FriendSuggestion
+
+MUTUAL_FRIEND_WEIGHT = 3
+SHARED_GAME_WEIGHT = 1
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+
+def score_of(mutual_friends, shared_games):
+    return mutual_friends * MUTUAL_FRIEND_WEIGHT + shared_games * SHARED_GAME_WEIGHT
+
+def top_suggestions(user, limit=DEFAULT_LIMIT):
+    """The user's best-ranked candidates, read from the precomputed rows"""
+    return list(
+        FriendSuggestion.objects.filter(user=user)
+        .exclude(candidate_id__in=Friendship.friend_ids(user))
+        .select_related('candidate__profile', 'candidate__clerkuser')
+        .order_by('-score', 'candidate_id')[:min(limit, MAX_LIMIT)]
+    )
+
+def current_friend_ids(user_id):
+    """The user's friends as committed, bypassing the per-process cache"""
+    return set(Friendship.objects.filter(user_id=user_id).values_list('friend_id', flat=True))
+
+def compute_suggestions(user_ids):
+    """{(user id, candidate id): [mutual friends, shared games]} from the raw rows"""
+    friends = defaultdict(set)
+    for user_id, friend_id in Friendship.objects.filter(
+        user_id__in=user_ids
+    ).values_list('user_id', 'friend_id'):
+        friends[user_id].add(friend_id)
+
+    counts = defaultdict(lambda: [0, 0])
+    # Two hops over the friendship edges: user -> friend -> friend's friend
+    mutual = Friendship.objects.filter(user_id__in=user_ids).values_list(
+        'user_id', 'friend__friend_edges__friend_id'
+    ).annotate(n=Count('pk'))
+    for user_id, candidate_id, n in mutual:
+        counts[user_id, candidate_id][0] = n
+    # Co-membership: user -> game -> other players
+    shared = GamePlayer.objects.filter(user_id__in=user_ids).values_list(
+        'user_id', 'game__game_players__user_id'
+    ).annotate(n=Count('pk'))
+    for user_id, candidate_id, n in shared:
+        counts[user_id, candidate_id][1] = n
+
+    return {
+        (user_id, candidate_id): value
+        for (user_id, candidate_id), value in counts.items()
+        if candidate_id is not None
+        and candidate_id != user_id
+        and candidate_id not in friends[user_id]
+    }
+
+def rebuild_suggestions(user_ids=None, batch_size=500):
+    """Replace the stored rows of user_ids (default everyone), batch_size users at a time"""
+    if user_ids is None:
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True)
+    user_ids = list(user_ids)
+    written = 0
+    for start in range(0, len(user_ids), batch_size):
+        chunk = user_ids[start:start + batch_size]
+        rows = [
+            FriendSuggestion(
+                user_id=user_id,
+                candidate_id=candidate_id,
+                mutual_friends=mutual,
+                shared_games=shared,
+                score=score_of(mutual, shared)
+            )
+            for (user_id, candidate_id), (mutual, shared) in compute_suggestions(chunk).items()
+        ]
+        with transaction.atomic():
+            FriendSuggestion.objects.filter(user_id__in=chunk).delete()
+            FriendSuggestion.objects.bulk_create(rows, batch_size=1000)
+        written += len(rows)
+    return written
+
+def _exact_counts(center, others):
+    """{other id: (mutual friends, shared games)} between center and each of others"""
+    mutual = dict(
+        Friendship.objects.filter(
+            user_id__in=others,
+            friend_id__in=Friendship.objects.filter(user_id=center).values('friend_id')
+        ).values_list('user_id').annotate(n=Count('pk'))
+    )
+    shared = dict(
+        GamePlayer.objects.filter(
+            user_id=center,
+            game__game_players__user_id__in=others
+        ).values_list('game__game_players__user_id').annotate(n=Count('pk'))
+    )
+    return {other: (mutual.get(other, 0), shared.get(other, 0)) for other in others}
+
+def _refresh(center, others):
+    """
+    Rewrite the rows between center and each of others, in both directions,
+    with their exact current counts: one upsert for the pairs that still
+    have something in common and one DELETE for those that no longer do or
+    have become friends. Recomputing rather than adding deltas keeps the
+    handlers idempotent however late or often the outbox delivers them.
+    """
+    others = set(others) - {center}
+    if not others:
+        return
+    counts = _exact_counts(center, others - current_friend_ids(center))
+    rows = [
+        FriendSuggestion(
+            user_id=user_id,
+            candidate_id=candidate_id,
+            mutual_friends=mutual,
+            shared_games=shared,
+            score=score_of(mutual, shared)
+        )
+        for other, (mutual, shared) in counts.items() if mutual or shared
+        for user_id, candidate_id in ((center, other), (other, center))
+    ]
+    FriendSuggestion.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['user', 'candidate'],
+        update_fields=['mutual_friends', 'shared_games', 'score', 'updated_at']
+    )
+    stale = others - {row.candidate_id for row in rows}
+    if stale:
+        FriendSuggestion.objects.filter(
+            Q(user_id=center, candidate_id__in=stale) | Q(user_id__in=stale, candidate_id=center)
+        ).delete()
+
+@handler('suggestions.friendship')
+def apply_friendship_change(payload):
+    a, b = payload['user_id'], payload['friend_id']
+    with transaction.atomic():
+        # Whether a and b became friends or stopped being friends, what
+        # changed is a as a mutual friend of b and each of a's friends, the
+        # other way round, and the a/b pair itself
+        _refresh(b, current_friend_ids(a) | {a})
+        _refresh(a, current_friend_ids(b) | {b})
+
+@handler('suggestions.join')
+def apply_game_join(payload):
+    user_id = payload['user_id']
+    players = set(
+        GamePlayer.objects.filter(game_id=payload['game_id']).values_list('user_id', flat=True)
+    )
+    if user_id in players:
+        _refresh(user_id, players)
@@ -1,3 +1,365 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.query import QuerySet
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from backend.testing import make_game, make_users
+from games.models import UserStatsRollup
+from users.models import ClerkUser, Profile, hash_phone
+from notifications import outbox
+from notifications.models import Notification
+from .models import FriendRequest, Friendship, FriendSuggestion
+from .suggestions import compute_suggestions, rebuild_suggestions, score_of
+
+
+class FriendshipEdgeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice')
+        self.bob = User.objects.create_user(username='bob')
+        self.carol = User.objects.create_user(username='carol')
+
+    def befriend(self, sender, receiver):
+        friend_request = FriendRequest.objects.create(sender=sender, receiver=receiver)
+        self.client.force_login(receiver)
+        response = self.client.post(f'/api/friends/{friend_request.pk}/accept/')
+        self.assertEqual(response.status_code, 200)
+        return friend_request
+
+    def test_accept_stores_both_directions_and_refreshes_cached_sets(self):
+        # Cached empty before the request is accepted
+        self.assertEqual(Friendship.friend_ids(self.alice), frozenset())
+        self.befriend(self.alice, self.bob)
+
+        self.assertEqual(
+            set(Friendship.objects.values_list('user_id', 'friend_id')),
+            {(self.alice.id, self.bob.id), (self.bob.id, self.alice.id)}
+        )
+        self.assertEqual(Friendship.friend_ids(self.alice), {self.bob.id})
+        Friendship.friend_ids(self.bob)
+        with self.assertNumQueries(0):
+            self.assertTrue(FriendRequest.are_friends(self.bob, self.alice))
+            self.assertFalse(FriendRequest.are_friends(self.alice, self.carol))
+
+    def test_friendship_lasts_while_either_accepted_request_remains(self):
+        one = FriendRequest.objects.create(sender=self.alice, receiver=self.bob, status='accepted')
+        other = FriendRequest.objects.create(sender=self.bob, receiver=self.alice, status='accepted')
+
+        one.delete()
+        self.assertTrue(Friendship.are_friends(self.alice, self.bob))
+        other.status = 'declined'
+        other.save()
+        self.assertFalse(Friendship.are_friends(self.alice, self.bob))
+        self.assertFalse(Friendship.objects.exists())
+
+    def test_cached_sets_are_dropped_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.link(self.alice, self.bob)
+            # A concurrent reader caches the set it saw before the commit
+            cache.set(Friendship.cache_key(self.alice.id), frozenset())
+        self.assertEqual(Friendship.friend_ids(self.alice), {self.bob.id})
+
+    def test_remove_and_delete_drop_the_friendship(self):
+        self.befriend(self.alice, self.bob)
+        friend_request = self.befriend(self.carol, self.alice)
+        self.assertEqual(Friendship.friend_ids(self.alice), {self.bob.id, self.carol.id})
+
+        self.client.force_login(self.alice)
+        response = self.client.post('/api/friends/remove/', {'user_id': self.bob.id})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Friendship.friend_ids(self.alice), {self.carol.id})
+        self.assertEqual(Friendship.friend_ids(self.bob), frozenset())
+        self.assertEqual(
+            self.client.post('/api/friends/remove/', {'user_id': self.bob.id}).status_code, 404
+        )
+
+        FriendRequest.objects.get(pk=friend_request.pk).delete()
+        self.assertEqual(Friendship.friend_ids(self.alice), frozenset())
+        self.assertFalse(Friendship.objects.exists())
+
+    def test_friends_list_and_private_games_use_the_edges(self):
+        self.befriend(self.alice, self.bob)
+        self.client.force_login(self.bob)
+        response = self.client.get('/api/friends/friends/')
+        self.assertEqual(
+            [friend['username'] for friend in response.json()['results']], ['alice']
+        )
+
+        game = make_game(self.alice, private=True)
+        self.assertTrue(game.can_user_join(self.alice))
+        self.assertTrue(game.can_user_join(self.bob))
+        self.assertFalse(game.can_user_join(self.carol))
+
+
+class FriendSuggestionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = {
+            name: User.objects.create_user(username=name)
+            for name in ('alice', 'bob', 'carol', 'dave', 'erin', 'frank')
+        }
+
+    def befriend(self, *pairs):
+        for a, b in pairs:
+            FriendRequest.objects.create(
+                sender=self.users[a], receiver=self.users[b], status='accepted'
+            )
+        outbox.drain()
+
+    def play(self, host, *players):
+        game = make_game(self.users[host])
+        # The host is seated when the game is created
+        for name in players:
+            game.reserve_seat(self.users[name])
+        outbox.drain()
+
+    def stored(self):
+        rows = FriendSuggestion.objects.values_list(
+            'user_id', 'candidate_id', 'mutual_friends', 'shared_games', 'score'
+        )
+        for *_, mutual, shared, score in rows:
+            self.assertEqual(score, score_of(mutual, shared))
+        return {(u, c): [m, s] for u, c, m, s, _ in rows}
+
+    def assert_matches_rebuild(self):
+        expected = compute_suggestions([user.id for user in self.users.values()])
+        self.assertEqual(self.stored(), expected)
+
+    def test_incremental_patches_match_a_full_rebuild(self):
+        self.befriend(('alice', 'bob'), ('bob', 'carol'), ('bob', 'dave'))
+        self.assert_matches_rebuild()
+        self.play('alice', 'dave', 'frank')
+        self.play('erin', 'dave', 'alice')
+        self.befriend(('erin', 'carol'), ('alice', 'erin'))
+        self.assert_matches_rebuild()
+
+        FriendRequest.objects.get(sender=self.users['bob'], receiver=self.users['dave']).delete()
+        outbox.drain()
+        self.assert_matches_rebuild()
+
+        stored = self.stored()
+        self.assertEqual(rebuild_suggestions(), len(stored))
+        self.assertEqual(self.stored(), stored)
+
+    def test_handlers_ignore_stale_cached_friend_sets(self):
+        self.befriend(('alice', 'bob'), ('bob', 'carol'))
+        # The worker's cache may still hold sets from before the change
+        stale = {name: Friendship.friend_ids(self.users[name]) for name in ('alice', 'carol')}
+        FriendRequest.objects.create(
+            sender=self.users['alice'], receiver=self.users['carol'], status='accepted'
+        )
+        for name, ids in stale.items():
+            cache.set(Friendship.cache_key(self.users[name].id), ids)
+        outbox.drain()
+        self.assert_matches_rebuild()
+        self.assertFalse(FriendSuggestion.objects.filter(
+            user=self.users['alice'], candidate=self.users['carol']
+        ).exists())
+
+    def test_endpoint_serves_ranked_top_k(self):
+        self.befriend(('alice', 'bob'), ('bob', 'carol'), ('bob', 'dave'), ('alice', 'erin'),
+                      ('erin', 'carol'))
+        self.play('alice', 'frank')
+        self.client.force_login(self.users['alice'])
+        response = self.client.get('/api/friends/suggestions/')
+        self.assertEqual(
+            [(row['user']['username'], row['mutual_friends'], row['shared_games'])
+             for row in response.json()],
+            [('carol', 2, 0), ('dave', 1, 0), ('frank', 0, 1)]
+        )
+        with self.assertNumQueries(3):  # session, user, suggestions
+            response = self.client.get('/api/friends/suggestions/?limit=1')
+        self.assertEqual([row['user']['username'] for row in response.json()], ['carol'])
+
+        # Friends drop out of the list as soon as the request is accepted
+        self.befriend(('carol', 'alice'))
+        response = self.client.get('/api/friends/suggestions/')
+        self.assertNotIn('carol', [row['user']['username'] for row in response.json()])
+
+
+class FriendCardQueryCountTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer')
+        self.client.force_login(self.viewer)
+
+    def seed(self, start, stop):
+        senders = make_users('sender', start, stop)
+        Profile.objects.bulk_create(
+            Profile(user=user, clerk_id=f'user_{user.username}',
+                    profile_image_url='https://img.example/p.png')
+            for user in senders[::2]
+        )
+        ClerkUser.objects.bulk_create(
+            ClerkUser(user=user, clerk_id=f'user_{user.username}',
+                      profile_image_url='https://img.example/c.png')
+            for user in senders[1::2]
+        )
+        UserStatsRollup.objects.bulk_create(
+            UserStatsRollup(user=user, total_games=2, win_count=1, total_profit=40,
+                            total_hours=4, total_buy_in=40)
+            for user in senders
+        )
+        FriendRequest.objects.bulk_create(
+            FriendRequest(sender=user, receiver=self.viewer) for user in senders
+        )
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_cards_are_compact_and_stats_load_in_bulk(self):
+        self.seed(0, 2)
+        _, compact = self.get('/api/friends/pending/')
+        _, expanded = self.get('/api/friends/pending/?expand=stats')
+        self.assertEqual(expanded, compact + 1)
+
+        self.seed(2, 40)
+        rows, queries = self.get('/api/friends/pending/')
+        self.assertEqual(len(rows), 40)
+        self.assertEqual(queries, compact)
+        self.assertEqual(set(rows[0]['sender']), {'id', 'username', 'profile_image_url'})
+        self.assertTrue(all(row['sender']['profile_image_url'] for row in rows))
+
+        rows, queries = self.get('/api/friends/pending/?expand=stats')
+        self.assertEqual(queries, expanded)
+        self.assertEqual(rows[0]['sender']['poker_stats']['total_profit'], 40.0)
+        self.assertEqual(rows[0]['receiver']['poker_stats']['total_games'], 0)
+
+        _, queries = self.get('/api/friends/?expand=stats')
+        self.assertEqual(queries, expanded)
+
+    def test_friends_list_is_paged_by_username_and_searchable(self):
+        names = [f'friend{i:03d}' for i in range(120)]
+        User.objects.bulk_create(User(username=name) for name in reversed(names))
+        Friendship.objects.bulk_create(
+            Friendship(user_id=a, friend_id=b)
+            for user in User.objects.filter(username__in=names)
+            for a, b in ((user.id, self.viewer.id), (self.viewer.id, user.id))
+        )
+
+        seen, counts, url = [], set(), '/api/friends/friends/?page_size=50'
+        while url:
+            page, queries = self.get(url)
+            seen += [friend['username'] for friend in page['results']]
+            counts.add(queries)
+            url = page['next']
+        self.assertEqual(seen, names)
+        self.assertEqual(len(counts), 1)
+
+        page, _ = self.get('/api/friends/friends/?search=FRIEND11')
+        self.assertEqual(
+            [friend['username'] for friend in page['results']],
+            [f'friend11{i}' for i in range(10)]
+        )
+        self.assertIsNone(page['next'])
+
+
+class ContactMatchingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = User.objects.create_user(username='viewer')
+        Profile.objects.create(user=self.viewer, clerk_id='user_viewer', phone='+1 555 000 0000')
+        self.client.force_login(self.viewer)
+
+    def seed(self, start, stop):
+        # One save per profile, which is what fills in phone_hash
+        for i, user in enumerate(make_users('contact', start, stop), start):
+            Profile.objects.create(user=user, clerk_id=f'user_{i}', phone=f'+1 (555) 100-{i:04d}')
+
+    def post(self, data):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/friends/bulk_request/', data, content_type='application/json')
+        return response, len(ctx.captured_queries)
+
+    def test_phone_hash_follows_the_number(self):
+        profile = self.viewer.profile
+        self.assertEqual(profile.phone_hash, hash_phone('15550000000'))
+        profile.phone = ''
+        profile.save(update_fields=['phone'])
+        profile.refresh_from_db()
+        self.assertEqual(profile.phone_hash, '')
+
+    def test_bulk_request_matches_contacts_and_reports_each(self):
+        self.seed(0, 4)
+        friend = User.objects.get(username='contact1')
+        FriendRequest.objects.create(sender=friend, receiver=self.viewer, status='accepted')
+        FriendRequest.objects.create(sender=self.viewer, receiver=User.objects.get(username='contact2'))
+
+        response, _ = self.post({
+            'phone_hashes': [
+                hash_phone('15551000000'), hash_phone('15551000001'),
+                hash_phone('15550000000'), hash_phone('15559999999'),
+            ],
+            'usernames': ['contact2', 'contact3', 'contact0', 'nobody'],
+        })
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(
+            [(row['type'], row['status']) for row in results],
+            [('phone', 'sent'), ('phone', 'already_friends'), ('phone', 'self'),
+             ('phone', 'not_found'), ('username', 'already_requested'), ('username', 'sent'),
+             ('username', 'sent'), ('username', 'not_found')]
+        )
+        self.assertEqual(results[0]['user']['username'], 'contact0')
+        self.assertIsNone(results[3]['user'])
+        self.assertEqual(
+            set(FriendRequest.objects.filter(sender=self.viewer, status='pending')
+                .values_list('receiver__username', flat=True)),
+            {'contact0', 'contact2', 'contact3'}
+        )
+        self.assertEqual(
+            sorted(Notification.objects.filter(type='FRIEND_REQUEST')
+                   .values_list('user__username', flat=True)),
+            ['contact0', 'contact3']
+        )
+
+        # Sending again changes nothing
+        response, _ = self.post({'usernames': ['contact0'], 'send': False})
+        self.assertEqual(response.json()['results'][0]['status'], 'already_requested')
+
+    def test_requests_lost_to_a_concurrent_one_are_not_reported_as_sent(self):
+        self.seed(0, 2)
+        rival = User.objects.get(username='contact1')
+        bulk_create = QuerySet.bulk_create
+
+        def racing(queryset, objs, *args, **kwargs):
+            # Another request for one of the pairs commits just before our insert
+            if queryset.model is FriendRequest:
+                FriendRequest.objects.create(sender=self.viewer, receiver=rival)
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', racing):
+            response, _ = self.post({'usernames': ['contact0', 'contact1']})
+        self.assertEqual(
+            [row['status'] for row in response.json()['results']], ['sent', 'already_requested']
+        )
+        self.assertEqual(
+            list(Notification.objects.filter(type='FRIEND_REQUEST').values_list('user__username', flat=True)),
+            ['contact0']
+        )
+
+    def test_bulk_request_query_count_is_independent_of_contact_count(self):
+        self.seed(0, 2)
+        hashes = [hash_phone(f'1555100{i:04d}') for i in range(2)]
+        response, few = self.post({'phone_hashes': hashes})
+        self.assertEqual(response.status_code, 200)
+
+        self.seed(2, 60)
+        hashes = [hash_phone(f'1555100{i:04d}') for i in range(2, 60)]
+        response, many = self.post({'phone_hashes': hashes})
+        self.assertEqual(len(response.json()['results']), 58)
+        self.assertEqual(many, few)
+        self.assertEqual(Notification.objects.filter(type='FRIEND_REQUEST').count(), 60)
 
-# Create your tests here.
+        self.seed(60, 61)
+        response, _ = self.post({'usernames': ['contact60'], 'send': False})
+        self.assertEqual(response.json()['results'][0]['status'], 'matched')
+        self.assertFalse(FriendRequest.objects.filter(receiver__username='contact60').exists())
+        self.assertEqual(self.post({'usernames': 'contact0'})[0].status_code, 400)
+        self.assertEqual(self.post({})[0].status_code, 400)
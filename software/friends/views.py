@@ -3,9 +3,16 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
+from django.contrib.auth.models import User
 from django.db.models import Q
-from .models import FriendRequest
-from .serializers import FriendRequestSerializer, FriendListSerializer
+from .contacts import MAX_CONTACTS, send_requests
+from .models import FriendRequest, Friendship
+from .pagination import FriendCursorPagination
+from .serializers import (
+    CARD_RELATED, FriendRequestSerializer, FriendSuggestionSerializer, UserCardSerializer
+)
+from .suggestions import DEFAULT_LIMIT, top_suggestions
+from games.models import UserStatsRollup
 from notifications.models import Notification
 
 class FriendViewSet(viewsets.ModelViewSet):
@@ -15,10 +22,30 @@ class FriendViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return FriendRequest.objects.filter(
             Q(sender=self.request.user) | Q(receiver=self.request.user)
-        ).select_related(
-            'sender__profile',
-            'receiver__profile'
-        )
+        ).select_related(*self.request_related())
+
+    @staticmethod
+    def request_related():
+        return [f'{side}__{related}' for side in ('sender', 'receiver') for related in CARD_RELATED]
+
+    def expand_stats(self):
+        return 'stats' in self.request.query_params.get('expand', '').split(',')
+
+    def card_context(self, user_ids):
+        """Serializer context; with ?expand=stats, the poker stats of user_ids in one query"""
+        context = self.get_serializer_context()
+        if self.expand_stats():
+            context['stats'] = UserStatsRollup.poker_stats_for(user_ids)
+        return context
+
+    def get_serializer(self, *args, **kwargs):
+        # User cards carry stats only when asked for, loaded for the whole page at once
+        if args and args[0] is not None and self.expand_stats():
+            rows = args[0] if kwargs.get('many') else [args[0]]
+            kwargs['context'] = self.card_context(
+                {row.sender_id for row in rows} | {row.receiver_id for row in rows}
+            )
+        return super().get_serializer(*args, **kwargs)
 
     @action(detail=False, methods=['POST'])
     def send_request(self, request):
@@ -55,6 +82,52 @@ class FriendViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(friend_request)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['POST'])
+    def bulk_request(self, request):
+        """
+        Match contacts (phone_hashes and/or usernames) and send a friend
+        request to every matched user in one transaction; with "send": false
+        only match. Returns one result per contact, in order.
+        """
+        contacts = {}
+        for field in ('phone_hashes', 'usernames'):
+            values = request.data.get(field, [])
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                return Response(
+                    {'error': f'{field} must be a list of strings'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            contacts[field] = values
+        total = len(contacts['phone_hashes']) + len(contacts['usernames'])
+        if not total:
+            return Response(
+                {'error': 'phone_hashes or usernames is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if total > MAX_CONTACTS:
+            return Response(
+                {'error': f'At most {MAX_CONTACTS} contacts per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = send_requests(
+            request.user, send=request.data.get('send', True) is not False, **contacts
+        )
+        matched = {user_id for _, _, user_id, _ in results if user_id is not None}
+        users = User.objects.filter(id__in=matched).select_related(*CARD_RELATED)
+        cards = {
+            card['id']: card
+            for card in UserCardSerializer(
+                users, many=True, context=self.card_context(matched)
+            ).data
+        }
+        return Response({
+            'results': [
+                {'type': kind, 'value': value, 'status': result, 'user': cards.get(user_id)}
+                for kind, value, user_id, result in results
+            ]
+        })
+
     @action(detail=True, methods=['POST'])
     def accept(self, request, pk=None):
         friend_request = self.get_object()
@@ -100,26 +173,63 @@ class FriendViewSet(viewsets.ModelViewSet):
         pending_requests = FriendRequest.objects.filter(
             receiver=request.user,
             status='pending'
-        ).select_related(
-            'sender__profile',
-            'receiver__profile'
-        )
+        ).select_related(*self.request_related())
         serializer = self.get_serializer(pending_requests, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['POST'])
+    def remove(self, request):
+        """Unfriend user_id; deleting the accepted request drops the friendship"""
+        friend_id = request.data.get('user_id')
+        if not friend_id:
+            return Response(
+                {'error': 'user_id is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        deleted, _ = FriendRequest.objects.filter(
+            Q(sender=request.user, receiver_id=friend_id) |
+            Q(sender_id=friend_id, receiver=request.user),
+            status='accepted'
+        ).delete()
+        if not deleted:
+            return Response(
+                {'error': 'Not friends with this user'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(detail=False)
     def friends(self, request):
-        # Get all accepted friend requests
-        friend_requests = FriendRequest.objects.filter(
-            (Q(sender=request.user) | Q(receiver=request.user)),
-            status='accepted'
-        )
-        
-        # Get the friend users from the requests
+        """
+        The user's friends in username order, paged by cursor; ?search= keeps
+        usernames starting with the given prefix
+        """
+        # One join against the (friend) index of the symmetric edge table
         friends = User.objects.filter(
-            Q(sent_requests__in=friend_requests) |
-            Q(received_requests__in=friend_requests)
-        ).exclude(id=request.user.id).distinct()
-        
-        serializer = FriendListSerializer(friends, many=True)
+            friend_edges__friend=request.user
+        ).select_related(*CARD_RELATED)
+        search = request.query_params.get('search')
+        if search:
+            friends = friends.filter(username__istartswith=search)
+
+        paginator = FriendCursorPagination()
+        page = paginator.paginate_queryset(friends, request, view=self)
+        serializer = UserCardSerializer(
+            page, many=True, context=self.card_context([user.id for user in page])
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def suggestions(self, request):
+        """People you may know, ranked by mutual friends and shared games (?limit=, max 50)"""
+        try:
+            limit = max(1, int(request.query_params.get('limit', DEFAULT_LIMIT)))
+        except ValueError:
+            limit = DEFAULT_LIMIT
+        suggestions = top_suggestions(request.user, limit)
+        serializer = FriendSuggestionSerializer(
+            suggestions,
+            many=True,
+            context=self.card_context([suggestion.candidate_id for suggestion in suggestions])
+        )
         return Response(serializer.data)
\ No newline at end of file
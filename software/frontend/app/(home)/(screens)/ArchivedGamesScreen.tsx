@@ -38,12 +38,14 @@ export default function ArchivedGamesScreen() {
       const response = await api.get('games/?status=archived');
       console.log('Raw API Response:', response.data);
 
-      if (!Array.isArray(response.data)) {
-        console.error('Expected array of games, got:', typeof response.data);
+      // Cursor-paginated: { next, previous, results }
+      const games = response.data?.results;
+      if (!Array.isArray(games)) {
+        console.error('Expected array of games, got:', typeof games);
         return;
       }
 
-      const transformedGames = response.data.map((game: any) => {
+      const transformedGames = games.map((game: any) => {
         console.log('Processing game:', game);
         
         if (!game || !game.id) {
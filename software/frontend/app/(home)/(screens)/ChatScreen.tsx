@@ -122,6 +122,7 @@ export default function ChatScreen(): React.JSX.Element {
       setError(null);
       setLoading(true);
       const chatData = await chatService.getGameChat(Number(gameId));
+      const page = await chatService.getMessages(chatData.id);
       console.log('[ChatScreen] Loaded chat data:', {
         id: chatData.id,
         title: chatData.game_title,
@@ -129,7 +130,8 @@ export default function ChatScreen(): React.JSX.Element {
       });
       setChat({
         ...chatData,
-        title: chatData.game_title
+        title: chatData.game_title,
+        messages: page.results
       });
       await chatService.markAsRead(chatData.id);
     } catch (error) {
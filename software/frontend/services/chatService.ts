@@ -27,13 +27,44 @@ export interface ChatMember {
 export interface Chat {
   id: number;
   game: number;
+  game_title: string;
   created_at: string;
   is_active: boolean;
-  messages: Message[];
   members: ChatMember[];
   unread_count: number;
 }
 
+export interface InboxChat {
+  id: number;
+  game: number;
+  game_title: string;
+  image_url: string | null;
+  created_at: string;
+  is_active: boolean;
+  member_count: number;
+  unread_count: number;
+  last_message: {
+    id: number;
+    content: string;
+    sender: string;
+    created_at: string;
+    is_system_message: boolean;
+  } | null;
+}
+
+export interface MessagePage {
+  next: string | null;
+  previous: string | null;
+  results: Message[];
+}
+
+export interface ChatSync {
+  watermark: string;
+  messages: (Message & { chat: number })[];
+  members: (ChatMember & { chat: number; unread_count: number | null })[];
+  has_more: boolean;
+}
+
 export interface ChatPreviewData {
   id: string;
   title: string;
@@ -49,9 +80,9 @@ class ChatService {
   async getChats(): Promise<ChatPreviewData[]> {
     try {
       console.log('[ChatService] Fetching chats...');
-      const response = await api.get('chat/chats/');
+      const response = await api.get('chat/chats/inbox/');
       console.log('[ChatService] Chats response:', response.data);
-      return response.data.map(chat => this.transformChatToPreview(chat));
+      return response.data.map((chat: InboxChat) => this.transformChatToPreview(chat));
     } catch (error) {
       console.error('[ChatService] Error in getChats:', error);
       throw error;
@@ -70,6 +101,32 @@ class ChatService {
     }
   }
 
+  // Newest page when no cursor is given; pass before=<oldest loaded id> to scroll back
+  async getMessages(chatId: number, cursor?: { before?: number; after?: number }): Promise<MessagePage> {
+    try {
+      const response = await api.get(`chat/chats/${chatId}/messages/`, { params: cursor });
+      return response.data;
+    } catch (error) {
+      console.error('[ChatService] Error fetching messages:', error);
+      throw error;
+    }
+  }
+
+  // One poll for all chats: pass the opaque watermark from the previous
+  // response (none on first call); keep polling while has_more is set.
+  // Nothing is sent twice, and member rows replace earlier ones by id
+  async sync(watermark?: string): Promise<ChatSync> {
+    try {
+      const response = await api.get('chat/chats/sync/', {
+        params: watermark ? { since: watermark } : undefined
+      });
+      return response.data;
+    } catch (error) {
+      console.error('[ChatService] Error syncing chats:', error);
+      throw error;
+    }
+  }
+
   async sendMessage(chatId: number, content: string): Promise<Message> {
     try {
       console.log(`[ChatService] Sending message to chat ${chatId}...`);
@@ -95,18 +152,18 @@ class ChatService {
     }
   }
 
-  private transformChatToPreview(chat: Chat): ChatPreviewData {
-    const lastMessage = chat.messages[chat.messages.length - 1];
+  private transformChatToPreview(chat: InboxChat): ChatPreviewData {
+    const lastMessage = chat.last_message;
     const timeAgo = this.getTimeAgo(new Date(lastMessage?.created_at || chat.created_at));
 
     return {
       id: chat.id.toString(),
       title: chat.game_title || `Game ${chat.game}`,
       lastMessage: lastMessage ? 
-        `${lastMessage.sender.username}: ${lastMessage.content}` : 
+        `${lastMessage.sender}: ${lastMessage.content}` : 
         'No messages yet',
       time: timeAgo,
-      image: chat.members[0]?.user.profile_image_url || 'https://via.placeholder.com/50',
+      image: chat.image_url || 'https://via.placeholder.com/50',
       unreadCount: chat.unread_count,
       isGameChat: true,
       gameId: chat.game
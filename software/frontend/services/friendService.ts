@@ -27,6 +27,19 @@ class FriendService {
     }
   }
 
+  // phone_hashes are SHA-256 hex digests of each number's digits
+  async matchContacts(
+    contacts: { phone_hashes?: string[]; usernames?: string[]; send?: boolean }
+  ): Promise<any[]> {
+    try {
+      const response = await api.post('friends/bulk_request/', contacts);
+      return response.data.results;
+    } catch (error) {
+      console.error('Error matching contacts:', error);
+      throw error;
+    }
+  }
+
   async acceptFriendRequest(requestId: string): Promise<void> {
     try {
       await api.post(`friends/accept/${requestId}/`);
@@ -72,10 +85,20 @@ class FriendService {
     }
   }
 
-  async getFriends(): Promise<any[]> {
+  // friends/friends/ is cursor-paginated ({ next, previous, results });
+  // follow next until every page is loaded
+  async getFriends(search?: string): Promise<any[]> {
     try {
-      const response = await api.get('friends/');
-      return response.data;
+      const friends: any[] = [];
+      let response = await api.get('friends/friends/', {
+        params: { page_size: 100, ...(search ? { search } : {}) }
+      });
+      friends.push(...response.data.results);
+      while (response.data.next) {
+        response = await api.get(response.data.next);
+        friends.push(...response.data.results);
+      }
+      return friends;
     } catch (error) {
       console.error('Error getting friends:', error);
       throw error;
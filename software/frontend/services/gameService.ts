@@ -89,7 +89,8 @@ export const fetchGames = async (): Promise<Game[]> => {
     console.log('Fetching games...');
     const response = await api.get('games/');
     console.log('Raw games response:', response.data);
-    return response.data;
+    // Cursor-paginated: { next, previous, results }
+    return response.data.results;
   } catch (error) {
     console.error('Error in fetchGames:', error);
     throw error;
@@ -302,7 +303,7 @@ export const checkGameAccess = async (gameId: string): Promise<'admin' | 'player
 export const fetchUserGames = async (): Promise<Game[]> => {
   try {
     const response = await api.get('games/my_games/');
-    const games = response.data.map(transformGameData);
+    const games = response.data.results.map(transformGameData);
     
     // Sort by date (soonest first)
     return games.sort((a, b) => {
@@ -44,13 +44,14 @@ export const getAllGames = async (): Promise<Game[]> => {
     const response = await api.get('games/');
     console.log('Raw API response:', response);
 
-    if (!response.data) {
+    // Cursor-paginated: { next, previous, results }
+    if (!response.data?.results) {
       console.log('No data in response');
       return [];
     }
 
     // Transform the API response to match our Game interface
-    const transformedGames = response.data.map((game: any) => ({
+    const transformedGames = response.data.results.map((game: any) => ({
       id: game.id.toString(),
       hostName: game.host?.username || 'Unknown Host',
       hostImage: 'https://i.pravatar.cc/150?img=1',
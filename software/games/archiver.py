@@ -0,0 +1,88 @@
+"""
+Archiving of past-due games. Due games are moved to 'archived' with chunked
+set-based UPDATEs; each chunk queues its notifications as a single outbox
+event and announces itself through the games_archived signal so the chat app
+can post its system messages in bulk too. `manage.py archive_past_games`
+runs it once or as a loop guarded by scheduler_lock.
+"""
+import fcntl
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from django.db import transaction
+from django.utils import timezone
+from .models import Game
+from .signals import games_archived
+
+DUE_STATUSES = ['upcoming', 'in_progress']
+CHUNK_SIZE = 500
+LOCK_PATH = os.path.join(tempfile.gettempdir(), 'pokeru-archive-past-games.lock')
+
+class SchedulerBusy(Exception):
+    """Another archiver already holds the scheduler lock"""
+
+@contextmanager
+def scheduler_lock(path=LOCK_PATH):
+    """Hold an exclusive, non-blocking file lock for as long as the block runs"""
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise SchedulerBusy(f'{path} is held by another archiver')
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def past_due_games(now=None):
+    return Game.objects.filter(
+        scheduled_time__lt=now or timezone.now(),
+        status__in=DUE_STATUSES
+    )
+
+def archive_chunk(now, chunk_size=CHUNK_SIZE):
+    """
+    Archive up to chunk_size due games in one transaction and queue their side
+    effects. Returns (how many games were selected, the ids actually archived):
+    a selected game whose status changed before the UPDATE is skipped, and
+    gets no notifications or chat events.
+    """
+    from notifications.outbox import enqueue
+
+    with transaction.atomic():
+        selected = list(
+            past_due_games(now).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not selected:
+            return 0, []
+        # updated_at is auto_now, which update() does not fill in by itself
+        archived = Game.objects.filter(id__in=selected, status__in=DUE_STATUSES).update(
+            status='archived',
+            updated_at=now
+        )
+        game_ids = selected
+        if archived < len(selected):
+            game_ids = list(
+                Game.objects.filter(id__in=selected, status='archived', updated_at=now)
+                .order_by('id').values_list('id', flat=True)
+            )
+        if game_ids:
+            enqueue('games.archived', {'game_ids': game_ids})
+            games_archived.send(sender=Game, game_ids=game_ids)
+    return len(selected), game_ids
+
+def archive_past_due_games(now=None, chunk_size=CHUNK_SIZE):
+    """
+    Archive every game that is past due at `now`, chunk by chunk.
+    Returns (games archived, seconds taken).
+    """
+    now = now or timezone.now()
+    started = time.monotonic()
+    archived = 0
+    while True:
+        selected, game_ids = archive_chunk(now, chunk_size)
+        archived += len(game_ids)
+        if selected < chunk_size:
+            break
+    return archived, time.monotonic() - started
@@ -0,0 +1,56 @@
+"""
+Time-windowed leaderboards. Each window is the sum of a handful of the stat
+buckets games.rollups keeps per user: up to seven day buckets for the
+current week, one month bucket for the current month and up to three month
+buckets for the current season (calendar quarter). The all-time board reads
+UserStatsRollup directly.
+"""
+from django.contrib.auth.models import User
+from django.db.models import Sum
+from django.utils import timezone
+from .models import UserStatsRollup, UserMonthlyStats, UserDailyStats
+
+PERIODS = ['week', 'month', 'season']
+
+def window_buckets(period):
+    """Bucket rows that make up the current week, month or season"""
+    today = timezone.localdate()
+    this_month = today.replace(day=1)
+    if period == 'week':
+        monday = today - timezone.timedelta(days=today.weekday())
+        return UserDailyStats.objects.filter(day__gte=monday)
+    if period == 'month':
+        return UserMonthlyStats.objects.filter(month=this_month)
+    if period == 'season':
+        season_start = this_month.replace(month=(this_month.month - 1) // 3 * 3 + 1)
+        return UserMonthlyStats.objects.filter(month__gte=season_start)
+    raise ValueError(f"Unknown leaderboard period: {period}")
+
+def _window_totals(period, user_ids):
+    buckets = window_buckets(period)
+    if user_ids is not None:
+        buckets = buckets.filter(user_id__in=user_ids)
+    return buckets.order_by().values('user_id').annotate(
+        winnings=Sum('profit'),
+        played=Sum('games'),
+    ).filter(played__gt=0)
+
+def window_standings(period, user_ids=None, limit=10):
+    """Top `limit` players for the window, as positioned UserStatsRollup rows"""
+    totals = list(_window_totals(period, user_ids).order_by('-winnings', 'user_id')[:limit])
+    users = User.objects.select_related('clerkuser', 'profile').in_bulk(
+        [row['user_id'] for row in totals]
+    )
+    rows = [
+        UserStatsRollup(user=users[row['user_id']], total_profit=row['winnings'])
+        for row in totals
+    ]
+    return UserStatsRollup.assign_positions(rows)
+
+def window_position(user, period, user_ids=None):
+    """Rank of user within the window (optionally within user_ids), or None"""
+    totals = _window_totals(period, user_ids)
+    mine = next(iter(totals.filter(user_id=user.id)), None)
+    if mine is None:
+        return None, None
+    return totals.filter(winnings__gt=mine['winnings']).count() + 1, mine['winnings']
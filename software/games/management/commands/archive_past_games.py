@@ -1,19 +1,33 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from games.models import Game
+import time
+from django.core.management.base import BaseCommand, CommandError
+from games.archiver import archive_past_due_games, scheduler_lock, SchedulerBusy, CHUNK_SIZE, LOCK_PATH
 
 class Command(BaseCommand):
-    help = 'Archives games that have passed their start time'
+    help = 'Archives games that are past their scheduled time, once or on a loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Archive what is due and exit instead of looping')
+        parser.add_argument('--interval', type=float, default=60.0,
+                            help='Seconds between passes when looping')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Games archived per UPDATE')
+        parser.add_argument('--lock-file', default=LOCK_PATH,
+                            help='Lock that keeps a second archiver from running')
 
     def handle(self, *args, **options):
-        past_games = Game.objects.filter(
-            time_start__lt=timezone.now(),
-            status='upcoming'
-        )
-        
-        count = past_games.count()
-        past_games.update(status='archived')
-        
-        self.stdout.write(
-            self.style.SUCCESS(f'Successfully archived {count} past games')
-        ) 
\ No newline at end of file
+        try:
+            with scheduler_lock(options['lock_file']):
+                while True:
+                    archived, elapsed = archive_past_due_games(chunk_size=options['chunk_size'])
+                    if archived or options['once']:
+                        rate = archived / elapsed if elapsed else 0
+                        self.stdout.write(
+                            f'Archived {archived} games in {elapsed:.3f}s ({rate:.0f} games/s)'
+                        )
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except SchedulerBusy as e:
+            raise CommandError(f'Another archiver is already running: {e}')
+        self.stdout.write(self.style.SUCCESS('Archiver stopped'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from games.rollups import rebuild_user_rollups, verify_user_rollups
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-user stats rollups from raw GameStats rows and verifies them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Only rebuild this user id (repeatable)')
+        parser.add_argument('--verify-only', action='store_true',
+                            help='Report drifted users without rewriting anything')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+
+        if not options['verify_only']:
+            rebuilt = rebuild_user_rollups(user_ids)
+            self.stdout.write(f'Rebuilt stats rollups for {rebuilt} users')
+
+        drifted = verify_user_rollups(user_ids)
+        if drifted:
+            raise CommandError(
+                f'{len(drifted)} users have rollups that differ from their game stats: '
+                + ', '.join(str(user_id) for user_id in drifted)
+            )
+        self.stdout.write(self.style.SUCCESS('Stats rollups match the raw game stats'))
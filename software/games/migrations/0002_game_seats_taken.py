@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:38
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_seats_taken(apps, schema_editor):
+    Game = apps.get_model('games', 'Game')
+    GamePlayer = apps.get_model('games', 'GamePlayer')
+    taken = GamePlayer.objects.filter(
+        game=OuterRef('pk')
+    ).order_by().values('game').annotate(c=Count('id')).values('c')
+    Game.objects.update(
+        seats_taken=Coalesce(Subquery(taken, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='seats_taken',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_seats_taken, migrations.RunPython.noop),
+    ]
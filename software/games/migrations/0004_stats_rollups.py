@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField, DecimalField, ExpressionWrapper, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill_rollups(apps, schema_editor):
+    GameStats = apps.get_model('games', 'GameStats')
+    UserStatsRollup = apps.get_model('games', 'UserStatsRollup')
+    UserMonthlyStats = apps.get_model('games', 'UserMonthlyStats')
+    profit = ExpressionWrapper(
+        F('cash_out') - F('buy_in'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+    stats = GameStats.objects.order_by()
+
+    UserStatsRollup.objects.bulk_create([
+        UserStatsRollup(
+            user_id=row['player_id'],
+            total_games=row['total_games'],
+            win_count=row['win_count'],
+            total_profit=row['total_profit'] or 0,
+            total_hours=row['total_hours'] or 0,
+            total_buy_in=row['total_buy_in'] or 0,
+            biggest_win=row['biggest_win'] or 0,
+            biggest_loss=row['biggest_loss'] or 0,
+        )
+        for row in stats.values('player_id').annotate(
+            total_games=Count('id'),
+            win_count=Count('id', filter=Q(cash_out__gt=F('buy_in'))),
+            total_profit=Sum(profit),
+            total_hours=Sum('hours_played'),
+            total_buy_in=Sum('buy_in'),
+            biggest_win=Max(profit, filter=Q(cash_out__gt=F('buy_in'))),
+            biggest_loss=Min(profit, filter=Q(cash_out__lt=F('buy_in'))),
+        )
+    ], batch_size=500)
+
+    UserMonthlyStats.objects.bulk_create([
+        UserMonthlyStats(
+            user_id=row['player_id'],
+            month=row['month'],
+            games=row['games'],
+            profit=row['profit'] or 0,
+            hours=row['hours'] or 0,
+        )
+        for row in stats.annotate(
+            month=TruncMonth('game__scheduled_time', output_field=DateField())
+        ).values('player_id', 'month').annotate(
+            games=Count('id'),
+            profit=Sum(profit),
+            hours=Sum('hours_played'),
+        )
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0003_game_status_sched_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStatsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_games', models.PositiveIntegerField(default=0)),
+                ('win_count', models.PositiveIntegerField(default=0)),
+                ('total_profit', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_hours', models.DecimalField(decimal_places=1, default=0, max_digits=10)),
+                ('total_buy_in', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('biggest_win', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('biggest_loss', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats_rollup', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserMonthlyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('profit', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('hours', models.DecimalField(decimal_places=1, default=0, max_digits=10)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['month'],
+                'unique_together': {('user', 'month')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
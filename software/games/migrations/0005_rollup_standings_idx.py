@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0004_stats_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userstatsrollup',
+            index=models.Index(fields=['-total_profit', 'user'], name='rollup_standings_idx'),
+        ),
+    ]
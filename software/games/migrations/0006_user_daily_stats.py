@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:45
+
+import django.db.models.deletion
+from django.conf import settings
+from datetime import timedelta
+from django.db import migrations, models
+from django.db.models import Count, DateField, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_daily_stats(apps, schema_editor):
+    GameStats = apps.get_model('games', 'GameStats')
+    UserDailyStats = apps.get_model('games', 'UserDailyStats')
+    profit = ExpressionWrapper(
+        F('cash_out') - F('buy_in'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+    start = timezone.localdate() - timedelta(days=14)
+    rows = GameStats.objects.order_by().annotate(
+        day=TruncDate('game__scheduled_time')
+    ).filter(day__gte=start).values('player_id', 'day').annotate(
+        games=Count('id'),
+        profit=Sum(profit),
+        hours=Sum('hours_played'),
+    )
+    UserDailyStats.objects.bulk_create([
+        UserDailyStats(
+            user_id=row['player_id'],
+            day=row['day'],
+            games=row['games'],
+            profit=row['profit'] or 0,
+            hours=row['hours'] or 0,
+        )
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0005_rollup_standings_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('profit', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('hours', models.DecimalField(decimal_places=1, default=0, max_digits=10)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['day'],
+                'indexes': [models.Index(fields=['day'], name='daily_stats_day_idx')],
+                'unique_together': {('user', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:11
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0006_user_daily_stats'),
+        # Its accepted rows are copied into friends.Friendship first
+        ('friends', '0002_friendship_edges'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='Friendship',
+        ),
+    ]
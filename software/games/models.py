@@ -8,10 +8,12 @@ from django.utils import timezone
 from users.models import Profile
 from model_utils import FieldTracker
 from users.models import ClerkUser
+from friends.models import Friendship
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 import random
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, F, Exists, OuterRef
 
 class Profile(models.Model):
   user = models.OneToOneField(
@@ -45,6 +47,7 @@ class Game(models.Model):
   scheduled_time = models.DateTimeField()
   buy_in = models.DecimalField(max_digits=10, decimal_places=2)
   slots = models.IntegerField()
+  seats_taken = models.PositiveIntegerField(default=0)
   blinds = models.DecimalField(max_digits=10, decimal_places=2)
   amount_reserved = models.DecimalField(max_digits=10, decimal_places=2, default=0)
   private = models.BooleanField(default=False)
@@ -52,158 +55,217 @@ class Game(models.Model):
   created_at = models.DateTimeField(auto_now_add=True)
   updated_at = models.DateTimeField(auto_now=True)
   players = models.ManyToManyField(User, through='GamePlayer')
-  tracker = FieldTracker(fields=['status'])
+  tracker = FieldTracker(fields=['status', 'scheduled_time'])
 
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
-    self._original_status = self.status if self.pk else None
+    # Read from __dict__: a deferred status (e.g. games loaded by a cascade
+    # delete) must not trigger a query from inside __init__
+    self._original_status = self.__dict__.get('status') if self.pk else None
 
   class Meta:
     ordering = ['-scheduled_time']
+    indexes = [
+      models.Index(fields=['status', 'scheduled_time'], name='game_status_sched_idx'),
+    ]
 
   def __str__(self):
     return f"{self.title} - {self.scheduled_time}"
 
   @property
   def player_count(self):
-    return self.players.count()
+    return self.seats_taken
+
+  def reserve_seat(self, user, **extra):
+    """
+    Claim a seat for user with a single conditional UPDATE on the seat counter.
+    Returns the new GamePlayer, or None if the game is full. Raises
+    IntegrityError (with the counter rolled back) if the user already has a seat.
+    """
+    with transaction.atomic():
+      claimed = Game.objects.filter(
+        pk=self.pk,
+        seats_taken__lt=F('slots')
+      ).update(seats_taken=F('seats_taken') + 1)
+      if not claimed:
+        return None
+      player = GamePlayer.objects.create(game=self, user=user, **extra)
+    self.seats_taken += 1
+    self._clear_prefetched_players()
+    return player
+
+  def release_seat(self, game_player):
+    """Delete game_player and give its seat back to the counter"""
+    with transaction.atomic():
+      deleted, _ = GamePlayer.objects.filter(pk=game_player.pk).delete()
+      if deleted:
+        Game.objects.filter(pk=self.pk, seats_taken__gt=0).update(
+          seats_taken=F('seats_taken') - 1
+        )
+    if deleted and self.seats_taken > 0:
+      self.seats_taken -= 1
+    self._clear_prefetched_players()
+    return bool(deleted)
+
+  def _clear_prefetched_players(self):
+    # Drop a stale prefetch_related('game_players') after the seat list changes
+    getattr(self, '_prefetched_objects_cache', {}).pop('game_players', None)
 
   @property
   def is_past_due(self):
     return timezone.now() > self.scheduled_time
 
-  def archive_if_past_due(self):
-    if self.is_past_due and self.status in ['upcoming', 'in_progress']:
-      print(f"Archiving game {self.id}: {self.title}")
-      print(f"Current time: {timezone.now()}")
-      print(f"Game start time: {self.scheduled_time}")
-      self.status = 'archived'
-      self.save()
-      print(f"Game status updated to: {self.status}")
-
   @classmethod
   def update_past_due_games(cls):
-    """Update status of all past due games"""
-    past_due_games = cls.objects.filter(
-      scheduled_time__lt=timezone.now(),
-      status__in=['upcoming', 'in_progress']
-    )
-    for game in past_due_games:
-      game.archive_if_past_due()
+    """Archive all past due games; see games.archiver"""
+    from .archiver import archive_past_due_games
+    return archive_past_due_games()
 
   def save(self, *args, **kwargs):
-    is_new = self.pk is None
-    status_changed = not is_new and self.status != self._original_status
+    # _state.adding rather than pk: a new game may be given an explicit pk
+    is_new = self._state.adding
+    status_changed = (
+      not is_new
+      and self._original_status is not None
+      and self.status != self._original_status
+    )
     old_status = self._original_status
-    
-    # Regular save
-    super().save(*args, **kwargs)
-    
-    # Update original status after save
-    self._original_status = self.status
-    
-    # If status changed, trigger notifications
-    if status_changed:
-        from notifications.models import Notification
-        
-        if self.status == 'in_progress':
-            # Game started notifications
-            title = random.choice([
-                'Game started!',
-                'Time to win some money!'
-            ])
-            message = f'{self.title} is now in session'
-        elif self.status in ['completed', 'archived']:
-            # Game ended notifications
-            title = random.choice([
-                'Game over!',
-                'Did you win?!'
-            ])
-            message = f'Report your stats for {self.title}'
-        else:
-            return  # Don't create notifications for other status changes
-        
-        # Create notifications for all players
-        players = list(self.game_players.all())
-        
-        for game_player in players:
-            Notification.objects.create(
-                user=game_player.user,
-                type='GAME_STARTED' if self.status == 'in_progress' else 'GAME_ENDED',
-                title=title,
-                message=message,
-                game=self
-            )
-        
-        # Special notification for host if they're not a player
-        if not self.game_players.filter(user=self.host).exists():
-            Notification.objects.create(
-                user=self.host,
-                type='GAME_STARTED' if self.status == 'in_progress' else 'GAME_ENDED',
-                title=title,
-                message=message,
-                game=self
-            )
-
-    # If this is a new game, add the host as a player
+
+    # The host takes the first seat of a new game
     if is_new and self.host:
-        GamePlayer.objects.get_or_create(
-            game=self,
-            user=self.host,
-            defaults={'is_admin': True}
-        )
+      self.seats_taken = 1
+    elif not is_new and not kwargs.get('force_insert'):
+      # seats_taken is only ever changed by the conditional UPDATEs in
+      # reserve_seat and release_seat; writing back the value this instance
+      # loaded would undo seats claimed or released since
+      update_fields = kwargs.get('update_fields')
+      if update_fields is None:
+        update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+      kwargs['update_fields'] = [name for name in update_fields if name != 'seats_taken']
+    
+    # The row, its host seat and the outbox events for its side effects
+    # (see notifications.outbox) commit together
+    with transaction.atomic():
+      super().save(*args, **kwargs)
+      
+      # Update original status after save
+      self._original_status = self.status
+      
+      # If status changed, queue notifications for players and host
+      if status_changed:
+          self.notify_status_change()
+
+      # If this is a new game, add the host as a player
+      if is_new and self.host:
+          GamePlayer.objects.get_or_create(
+              game=self,
+              user=self.host,
+              defaults={'is_admin': True}
+          )
 
   def is_hosted_by(self, user):
     """Check if game is hosted by user using clerk_id"""
     return hasattr(user, 'profile') and self.host.profile.clerk_id == user.profile.clerk_id
 
+  def notification_recipient_ids(self):
+    """Ids of every player plus the host, whether or not they hold a seat"""
+    return list(self.game_players.values_list('user_id', flat=True)) + [self.host_id]
+
+  def status_notification(self):
+    """(type, title, message) announcing the current status, or None"""
+    if self.status == 'in_progress':
+      # Game started notifications
+      title = random.choice([
+        'Game started!',
+        'Time to win some money!'
+      ])
+      return 'GAME_STARTED', title, f'{self.title} is now in session'
+    if self.status in ['completed', 'archived']:
+      # Game ended notifications
+      title = random.choice([
+        'Game over!',
+        'Did you win?!'
+      ])
+      return 'GAME_ENDED', title, f'Report your stats for {self.title}'
+    return None  # Don't create notifications for other status changes
+
+  def notify_status_change(self):
+    """Queue the status announcement; the outbox worker fans it out"""
+    from notifications.outbox import enqueue
+
+    notification = self.status_notification()
+    if notification:
+      type, title, message = notification
+      enqueue('game.notify', {
+        'game_id': self.pk,
+        'type': type,
+        'title': title,
+        'message': message,
+      })
+
   def create_game_notification(self, type, title, message):
     from notifications.models import Notification
     
-    # Create notification for all players
-    for player in self.game_players.all():
-        Notification.objects.create(
-            user=player.user,
-            type=type,
-            title=title,
-            message=message,
-            game=self
-        )
+    # One bulk insert for all players and the host
+    return Notification.fan_out(
+      self.notification_recipient_ids(),
+      type=type,
+      title=title,
+      message=message,
+      game=self
+    )
+
+  @classmethod
+  def create_status_notifications(cls, game_ids):
+    """
+    Announce the current status of many games with one insert, e.g. after
+    the archiver moved them with a set-based UPDATE
+    """
+    from notifications.models import Notification
+
+    games = list(cls.objects.filter(pk__in=game_ids).order_by().only('id', 'title', 'status', 'host_id'))
+    recipients = {game.pk: [] for game in games}
+    for game_id, user_id in GamePlayer.objects.filter(game_id__in=recipients).values_list('game_id', 'user_id'):
+      recipients[game_id].append(user_id)
+
+    batches = []
+    for game in games:
+      notification = game.status_notification()
+      if notification:
+        batches.append((recipients[game.pk] + [game.host_id], *notification, game))
+    return Notification.fan_out_many(batches)
 
   def start_game(self):
+    # save() announces the status change to everyone once
     self.status = 'in_progress'
-    self.save()
-    self.create_game_notification(
-        'GAME_STARTED',
-        'Game Started',
-        f'Your game "{self.title}" has started!'
-    )
+    self.save(update_fields=['status', 'updated_at'])
 
   def end_game(self):
     self.status = 'completed'
-    self.save()
-    self.create_game_notification(
-        'GAME_ENDED',
-        'Game Ended',
-        f'Your game "{self.title}" has ended!'
+    self.save(update_fields=['status', 'updated_at'])
+
+  @classmethod
+  def visible_to(cls, user):
+    """
+    Games user may see: public ones, plus private games they host, play in
+    or that a friend hosts. The friend check is one subquery on the covering
+    (user, friend) index of friends.Friendship, so a list of any length is
+    filtered in the same query that loads it.
+    """
+    if not user.is_authenticated:
+      return cls.objects.filter(private=False)
+    return cls.objects.filter(
+      Q(private=False) |
+      Q(host_id=user.id) |
+      Q(host_id__in=Friendship.objects.filter(user_id=user.id).values('friend_id')) |
+      Q(Exists(GamePlayer.objects.filter(game=OuterRef('pk'), user_id=user.id)))
     )
 
   def can_user_join(self, user):
-    # If game is public, anyone can join
-    if not self.private:
-        return True
-            
-    # If user is host, they can join
-    if self.host == user:
-        return True
-            
-    # Check if user is friends with host
-    friendship = Friendship.objects.filter(
-        (Q(user1=self.host, user2=user) | Q(user1=user, user2=self.host)),
-        status='accepted'
-    ).exists()
-        
-    return friendship
+    # Public games are open to anyone, private ones to the host and their friends
+    if not self.private or self.host_id == user.id:
+      return True
+    return Friendship.are_friends(self.host_id, user.id)
 
 class GamePlayer(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='joined_games')
@@ -226,6 +288,7 @@ class GameStats(models.Model):
     hours_played = models.DecimalField(max_digits=4, decimal_places=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    tracker = FieldTracker(fields=['buy_in', 'cash_out', 'hours_played'])
 
     class Meta:
         unique_together = ('game', 'player')
@@ -249,13 +312,13 @@ class GameStats(models.Model):
 
     @classmethod
     def get_user_stats(cls, user):
-        print(f"\n=== Calculating Stats for {user.username} ===")
-        stats = cls.objects.filter(player=user)
-        print(f"Found {stats.count()} game stats")
-        
-        total_games = stats.count()
-        if total_games == 0:
-            print("No games found, returning zeros")
+        """Read the user's totals and last six months from the stats rollups"""
+        try:
+            rollup = UserStatsRollup.objects.get(user=user)
+        except UserStatsRollup.DoesNotExist:
+            rollup = None
+
+        if rollup is None or rollup.total_games == 0:
             return {
                 'total_games': 0,
                 'total_profit': 0,
@@ -267,61 +330,29 @@ class GameStats(models.Model):
                 'biggest_loss': 0
             }
 
-        total_profit = sum((stat.cash_out - stat.buy_in) for stat in stats)
-        total_hours = sum(stat.hours_played for stat in stats)
-        total_buyin = sum(stat.buy_in for stat in stats)
-        
-        # Calculate biggest win and loss
-        profits = [(stat.cash_out - stat.buy_in) for stat in stats]
-        biggest_win = max(profits) if profits else 0
-        # Only count negative values for biggest loss
-        losses = [p for p in profits if p < 0]
-        biggest_loss = min(losses) if losses else 0
-        
-        print(f"Biggest win: ${biggest_win}")
-        print(f"Biggest loss: ${biggest_loss}")
-        
-        print(f"Stats calculated:")
-        print(f"- Total games: {total_games}")
-        print(f"- Total profit: ${total_profit}")
-        print(f"- Total hours: {total_hours}")
-        print(f"- ROI: {(total_profit / total_buyin * 100) if total_buyin > 0 else 0}%")
-        
-        # Add historical data
-        # Get stats for last 6 months
-        six_months_ago = timezone.now() - timezone.timedelta(days=180)
+        total_games = rollup.total_games
+        total_profit = rollup.total_profit
+        total_hours = rollup.total_hours
+        total_buyin = rollup.total_buy_in
+
+        # Add historical data for the last six calendar months
+        months = UserMonthlyStats.last_months(6)
+        buckets = {
+            bucket.month: bucket
+            for bucket in UserMonthlyStats.objects.filter(user=user, month__gte=months[0])
+        }
         monthly_stats = []
-        
-        for month in range(6):
-            start_date = six_months_ago + timezone.timedelta(days=30 * month)
-            end_date = start_date + timezone.timedelta(days=30)
-            
-            month_stats = cls.objects.filter(
-                player=user,
-                game__scheduled_time__gte=start_date,
-                game__scheduled_time__lt=end_date
-            )
-            
-            if month_stats.exists():
-                profit = sum((stat.cash_out - stat.buy_in) for stat in month_stats)
-                hours = sum(stat.hours_played for stat in month_stats)
-                games = month_stats.count()
-                
-                monthly_stats.append({
-                    'month': start_date.strftime('%b'),
-                    'profit': float(profit),
-                    'hours': float(hours),
-                    'games': games,
-                    'hourly_rate': float(profit / hours) if hours > 0 else 0
-                })
-            else:
-                monthly_stats.append({
-                    'month': start_date.strftime('%b'),
-                    'profit': 0,
-                    'hours': 0,
-                    'games': 0,
-                    'hourly_rate': 0
-                })
+        for month in months:
+            bucket = buckets.get(month)
+            profit = bucket.profit if bucket else 0
+            hours = bucket.hours if bucket else 0
+            monthly_stats.append({
+                'month': month.strftime('%b'),
+                'profit': float(profit),
+                'hours': float(hours),
+                'games': bucket.games if bucket else 0,
+                'hourly_rate': float(profit / hours) if hours > 0 else 0
+            })
 
         return {
             'total_games': total_games,
@@ -330,31 +361,169 @@ class GameStats(models.Model):
             'total_hours': total_hours,
             'avg_hourly_rate': total_profit / total_hours if total_hours > 0 else 0,
             'roi': (total_profit / total_buyin * 100) if total_buyin > 0 else 0,
-            'biggest_win': biggest_win,
-            'biggest_loss': biggest_loss,
+            'biggest_win': rollup.biggest_win,
+            'biggest_loss': rollup.biggest_loss,
             'total_buyin': total_buyin,
             'historical_data': monthly_stats
         }
 
-class Player(models.Model):
-    # ... existing Player model code ...
-    pass
+class UserStatsRollup(models.Model):
+    """
+    Running totals over a user's GameStats rows, kept current by
+    games.signals so profile and stats views read one row instead of
+    aggregating every game. Rebuild with `manage.py rebuild_stats_rollups`.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stats_rollup')
+    total_games = models.PositiveIntegerField(default=0)
+    win_count = models.PositiveIntegerField(default=0)
+    total_profit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_hours = models.DecimalField(max_digits=10, decimal_places=1, default=0)
+    total_buy_in = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Largest single-game profit (>= 0) and most negative single-game profit (<= 0)
+    biggest_win = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    biggest_loss = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
-class Friendship(models.Model):
-    user1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friendships_initiated')
-    user2 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friendships_received')
-    created_at = models.DateTimeField(auto_now_add=True)
-    status = models.CharField(max_length=20, choices=[
-        ('pending', 'Pending'),
-        ('accepted', 'Accepted'),
-        ('declined', 'Declined')
-    ], default='pending')
+    class Meta:
+        indexes = [
+            # Leaderboard order; also answers "how many players are ahead of me"
+            models.Index(fields=['-total_profit', 'user'], name='rollup_standings_idx'),
+        ]
+
+    def __str__(self):
+        return f"Stats rollup for {self.user.username}"
+
+    def as_poker_stats(self):
+        """The poker_stats dict profiles and user cards expose"""
+        total_games = self.total_games
+        total_profit = self.total_profit
+        total_hours = self.total_hours
+        total_buy_in = self.total_buy_in
+
+        return {
+            'total_games': total_games,
+            'total_profit': float(total_profit),
+            'total_hours': float(total_hours),
+            'average_profit_per_game': float(total_profit / total_games) if total_games > 0 else 0,
+            'hourly_rate': float(total_profit / total_hours) if total_hours > 0 else 0,
+            'roi_percentage': float((total_profit / total_buy_in) * 100) if total_buy_in > 0 else 0,
+            'biggest_win': float(self.biggest_win),
+            'biggest_loss': float(abs(self.biggest_loss)),
+            'win_rate': float(self.win_count / total_games * 100) if total_games > 0 else 0
+        }
+
+    @classmethod
+    def poker_stats_for(cls, user_ids):
+        """{user id: poker_stats} for many users in one query; users without games get zeros"""
+        rollups = cls.objects.in_bulk(set(user_ids), field_name='user_id')
+        return {
+            user_id: (rollups.get(user_id) or cls(user_id=user_id)).as_poker_stats()
+            for user_id in user_ids
+        }
+
+    @classmethod
+    def standings(cls, user_ids=None, limit=10):
+        """
+        Top `limit` players by total profit, read from the standings index.
+        Each row gets a `position` with tied players sharing a rank.
+        """
+        rows = cls.objects.filter(total_games__gt=0)
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        rows = list(
+            rows.select_related('user', 'user__clerkuser', 'user__profile')
+            .order_by('-total_profit', 'user_id')[:limit]
+        )
+        return cls.assign_positions(rows)
+
+    @staticmethod
+    def assign_positions(rows):
+        """Number rows already sorted by total_profit, tied players sharing a rank"""
+        for index, row in enumerate(rows):
+            if index and row.total_profit == rows[index - 1].total_profit:
+                row.position = rows[index - 1].position
+            else:
+                row.position = index + 1
+        return rows
+
+    @classmethod
+    def position_of(cls, user, user_ids=None):
+        """Rank of user among players with stats (optionally within user_ids), or None"""
+        try:
+            mine = cls.objects.get(user=user, total_games__gt=0)
+        except cls.DoesNotExist:
+            return None, None
+
+        ahead = cls.objects.filter(total_games__gt=0, total_profit__gt=mine.total_profit)
+        if user_ids is not None:
+            ahead = ahead.filter(user_id__in=user_ids)
+        return ahead.count() + 1, mine.total_profit
+
+class UserMonthlyStats(models.Model):
+    """Per-user totals bucketed by the calendar month the game was scheduled in"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_stats')
+    month = models.DateField()  # First day of the month
+    games = models.PositiveIntegerField(default=0)
+    profit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    hours = models.DecimalField(max_digits=10, decimal_places=1, default=0)
+
+    class Meta:
+        unique_together = ('user', 'month')
+        ordering = ['month']
+
+    def __str__(self):
+        return f"{self.user.username} {self.month:%Y-%m}"
+
+    @staticmethod
+    def month_of(moment):
+        return timezone.localtime(moment).date().replace(day=1)
+
+    @classmethod
+    def last_months(cls, count):
+        """First days of the last `count` calendar months, oldest first"""
+        month = cls.month_of(timezone.now())
+        months = [month]
+        for _ in range(count - 1):
+            month = (month - timezone.timedelta(days=1)).replace(day=1)
+            months.append(month)
+        return months[::-1]
+
+class UserDailyStats(models.Model):
+    """
+    Per-user totals by the day the game was scheduled. Only recent days are
+    kept, to answer weekly leaderboards; older buckets are pruned as new days
+    start, since UserMonthlyStats already carries their totals.
+    """
+    RETENTION_DAYS = 14
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField()
+    games = models.PositiveIntegerField(default=0)
+    profit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    hours = models.DecimalField(max_digits=10, decimal_places=1, default=0)
 
     class Meta:
-        unique_together = ('user1', 'user2')
+        unique_together = ('user', 'day')
+        ordering = ['day']
+        indexes = [
+            models.Index(fields=['day'], name='daily_stats_day_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user1.username} - {self.user2.username} ({self.status})"
+        return f"{self.user.username} {self.day}"
+
+    @staticmethod
+    def day_of(moment):
+        return timezone.localtime(moment).date()
+
+    @classmethod
+    def retention_start(cls):
+        """Oldest day that still has a bucket"""
+        return timezone.localdate() - timezone.timedelta(days=cls.RETENTION_DAYS)
+
+class Player(models.Model):
+    # ... existing Player model code ...
+    pass
 
 class Follow(models.Model):
     follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+class GameCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (scheduled_time, id), backed by the
+    (status, scheduled_time) index on Game. Each page is a range scan from an
+    opaque cursor, so page N costs the same as page 1 and no COUNT is run.
+    """
+    ordering = ('scheduled_time', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class ArchivedGameCursorPagination(GameCursorPagination):
+    """Same keyset, newest games first"""
+    ordering = ('-scheduled_time', '-id')
@@ -0,0 +1,246 @@
+"""
+Maintenance of the per-user stats rollups: UserStatsRollup for all-time
+totals, UserMonthlyStats and UserDailyStats for time buckets. games.signals
+folds every GameStats insert, update and delete in incrementally, and
+moves a game's stats between buckets when it is rescheduled;
+rebuild_user_rollups recomputes them from the raw rows and
+verify_user_rollups reports users whose rollups have drifted.
+"""
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Q, Sum, Count, Max, Min, Value, DateField, DecimalField, ExpressionWrapper
+from django.db.models.functions import Greatest, Least, TruncDate, TruncMonth
+from .models import Game, GameStats, UserStatsRollup, UserMonthlyStats, UserDailyStats
+
+ROLLUP_FIELDS = [
+    'total_games', 'win_count', 'total_profit', 'total_hours',
+    'total_buy_in', 'biggest_win', 'biggest_loss',
+]
+BUCKET_FIELDS = ['games', 'profit', 'hours']
+
+# Time bucket model -> name of its period field
+BUCKETS = {
+    UserMonthlyStats: 'month',
+    UserDailyStats: 'day',
+}
+
+PROFIT = ExpressionWrapper(
+    F('cash_out') - F('buy_in'),
+    output_field=DecimalField(max_digits=12, decimal_places=2)
+)
+
+def stats_entry(stats, previous=False):
+    """
+    Snapshot the values of a GameStats row that the rollups depend on.
+    previous=True reads the values as they were loaded from the database.
+    """
+    read = stats.tracker.previous if previous else lambda field: getattr(stats, field)
+    buy_in = Decimal(str(read('buy_in')))
+    cash_out = Decimal(str(read('cash_out')))
+    try:
+        scheduled_time = stats.game.scheduled_time
+    except Game.DoesNotExist:
+        scheduled_time = None
+    return {
+        'buy_in': buy_in,
+        'profit': cash_out - buy_in,
+        'hours': Decimal(str(read('hours_played'))),
+        **bucket_keys(scheduled_time),
+    }
+
+def bucket_keys(scheduled_time):
+    """The month and day buckets a game scheduled at scheduled_time counts in"""
+    return {
+        'month': UserMonthlyStats.month_of(scheduled_time) if scheduled_time else None,
+        'day': UserDailyStats.day_of(scheduled_time) if scheduled_time else None,
+    }
+
+def _decimal(value):
+    return Value(value, output_field=DecimalField(max_digits=12, decimal_places=2))
+
+def apply_stats_change(user_id, old=None, new=None):
+    """
+    Fold one GameStats change into the user's rollups with F() updates.
+    old is None for an insert and new is None for a delete. Taking a row out
+    only updates rollups that exist: when the row goes because its player
+    is being deleted, the rollups may have been cascaded away already.
+    """
+    zero = {'buy_in': Decimal('0'), 'profit': Decimal('0'), 'hours': Decimal('0')}
+    before, after = old or zero, new or zero
+    games = (new is not None) - (old is not None)
+    wins = (after['profit'] > 0) - (before['profit'] > 0)
+
+    with transaction.atomic():
+        if new is not None:
+            UserStatsRollup.objects.get_or_create(user_id=user_id)
+        updates = {
+            'total_games': F('total_games') + games,
+            'win_count': F('win_count') + wins,
+            'total_profit': F('total_profit') + _decimal(after['profit'] - before['profit']),
+            'total_hours': F('total_hours') + _decimal(after['hours'] - before['hours']),
+            'total_buy_in': F('total_buy_in') + _decimal(after['buy_in'] - before['buy_in']),
+        }
+        if after['profit'] > 0:
+            updates['biggest_win'] = Greatest(F('biggest_win'), _decimal(after['profit']))
+        elif after['profit'] < 0:
+            updates['biggest_loss'] = Least(F('biggest_loss'), _decimal(after['profit']))
+        UserStatsRollup.objects.filter(user_id=user_id).update(**updates)
+
+        # An extreme can only shrink by looking at the remaining rows again
+        if old is not None and old['profit'] != 0:
+            rollup = UserStatsRollup.objects.filter(user_id=user_id).first()
+            if rollup and old['profit'] in (rollup.biggest_win, rollup.biggest_loss):
+                _refresh_extremes(user_id)
+
+        for entry, sign in ((old, -1), (new, 1)):
+            if entry is not None:
+                _apply_to_buckets(user_id, entry, sign)
+
+def move_game_stats(game_id, old_time, new_time):
+    """
+    Move the stats of a rescheduled game from the buckets of old_time to
+    those of new_time; the all-time rollups do not depend on the date
+    """
+    old_keys, new_keys = bucket_keys(old_time), bucket_keys(new_time)
+    if old_keys == new_keys:
+        return
+    with transaction.atomic():
+        for stats in GameStats.objects.filter(game_id=game_id).select_related('game'):
+            entry = stats_entry(stats)
+            _apply_to_buckets(stats.player_id, {**entry, **old_keys}, -1)
+            _apply_to_buckets(stats.player_id, {**entry, **new_keys}, 1)
+
+def _apply_to_buckets(user_id, entry, sign):
+    for model, period in BUCKETS.items():
+        key = entry[period]
+        if key is None:
+            continue
+        if model is UserDailyStats and key < UserDailyStats.retention_start():
+            continue  # Too old for a day bucket; the month bucket has it
+
+        created = False
+        if sign > 0:
+            _, created = model.objects.get_or_create(user_id=user_id, **{period: key})
+        model.objects.filter(user_id=user_id, **{period: key}).update(
+            games=F('games') + sign,
+            profit=F('profit') + _decimal(sign * entry['profit']),
+            hours=F('hours') + _decimal(sign * entry['hours']),
+        )
+        if created and model is UserDailyStats:
+            prune_daily_stats()
+
+def prune_daily_stats():
+    """Drop day buckets that have aged out of the retention window"""
+    return UserDailyStats.objects.filter(day__lt=UserDailyStats.retention_start()).delete()[0]
+
+def _refresh_extremes(user_id):
+    extremes = GameStats.objects.filter(player_id=user_id).aggregate(
+        biggest_win=Max(PROFIT, filter=Q(cash_out__gt=F('buy_in'))),
+        biggest_loss=Min(PROFIT, filter=Q(cash_out__lt=F('buy_in'))),
+    )
+    UserStatsRollup.objects.filter(user_id=user_id).update(
+        biggest_win=extremes['biggest_win'] or 0,
+        biggest_loss=extremes['biggest_loss'] or 0,
+    )
+
+def compute_user_rollups(user_ids=None):
+    """
+    Aggregate raw GameStats rows into unsaved rollup objects, one query per
+    table. Returns (rollups by user id, buckets by (model, user id, period)).
+    """
+    stats = GameStats.objects.order_by()
+    if user_ids is not None:
+        stats = stats.filter(player_id__in=user_ids)
+
+    rollups = {}
+    for row in stats.values('player_id').annotate(
+        total_games=Count('id'),
+        win_count=Count('id', filter=Q(cash_out__gt=F('buy_in'))),
+        total_profit=Sum(PROFIT),
+        total_hours=Sum('hours_played'),
+        total_buy_in=Sum('buy_in'),
+        biggest_win=Max(PROFIT, filter=Q(cash_out__gt=F('buy_in'))),
+        biggest_loss=Min(PROFIT, filter=Q(cash_out__lt=F('buy_in'))),
+    ):
+        user_id = row.pop('player_id')
+        rollups[user_id] = UserStatsRollup(
+            user_id=user_id,
+            **{field: row[field] or 0 for field in ROLLUP_FIELDS}
+        )
+
+    periods = {
+        UserMonthlyStats: stats.annotate(
+            month=TruncMonth('game__scheduled_time', output_field=DateField())
+        ),
+        UserDailyStats: stats.annotate(
+            day=TruncDate('game__scheduled_time')
+        ).filter(day__gte=UserDailyStats.retention_start()),
+    }
+    buckets = {}
+    for model, rows in periods.items():
+        period = BUCKETS[model]
+        for row in rows.values('player_id', period).annotate(
+            games=Count('id'),
+            profit=Sum(PROFIT),
+            hours=Sum('hours_played'),
+        ):
+            buckets[(model, row['player_id'], row[period])] = model(
+                user_id=row['player_id'],
+                games=row['games'],
+                profit=row['profit'] or 0,
+                hours=row['hours'] or 0,
+                **{period: row[period]}
+            )
+    return rollups, buckets
+
+def _stored(model, user_ids):
+    rows = model.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return rows
+
+def rebuild_user_rollups(user_ids=None, batch_size=500):
+    """Replace stored rollups with ones computed from the raw rows"""
+    rollups, buckets = compute_user_rollups(user_ids)
+
+    with transaction.atomic():
+        _stored(UserStatsRollup, user_ids).delete()
+        UserStatsRollup.objects.bulk_create(rollups.values(), batch_size=batch_size)
+        for model in BUCKETS:
+            _stored(model, user_ids).delete()
+            model.objects.bulk_create(
+                [bucket for key, bucket in buckets.items() if key[0] is model],
+                batch_size=batch_size
+            )
+    return len(rollups)
+
+def verify_user_rollups(user_ids=None):
+    """Return the sorted ids of users whose stored rollups differ from the raw rows"""
+    rollups, buckets = compute_user_rollups(user_ids)
+
+    def values(obj, fields):
+        return tuple(Decimal(getattr(obj, field)) for field in fields)
+
+    drifted = set()
+    stored_ids = set()
+    for rollup in _stored(UserStatsRollup, user_ids):
+        stored_ids.add(rollup.user_id)
+        expected = rollups.get(rollup.user_id) or UserStatsRollup(user_id=rollup.user_id)
+        if values(rollup, ROLLUP_FIELDS) != values(expected, ROLLUP_FIELDS):
+            drifted.add(rollup.user_id)
+    drifted.update(set(rollups) - stored_ids)
+
+    stored_buckets = {}
+    for model, period in BUCKETS.items():
+        rows = _stored(model, user_ids).exclude(games=0)
+        if model is UserDailyStats:
+            rows = rows.filter(day__gte=UserDailyStats.retention_start())
+        for bucket in rows:
+            stored_buckets[(model, bucket.user_id, getattr(bucket, period))] = bucket
+
+    for key in set(stored_buckets) | set(buckets):
+        if key not in stored_buckets or key not in buckets:
+            drifted.add(key[1])
+        elif values(stored_buckets[key], BUCKET_FIELDS) != values(buckets[key], BUCKET_FIELDS):
+            drifted.add(key[1])
+    return sorted(drifted)
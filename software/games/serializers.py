@@ -1,11 +1,25 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Game, GamePlayer, GameStats
+from .models import Game, GamePlayer, GameStats, UserStatsRollup
 from users.serializers import ProfileSerializer
 from datetime import datetime
 from django.utils.dateparse import parse_datetime
 from django.utils import timezone
-from django.db.models import Sum
+from django.core.exceptions import ObjectDoesNotExist
+
+def get_avatar_url(user):
+    """
+    Avatar URL for user, read from the clerkuser/profile relations. Callers
+    are expected to select_related or prefetch both so no query is issued.
+    """
+    for relation in ('clerkuser', 'profile'):
+        try:
+            related = getattr(user, relation)
+        except ObjectDoesNotExist:
+            continue
+        if related.profile_image_url:
+            return related.profile_image_url
+    return None
 
 class UserSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
@@ -15,15 +29,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'image_url']
         
     def get_image_url(self, obj):
-        try:
-            if hasattr(obj, 'clerkuser') and obj.clerkuser:
-                return obj.clerkuser.profile_image_url
-            elif hasattr(obj, 'user_profile') and obj.user_profile:
-                return obj.user_profile.profile_image_url
-            return None
-        except Exception as e:
-            print(f"Error getting image_url for user {obj.username}: {str(e)}")
-            return None
+        return get_avatar_url(obj)
         
 class GamePlayerSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
@@ -34,15 +40,7 @@ class GamePlayerSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'is_admin', 'is_host', 'joined_at', 'image_url']
         
     def get_image_url(self, obj):
-        try:
-            if hasattr(obj.user, 'clerkuser') and obj.user.clerkuser:
-                return obj.user.clerkuser.profile_image_url
-            elif hasattr(obj.user, 'user_profile') and obj.user.user_profile:
-                return obj.user.user_profile.profile_image_url
-            return None
-        except Exception as e:
-            print(f"Error getting image_url for user {obj.user.username}: {str(e)}")
-            return None
+        return get_avatar_url(obj.user)
 
 class GameSerializer(serializers.ModelSerializer):
     players = GamePlayerSerializer(source='game_players', many=True, read_only=True)
@@ -63,15 +61,24 @@ class GameSerializer(serializers.ModelSerializer):
         read_only_fields = ['host', 'status']
 
     def get_is_hosted_by_me(self, obj):
+        # Annotated by GameViewSet.annotate_for_user on list endpoints
+        if hasattr(obj, 'hosted_by_me'):
+            return obj.hosted_by_me
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.host == request.user
+            return obj.host_id == request.user.id
         return False
 
     def get_is_player(self, obj):
+        # Annotated by GameViewSet.annotate_for_user on list endpoints
+        if hasattr(obj, 'user_is_player'):
+            return obj.user_is_player
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.game_players.filter(user=request.user).exists()
+            return any(
+                player.user_id == request.user.id
+                for player in obj.game_players.all()
+            )
         return False
 
     def validate_scheduled_time(self, value):
@@ -94,20 +101,19 @@ class GameStatsSerializer(serializers.ModelSerializer):
         read_only_fields = ['player', 'created_at', 'updated_at']
 
 class LeaderboardUserSerializer(serializers.ModelSerializer):
+    """A leaderboard row, built from a UserStatsRollup with `position` set"""
+    id = serializers.IntegerField(source='user_id', read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
     imageUrl = serializers.SerializerMethodField()
     winnings = serializers.SerializerMethodField()
     position = serializers.IntegerField(read_only=True)
 
     class Meta:
-        model = User
+        model = UserStatsRollup
         fields = ['id', 'username', 'imageUrl', 'winnings', 'position']
 
     def get_imageUrl(self, obj):
-        if hasattr(obj, 'clerkuser') and obj.clerkuser.profile_image_url:
-            return obj.clerkuser.profile_image_url
-        return None
+        return get_avatar_url(obj.user)
 
     def get_winnings(self, obj):
-        return GameStats.objects.filter(player=obj).aggregate(
-            total_winnings=Sum('cash_out') - Sum('buy_in')
-        )['total_winnings'] or 0
\ No newline at end of file
+        return obj.total_profit
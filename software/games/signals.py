@@ -0,0 +1,33 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver, Signal
+from .models import Game, GameStats
+from .rollups import apply_stats_change, move_game_stats, stats_entry
+
+# Sent by games.archiver with game_ids after a chunk of games is archived
+# with a set-based UPDATE, which bypasses post_save
+games_archived = Signal()
+
+@receiver(post_save, sender=GameStats)
+def update_stats_rollup(sender, instance, created, **kwargs):
+    """Fold a new or edited stats row into the player's rollups"""
+    if created:
+        apply_stats_change(instance.player_id, new=stats_entry(instance))
+    elif instance.tracker.changed():
+        apply_stats_change(
+            instance.player_id,
+            old=stats_entry(instance, previous=True),
+            new=stats_entry(instance)
+        )
+
+@receiver(post_delete, sender=GameStats)
+def remove_stats_from_rollup(sender, instance, **kwargs):
+    """Take a deleted stats row back out of the player's rollups"""
+    apply_stats_change(instance.player_id, old=stats_entry(instance, previous=True))
+
+@receiver(post_save, sender=Game)
+def move_stats_with_game(sender, instance, created, **kwargs):
+    """A rescheduled game's stats move to the month and day buckets of its new date"""
+    if not created and instance.tracker.has_changed('scheduled_time'):
+        move_game_stats(
+            instance.pk, instance.tracker.previous('scheduled_time'), instance.scheduled_time
+        )
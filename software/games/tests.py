@@ -1,3 +1,521 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from backend.testing import make_game, make_users
+from chat.models import Message
+from friends.models import FriendRequest, Friendship
+from notifications import outbox
+from notifications.models import Notification, OutboxEvent
+from users.models import Profile
+from .models import Game, GamePlayer, GameStats, UserStatsRollup, UserMonthlyStats, UserDailyStats
+from .archiver import archive_chunk, archive_past_due_games, scheduler_lock, SchedulerBusy
+from .rollups import verify_user_rollups
+
+
+class SeatReservationTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='host')
+        self.game = make_game(self.host, slots=3)
+
+    def test_host_takes_first_seat(self):
+        self.assertEqual(self.game.seats_taken, 1)
+        self.assertTrue(GamePlayer.objects.filter(game=self.game, user=self.host).exists())
+
+    def test_reserve_until_full(self):
+        alice = User.objects.create_user(username='alice')
+        bob = User.objects.create_user(username='bob')
+        carol = User.objects.create_user(username='carol')
+
+        self.assertIsNotNone(self.game.reserve_seat(alice))
+        self.assertIsNotNone(self.game.reserve_seat(bob))
+        self.assertIsNone(self.game.reserve_seat(carol))
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.seats_taken, 3)
+        self.assertEqual(self.game.game_players.count(), 3)
+
+    def test_duplicate_join_rolls_back_counter(self):
+        alice = User.objects.create_user(username='alice')
+        self.game.reserve_seat(alice)
+        with self.assertRaises(IntegrityError):
+            self.game.reserve_seat(alice)
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.seats_taken, 2)
+
+    def test_release_frees_seat(self):
+        alice = User.objects.create_user(username='alice')
+        player = self.game.reserve_seat(alice)
+
+        self.assertTrue(self.game.release_seat(player))
+        self.assertFalse(self.game.release_seat(player))
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.seats_taken, 1)
+        self.assertEqual(self.game.game_players.count(), 1)
+
+    def test_games_can_be_created_with_an_explicit_pk(self):
+        created = make_game(self.host, pk=9001)
+        self.assertEqual(Game.objects.get(pk=9001).seats_taken, 1)
+        self.assertTrue(GamePlayer.objects.filter(game=created, user=self.host).exists())
+
+        unsaved = Game(
+            pk=9002, host=self.host, title='Unsaved', location='LBC',
+            scheduled_time=timezone.now(), buy_in=20, slots=8, blinds=1
+        )
+        unsaved.save()
+        self.assertEqual(Game.objects.get(pk=9002).title, 'Unsaved')
+
+    def test_saving_a_stale_instance_keeps_seats_claimed_since(self):
+        stale = Game.objects.get(pk=self.game.pk)
+        self.game.reserve_seat(User.objects.create_user(username='alice'))
+
+        stale.title = 'Renamed'
+        stale.save()
+        stale.start_game()
+        self.client.force_login(self.host)
+        response = self.client.patch(
+            f'/api/games/{self.game.id}/', {'description': 'Bring chips'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.game.refresh_from_db()
+        self.assertEqual(
+            (self.game.title, self.game.status, self.game.seats_taken),
+            ('Renamed', 'in_progress', 2)
+        )
+
+    def test_join_and_leave_endpoints(self):
+        alice = User.objects.create_user(username='alice')
+        self.client.force_login(alice)
+
+        response = self.client.post(f'/api/games/{self.game.id}/join/')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(f'/api/games/{self.game.id}/join/')
+        self.assertEqual(response.json()['detail'], 'Already joined this game')
+
+        response = self.client.post(f'/api/games/{self.game.id}/leave/')
+        self.assertEqual(response.status_code, 200)
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.seats_taken, 1)
+
+
+class GameListQueryCountTests(TestCase):
+    URLS = ['/api/games/', '/api/games/my_games/', '/api/games/archived/']
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer')
+        self.client.force_login(self.viewer)
+
+    def seed(self, start, stop):
+        hosts = make_users('host', start, stop, image_url='https://img.example/a.png')
+        games = Game.objects.bulk_create(
+            Game(
+                host=host,
+                title=host.username,
+                location='LBC',
+                scheduled_time=timezone.now() + timedelta(days=1),
+                buy_in=20,
+                slots=8,
+                blinds=1,
+                status='archived' if i % 2 else 'upcoming',
+            )
+            for i, host in enumerate(hosts)
+        )
+        GamePlayer.objects.bulk_create(
+            [GamePlayer(game=game, user=game.host, is_admin=True) for game in games] +
+            [GamePlayer(game=game, user=self.viewer) for game in games]
+        )
+
+    def count_queries(self, games):
+        counts = {}
+        for url in self.URLS:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()['results']
+            self.assertEqual(len(data), min(games // 2, 50))
+            self.assertTrue(all(game['is_player'] for game in data))
+            self.assertTrue(all(game['players'][0]['image_url'] for game in data))
+            counts[url] = len(ctx.captured_queries)
+        return counts
+
+    def test_list_endpoints_use_constant_queries(self):
+        self.seed(0, 10)
+        small = self.count_queries(10)
+        self.seed(10, 1000)
+        self.assertEqual(self.count_queries(1000), small)
+
+    def test_cursor_pages_cover_every_game_without_count(self):
+        self.seed(0, 250)
+        seen = []
+        url = '/api/games/?page_size=40'
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+            body = response.json()
+            seen.extend(game['id'] for game in body['results'])
+            url = body['next']
+
+        self.assertEqual(len(seen), 125)
+        self.assertEqual(len(set(seen)), 125)
+        expected = list(
+            Game.objects.filter(status='upcoming')
+            .order_by('scheduled_time', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+
+class PrivateGameVisibilityTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer')
+        self.friend = User.objects.create_user(username='friend')
+        self.stranger = User.objects.create_user(username='stranger')
+        Friendship.link(self.viewer, self.friend)
+        self.client.force_login(self.viewer)
+
+    def seed(self, per_host):
+        """per_host private games for each host, plus one public game by the stranger"""
+        hosts = (self.viewer, self.friend, self.stranger)
+        games = Game.objects.bulk_create(
+            Game(
+                host=host,
+                title=f'{host.username} {i}',
+                location='LBC',
+                scheduled_time=timezone.now() + timedelta(days=1, minutes=i),
+                buy_in=20,
+                slots=8,
+                blinds=1,
+                private=True,
+            )
+            for host in hosts for i in range(per_host)
+        )
+        public = make_game(self.stranger, title='Open table')
+        # A private stranger game the viewer was seated in stays visible
+        seated = games[-1]
+        GamePlayer.objects.create(game=seated, user=self.viewer)
+        visible = {game.id for game in games if game.host_id != self.stranger.id}
+        return visible | {public.id, seated.id}
+
+    def list_ids(self):
+        seen = []
+        url = '/api/games/?page_size=100'
+        queries = set()
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            queries.add(len(ctx.captured_queries))
+            body = response.json()
+            seen.extend(game['id'] for game in body['results'])
+            url = body['next']
+        return seen, queries
+
+    def test_list_hides_private_games_of_non_friends_at_constant_cost(self):
+        small_visible = self.seed(2)
+        seen, small_queries = self.list_ids()
+        self.assertEqual(set(seen), small_visible)
+
+        visible = self.seed(1500) | small_visible
+        seen, queries = self.list_ids()
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(set(seen), visible)
+        # Same per-page cost for 4500 private games as for 6
+        self.assertEqual(queries, small_queries)
+        self.assertEqual(len(queries), 1)
+
+    def test_retrieve_join_and_my_games_respect_visibility(self):
+        hidden = make_game(self.stranger, private=True)
+        friends_game = make_game(self.friend, private=True)
+        self.assertEqual(self.client.get(f'/api/games/{hidden.id}/').status_code, 404)
+        self.assertEqual(self.client.post(f'/api/games/{hidden.id}/join/').status_code, 404)
+        self.assertEqual(self.client.post(f'/api/games/{friends_game.id}/join/').status_code, 200)
+
+        response = self.client.get('/api/games/my_games/')
+        self.assertEqual([game['id'] for game in response.json()['results']], [friends_game.id])
+
+        self.client.logout()
+        response = self.client.get('/api/games/')
+        self.assertEqual(response.json()['results'], [])
+
+
+class StatsRollupTests(TestCase):
+    def setUp(self):
+        self.player = User.objects.create_user(username='player')
+        self.games = [make_game(self.player, title=f'Game {i}') for i in range(4)]
+
+    def record(self, game, buy_in, cash_out, hours=2):
+        return GameStats.objects.create(
+            game=game, player=self.player,
+            buy_in=buy_in, cash_out=cash_out, hours_played=hours
+        )
+
+    def test_rollup_follows_create_update_delete(self):
+        self.record(self.games[0], 20, 80)
+        loss = self.record(self.games[1], 50, 10)
+        big = self.record(self.games[2], 20, 120, hours=4)
+
+        rollup = UserStatsRollup.objects.get(user=self.player)
+        self.assertEqual(rollup.total_games, 3)
+        self.assertEqual(rollup.win_count, 2)
+        self.assertEqual(rollup.total_profit, Decimal('120'))
+        self.assertEqual(rollup.biggest_win, Decimal('100'))
+        self.assertEqual(rollup.biggest_loss, Decimal('-40'))
+
+        big.cash_out = Decimal('30')
+        big.save()
+        loss.delete()
+
+        rollup.refresh_from_db()
+        self.assertEqual(rollup.total_games, 2)
+        self.assertEqual(rollup.total_profit, Decimal('70'))
+        self.assertEqual(rollup.biggest_win, Decimal('60'))
+        self.assertEqual(rollup.biggest_loss, Decimal('0'))
+        self.assertEqual(verify_user_rollups(), [])
+
+    def test_rescheduling_a_game_moves_its_stats_between_buckets(self):
+        played = timezone.now() - timedelta(days=3)
+        game = make_game(self.player, scheduled_time=played)
+        self.record(game, 20, 80)
+
+        game.scheduled_time = played - timedelta(days=37)
+        game.save()
+        self.assertEqual(verify_user_rollups(), [])
+        self.assertFalse(UserMonthlyStats.objects.filter(
+            user=self.player, month=UserMonthlyStats.month_of(played), games__gt=0
+        ).exists())
+        self.assertFalse(UserDailyStats.objects.filter(user=self.player, games__gt=0).exists())
+
+        game.scheduled_time = played
+        game.save(update_fields=['scheduled_time', 'updated_at'])
+        self.assertEqual(verify_user_rollups(), [])
+        self.assertEqual(
+            UserDailyStats.objects.get(user=self.player, day=UserDailyStats.day_of(played)).games, 1
+        )
+
+    def test_deleting_a_player_with_stats_drops_their_rollups(self):
+        guest = User.objects.create_user(username='guest')
+        self.record(self.games[0], 20, 80)
+        for game in self.games[:2]:
+            GameStats.objects.create(
+                game=game, player=guest, buy_in=20, cash_out=5, hours_played=1
+            )
+
+        guest.delete()
+        self.assertFalse(UserStatsRollup.objects.filter(user_id=guest.id).exists())
+        self.assertFalse(UserMonthlyStats.objects.filter(user_id=guest.id).exists())
+        self.assertEqual(verify_user_rollups(), [])
+
+        self.player.delete()
+        self.assertFalse(UserStatsRollup.objects.exists())
+        self.assertFalse(UserDailyStats.objects.exists())
+
+    def test_user_stats_reads_rollup_in_constant_queries(self):
+        self.record(self.games[0], 20, 80)
+        with self.assertNumQueries(2):
+            stats = GameStats.get_user_stats(self.player)
+        self.assertEqual(stats['total_games'], 1)
+        self.assertEqual(stats['historical_data'][-1]['games'], 1)
+
+        profile = Profile.objects.create(user=self.player, clerk_id='user_player')
+        with self.assertNumQueries(1):
+            poker_stats = profile.get_poker_stats()
+        self.assertEqual(poker_stats['total_profit'], 60.0)
+        self.assertEqual(poker_stats['win_rate'], 100.0)
+
+    def test_rebuild_command_repairs_drift(self):
+        self.record(self.games[0], 20, 80)
+        UserStatsRollup.objects.filter(user=self.player).update(total_games=7)
+        self.assertEqual(verify_user_rollups(), [self.player.id])
+
+        call_command('rebuild_stats_rollups', stdout=StringIO())
+        self.assertEqual(UserStatsRollup.objects.get(user=self.player).total_games, 1)
+        self.assertEqual(verify_user_rollups(), [])
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user(username='me')
+        self.game = make_game(self.me)
+        self.players = {}
+        for name, profit in [('ace', 300), ('king', 150), ('queen', 150), ('me', 50), ('jack', -20)]:
+            user = self.me if name == 'me' else User.objects.create_user(username=name)
+            GameStats.objects.create(
+                game=self.game, player=user,
+                buy_in=100, cash_out=100 + profit, hours_played=3
+            )
+            self.players[name] = user
+        self.client.force_login(self.me)
+
+    def test_global_top_n_shares_tied_positions(self):
+        with self.assertNumQueries(3):  # session, user, standings
+            response = self.client.get('/api/games/leaderboard/?type=global&limit=4')
+        rows = response.json()
+        self.assertEqual([row['username'] for row in rows], ['ace', 'king', 'queen', 'me'])
+        self.assertEqual([row['position'] for row in rows], [1, 2, 2, 4])
+        self.assertEqual(rows[0]['winnings'], 300.0)
+
+    def test_friends_leaderboard_and_my_rank(self):
+        FriendRequest.objects.create(sender=self.me, receiver=self.players['queen'], status='accepted')
+        FriendRequest.objects.create(sender=self.players['jack'], receiver=self.me, status='accepted')
+        FriendRequest.objects.create(sender=self.me, receiver=self.players['ace'], status='pending')
+
+        rows = self.client.get('/api/games/leaderboard/?type=friends').json()
+        self.assertEqual([row['username'] for row in rows], ['queen', 'me', 'jack'])
+        self.assertEqual([row['position'] for row in rows], [1, 2, 3])
+
+        mine = self.client.get('/api/games/leaderboard/me/?type=friends').json()
+        self.assertEqual(mine['position'], 2)
+        mine = self.client.get('/api/games/leaderboard/me/?type=global').json()
+        self.assertEqual(mine['position'], 4)
+
+
+class WindowedLeaderboardTests(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user(username='me')
+        self.rival = User.objects.create_user(username='rival')
+        self.client.force_login(self.me)
+
+    def record(self, user, days_ago, profit):
+        game = make_game(user, scheduled_time=timezone.now() - timedelta(days=days_ago))
+        GameStats.objects.create(
+            game=game, player=user,
+            buy_in=100, cash_out=100 + profit, hours_played=2
+        )
+
+    def board(self, period):
+        response = self.client.get(f'/api/games/leaderboard/?type=global&period={period}')
+        return [(row['username'], row['winnings']) for row in response.json()]
+
+    def test_windows_sum_only_their_buckets(self):
+        self.record(self.me, 0, 40)
+        self.record(self.rival, 0, 10)
+        self.record(self.rival, 45, 500)
+        self.record(self.rival, 400, 1000)
+
+        self.assertEqual(self.board('week'), [('me', 40.0), ('rival', 10.0)])
+        self.assertEqual(self.board('month'), [('me', 40.0), ('rival', 10.0)])
+        self.assertEqual(self.board('all'), [('rival', 1510.0), ('me', 40.0)])
+
+        mine = self.client.get('/api/games/leaderboard/me/?type=global&period=week').json()
+        self.assertEqual(mine['position'], 1)
+        response = self.client.get('/api/games/leaderboard/?period=decade')
+        self.assertEqual(response.status_code, 400)
+
+    def test_expired_day_buckets_are_compacted(self):
+        stale_day = timezone.localdate() - timedelta(days=UserDailyStats.RETENTION_DAYS + 5)
+        UserDailyStats.objects.create(user=self.rival, day=stale_day, games=1, profit=5)
+
+        self.record(self.me, 0, 40)
+        self.assertFalse(UserDailyStats.objects.filter(day=stale_day).exists())
+        self.assertTrue(UserMonthlyStats.objects.filter(user=self.me).exists())
+        self.assertEqual(verify_user_rollups([self.me.id]), [])
+
+
+class PastDueArchiverTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='host')
+        self.player = User.objects.create_user(username='player')
+        past = timezone.now() - timedelta(hours=6)
+        self.due = [make_game(self.host, title=f'Due {i}', scheduled_time=past) for i in range(5)]
+        self.due[0].reserve_seat(self.player)
+        Game.objects.filter(pk=self.due[1].pk).update(status='in_progress')
+        self.future = make_game(self.host)
+        self.finished = make_game(self.host, scheduled_time=past)
+        Game.objects.filter(pk=self.finished.pk).update(status='completed')
+        outbox.drain()
+
+    def test_due_games_are_archived_in_chunks(self):
+        archived, _ = archive_past_due_games(chunk_size=2)
+        self.assertEqual(archived, 5)
+        self.assertEqual(
+            set(Game.objects.filter(status='archived').values_list('pk', flat=True)),
+            {game.pk for game in self.due}
+        )
+        self.assertEqual(Game.objects.get(pk=self.future.pk).status, 'upcoming')
+        self.assertEqual(Game.objects.get(pk=self.finished.pk).status, 'completed')
+        self.assertEqual(archive_past_due_games()[0], 0)
+
+    def test_side_effects_are_written_in_bulk(self):
+        archive_past_due_games(chunk_size=2)
+        # Games, their players, then one INSERT wrapped in a savepoint
+        with self.assertNumQueries(5):
+            Game.create_status_notifications([game.pk for game in self.due])
+        Notification.objects.all().delete()
+
+        self.assertEqual(outbox.drain(), (6, 0))  # per chunk of 2: notifications and chat
+        self.assertEqual(Notification.objects.filter(type='GAME_ENDED').count(), 6)  # host x5, player
+        self.assertEqual(Notification.objects.filter(user=self.player).count(), 1)
+        self.assertEqual(
+            Message.objects.filter(content='Game has ended', chat__game__in=self.due).count(), 5
+        )
+
+    def test_games_that_changed_after_selection_are_skipped(self):
+        # The finished game is selected, then its status no longer matches at the UPDATE
+        selected = Game.objects.filter(pk__in=[self.due[0].pk, self.finished.pk])
+        with mock.patch('games.archiver.past_due_games', return_value=selected):
+            self.assertEqual(archive_chunk(timezone.now()), (2, [self.due[0].pk]))
+        self.assertEqual(Game.objects.get(pk=self.finished.pk).status, 'completed')
+        self.assertEqual(
+            list(OutboxEvent.objects.filter(kind='games.archived').values_list('payload', flat=True)),
+            [{'game_ids': [self.due[0].pk]}]
+        )
+
+    def test_command_reports_throughput(self):
+        out = StringIO()
+        call_command('archive_past_games', '--once', stdout=out)
+        self.assertIn('Archived 5 games', out.getvalue())
+        self.assertIn('games/s', out.getvalue())
+
+    def test_lock_keeps_a_second_archiver_out(self):
+        lock_path = f'/tmp/pokeru-archiver-test-{self.host.pk}.lock'
+        with scheduler_lock(lock_path):
+            with self.assertRaises(SchedulerBusy):
+                with scheduler_lock(lock_path):
+                    pass
+        with scheduler_lock(lock_path):
+            pass
+
+
+class ConcurrentJoinTests(TransactionTestCase):
+    SLOTS = 9
+    JOINERS = 300
+
+    def test_parallel_joins_never_overfill(self):
+        host = User.objects.create_user(username='host')
+        game = make_game(host, slots=self.SLOTS)
+        users = User.objects.bulk_create(
+            User(username=f'player{i}') for i in range(self.JOINERS)
+        )
+
+        def join(user):
+            try:
+                for _ in range(50):
+                    try:
+                        return Game.objects.get(pk=game.pk).reserve_seat(user) is not None
+                    except OperationalError:
+                        # SQLite reports lock contention instead of blocking
+                        continue
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(join, users))
+
+        game.refresh_from_db()
+        seated = game.game_players.count()
+        self.assertEqual(results.count(True), self.SLOTS - 1)
+        self.assertEqual(seated, self.SLOTS)
+        self.assertEqual(game.seats_taken, seated)
@@ -1,6 +1,8 @@
 from rest_framework import viewsets
-from .models import Game, GamePlayer, GameStats
+from .models import Game, GamePlayer, GameStats, UserStatsRollup
 from .serializers import GameSerializer, GameStatsSerializer, LeaderboardUserSerializer
+from .pagination import GameCursorPagination, ArchivedGameCursorPagination
+from .leaderboards import PERIODS, window_standings, window_position
 from users.authentication import ClerkAuthentication
 from rest_framework import permissions
 from rest_framework.response import Response
@@ -13,16 +15,18 @@ from users.models import Profile
 from django.views.decorators.http import require_http_methods
 from django.http import JsonResponse
 from notifications.models import Notification
+from friends.models import FriendRequest
 import random
-from django.db.models import Sum, F, Window
-from django.db.models.functions import Rank
+from django.db.models import Prefetch, Exists, OuterRef, Case, When, Value, BooleanField
 from django.contrib.auth.models import User
+from django.db import IntegrityError
 
 logger = logging.getLogger(__name__)
 
 class GameViewSet(viewsets.ModelViewSet):
     serializer_class = GameSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = GameCursorPagination
 
     def get_serializer_context(self):
         print("\n=== Serializer Context ===")
@@ -44,15 +48,8 @@ class GameViewSet(viewsets.ModelViewSet):
         """
         print("\n=== Fetching Games ===")
         
-        # Start with all games
-        queryset = Game.objects.select_related(
-            'host',
-            'host__clerkuser'
-        ).prefetch_related(
-            'game_players',
-            'game_players__user',
-            'game_players__user__clerkuser'
-        )
+        # Start with every game the user may see (private ones only via friends)
+        queryset = self.with_related(Game.visible_to(self.request.user))
         
         # Get status from query params
         status_params = self.request.query_params.getlist('status')
@@ -66,9 +63,45 @@ class GameViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(status__in=['upcoming', 'in_progress'])
         
         # Order by scheduled time
-        queryset = queryset.order_by('scheduled_time')
-        
-        print(f"Found {queryset.count()} games")
+        return queryset.order_by('scheduled_time', 'id')
+
+    def with_related(self, queryset, annotate=True):
+        """
+        Load everything GameSerializer reads up front so a page of games is
+        serialized with a fixed number of queries, however many games it holds
+        """
+        queryset = queryset.select_related(
+            'host',
+            'host__clerkuser',
+            'host__profile'
+        ).prefetch_related(
+            Prefetch(
+                'game_players',
+                queryset=GamePlayer.objects.select_related(
+                    'user',
+                    'user__clerkuser',
+                    'user__profile'
+                )
+            )
+        )
+        if annotate:
+            queryset = self.annotate_for_user(queryset)
+        return queryset
+
+    def annotate_for_user(self, queryset):
+        """Compute is_player and is_hosted_by_me in SQL instead of per game"""
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                user_is_player=Exists(
+                    GamePlayer.objects.filter(game=OuterRef('pk'), user=user)
+                ),
+                hosted_by_me=Case(
+                    When(host_id=user.id, then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField()
+                )
+            )
         return queryset
 
     def list(self, request, *args, **kwargs):
@@ -79,10 +112,11 @@ class GameViewSet(viewsets.ModelViewSet):
         print(f"Query params: {request.query_params}")
         
         queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
         
         print(f"Returning {len(serializer.data)} games")
-        return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     def destroy(self, request, *args, **kwargs):
         game = self.get_object()
@@ -98,22 +132,22 @@ class GameViewSet(viewsets.ModelViewSet):
     def join(self, request, pk=None):
         game = self.get_object()
         
-        # Check if game is full
-        if game.player_count >= game.slots:
+        # Claim a seat atomically; the unique (game, user) constraint
+        # rejects a second seat for the same user
+        try:
+            player = game.reserve_seat(request.user)
+        except IntegrityError:
             return Response(
-                {"detail": "Game is full"}, 
+                {"detail": "Already joined this game"}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
-            
-        # Check if user is already in the game
-        if GamePlayer.objects.filter(user=request.user, game=game).exists():
+        
+        if player is None:
             return Response(
-                {"detail": "Already joined this game"}, 
+                {"detail": "Game is full"}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
             
-        # Create GamePlayer instance
-        GamePlayer.objects.create(user=request.user, game=game)
         serializer = self.get_serializer(game)
         return Response(serializer.data)
 
@@ -139,7 +173,7 @@ class GameViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
                 
-            player.delete()
+            game.release_seat(player)
             serializer = self.get_serializer(game)
             return Response(serializer.data)
             
@@ -189,13 +223,15 @@ class GameViewSet(viewsets.ModelViewSet):
         Get archived games that the user participated in
         """
         user = request.user
-        archived_games = Game.objects.filter(
+        archived_games = self.with_related(Game.objects.filter(
             status='archived',
             game_players__user=user  # Only get games where user was a player
-        ).distinct()
+        ).distinct())
         
-        serializer = self.get_serializer(archived_games, many=True)
-        return Response(serializer.data)
+        paginator = ArchivedGameCursorPagination()
+        page = paginator.paginate_queryset(archived_games, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post'])
     def stats(self, request, pk=None):
@@ -249,14 +285,12 @@ class GameViewSet(viewsets.ModelViewSet):
 
     def get_object(self):
         """
-        Override get_object to allow retrieving archived games
+        Override get_object to allow retrieving archived games. Private games
+        of non-friends are filtered out by the query, so they 404.
         """
-        queryset = Game.objects.select_related(
-            'host'
-        ).prefetch_related(
-            'game_players',
-            'game_players__user'
-        )
+        # Not annotated: join/leave change the caller's seat after the lookup,
+        # and GameSerializer then falls back to the (refreshed) player list
+        queryset = self.with_related(Game.visible_to(self.request.user), annotate=False)
         
         # Lookup the game
         lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
@@ -294,7 +328,7 @@ class GameViewSet(viewsets.ModelViewSet):
         
         # Simply update the status - notifications will be handled by the Game model's save method
         game.status = new_status
-        game.save()
+        game.save(update_fields=['status', 'updated_at'])
         
         serializer = self.get_serializer(game)
         return Response(serializer.data)
@@ -313,7 +347,7 @@ class GameViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            player.delete()
+            game.release_seat(player)
             serializer = self.get_serializer(game)
             return Response(serializer.data)
             
@@ -335,13 +369,13 @@ class GameViewSet(viewsets.ModelViewSet):
         user = request.user
         
         # Get upcoming and in-progress games
-        active_games = Game.objects.filter(
+        active_games = Game.visible_to(user).filter(
             game_players__user=user,
             status__in=['upcoming', 'in_progress']
         )
 
         # Get completed games without player stats
-        completed_games = Game.objects.filter(
+        completed_games = Game.visible_to(user).filter(
             game_players__user=user,
             status='completed'
         ).exclude(
@@ -352,17 +386,11 @@ class GameViewSet(viewsets.ModelViewSet):
         games = (active_games | completed_games).distinct().order_by('scheduled_time')
 
         # Add related data
-        games = games.select_related(
-            'host',
-            'host__clerkuser'
-        ).prefetch_related(
-            'game_players',
-            'game_players__user',
-            'game_players__user__clerkuser'
-        )
+        games = self.with_related(games)
 
-        serializer = self.get_serializer(games, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(games)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def notifications(self, request):
@@ -398,48 +426,79 @@ class GameViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-    @action(detail=False)
-    def leaderboard(self, request):
-        """Get global or friends leaderboard"""
-        is_global = request.query_params.get('type') == 'global'
-        
-        # Start with all users who have played games
-        users = User.objects.filter(
-            game_stats__isnull=False
-        ).distinct()
-
-        # Calculate total winnings for each user
-        users = users.annotate(
-            winnings=Sum(F('game_stats__cash_out') - F('game_stats__buy_in'))
-        )
+    def leaderboard_scope(self, request):
+        """User ids the leaderboard is limited to, or None for everyone"""
+        if request.query_params.get('type') == 'global':
+            return None
+        if not request.user.is_authenticated:
+            return set()
+        # Friends leaderboard: accepted friends plus the caller
+        return FriendRequest.friend_ids(request.user) | {request.user.id}
 
-        # If friends leaderboard, filter to only friends
-        if not is_global:
-            # Implement friend filtering here when friend system is added
-            pass
+    def leaderboard_period(self, request):
+        """'all' or one of leaderboards.PERIODS, from ?period="""
+        period = request.query_params.get('period', 'all')
+        if period != 'all' and period not in PERIODS:
+            return None
+        return period
 
-        # Add position using window function and order by winnings
-        users = users.annotate(
-            position=Window(
-                expression=Rank(),
-                order_by=F('winnings').desc(nulls_last=True)
+    @action(detail=False)
+    def leaderboard(self, request):
+        """Get global or friends leaderboard, all-time or for this week/month/season"""
+        period = self.leaderboard_period(request)
+        if period is None:
+            return Response(
+                {"detail": f"period must be one of: all, {', '.join(PERIODS)}"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        ).order_by('position')[:10]  # Get top 10
 
-        print(f"\n=== Leaderboard Query ===")
-        print(f"Type: {'Global' if is_global else 'Friends'}")
-        print(f"Found {users.count()} users")
-        
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+        except ValueError:
+            limit = 10
+
+        scope = self.leaderboard_scope(request)
+        if period == 'all':
+            users = UserStatsRollup.standings(scope, limit=limit)
+        else:
+            users = window_standings(period, scope, limit=limit)
         serializer = LeaderboardUserSerializer(users, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, url_path='leaderboard/me')
+    def leaderboard_me(self, request):
+        """Get the caller's position on the global or friends leaderboard"""
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Authentication required"}, 
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        period = self.leaderboard_period(request)
+        if period is None:
+            return Response(
+                {"detail": f"period must be one of: all, {', '.join(PERIODS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        scope = self.leaderboard_scope(request)
+        if period == 'all':
+            position, winnings = UserStatsRollup.position_of(request.user, scope)
+        else:
+            position, winnings = window_position(request.user, period, scope)
+        return Response({
+            'id': request.user.id,
+            'position': position,
+            'winnings': winnings or 0
+        })
+
 @require_http_methods(['POST'])
 def remove_player(request, game_id):
     try:
         game = Game.objects.get(id=game_id)
         player = request.user
         game_player = GamePlayer.objects.get(game=game, user=player)
-        game_player.delete()
+        game.release_seat(game_player)
         return Response(GameSerializer(game).data)
     except Exception as e:
         return Response({'error': str(e)}, status=400)
\ No newline at end of file
@@ -1,8 +1,14 @@
 from django.contrib import admin
-from .models import Notification
+from .models import Notification, OutboxEvent
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
     list_display = ('user', 'type', 'title', 'created_at', 'read')
     list_filter = ('type', 'read', 'created_at')
-    search_fields = ('title', 'message') 
\ No newline at end of file
+    search_fields = ('title', 'message')
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'available_at', 'processed_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('idempotency_key',)
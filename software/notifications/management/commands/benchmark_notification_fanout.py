@@ -0,0 +1,82 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from backend.benchmarks import RollbackBenchmark
+from games.models import Game, GamePlayer
+from notifications.models import Notification
+
+def per_row_notify(game):
+    """The old path: one INSERT per player plus a host exists() check"""
+    for game_player in game.game_players.select_related('user'):
+        Notification.objects.create(
+            user=game_player.user,
+            type='GAME_STARTED',
+            title='Game started!',
+            message=f'{game.title} is now in session',
+            game=game
+        )
+    if not game.game_players.filter(user=game.host).exists():
+        Notification.objects.create(
+            user=game.host,
+            type='GAME_STARTED',
+            title='Game started!',
+            message=f'{game.title} is now in session',
+            game=game
+        )
+
+def fan_out_notify(game):
+    game.create_game_notification(
+        'GAME_STARTED',
+        'Game started!',
+        f'{game.title} is now in session'
+    )
+
+class Command(BaseCommand):
+    help = 'Compares per-row and bulk game notification fan-out (all rows are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[10, 100, 1000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'players':>8} {'path':>9} {'queries':>8} {'best ms':>9}")
+        for players in options['players']:
+            for name, notify in (('per-row', per_row_notify), ('fan-out', fan_out_notify)):
+                queries, best = self.measure(players, notify, options['repeat'])
+                self.stdout.write(f"{players:>8} {name:>9} {queries:>8} {best * 1000:>9.1f}")
+
+    def measure(self, players, notify, repeat):
+        try:
+            with transaction.atomic():
+                game = self.seed(players)
+                timings = []
+                for _ in range(repeat):
+                    with transaction.atomic():
+                        with CaptureQueriesContext(connection) as ctx:
+                            started = time.perf_counter()
+                            notify(game)
+                            timings.append(time.perf_counter() - started)
+                    Notification.objects.filter(game=game).delete()
+                raise RollbackBenchmark((len(ctx.captured_queries), min(timings)))
+        except RollbackBenchmark as result:
+            return result.args[0]
+
+    def seed(self, players):
+        tag = f'bench{time.monotonic_ns()}'
+        users = User.objects.bulk_create(
+            User(username=f'{tag}_{i}') for i in range(players)
+        )
+        game = Game.objects.create(
+            host=users[0],
+            title='Benchmark game',
+            location='Benchmark',
+            scheduled_time=timezone.now(),
+            buy_in=0,
+            slots=players,
+            blinds=0
+        )
+        GamePlayer.objects.bulk_create(GamePlayer(game=game, user=user) for user in users[1:])
+        return game
@@ -0,0 +1,40 @@
+import time
+from django.core.management.base import BaseCommand
+from notifications.outbox import drain, prune, MAX_ATTEMPTS
+
+class Command(BaseCommand):
+    help = 'Applies queued outbox events (notifications, chat messages and membership)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Drain what is due and exit instead of polling')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Threads applying each batch')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--prune-interval', type=float, default=3600.0,
+                            help='Seconds between deletions of old done events')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Outbox worker started')
+        pruned_at = None
+        while True:
+            done, failed = drain(
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                max_attempts=options['max_attempts']
+            )
+            if done or failed:
+                self.stdout.write(f'Applied {done} events, {failed} failed')
+            if pruned_at is None or time.monotonic() - pruned_at >= options['prune_interval']:
+                pruned = prune()
+                pruned_at = time.monotonic()
+                if pruned:
+                    self.stdout.write(f'Deleted {pruned} old events')
+            if options['once']:
+                break
+            if not done and not failed:
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Outbox worker stopped'))
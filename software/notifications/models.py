@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
 from games.models import Game
 
 class Notification(models.Model):
@@ -25,4 +26,69 @@ class Notification(models.Model):
         ordering = ['-created_at']
 
     def __str__(self):
-        return f"{self.type} - {self.title} for {self.user.username}" 
\ No newline at end of file
+        return f"{self.type} - {self.title} for {self.user.username}"
+
+    @classmethod
+    def fan_out(cls, user_ids, type, title, message, game=None):
+        """
+        Create the same notification for every user in user_ids with a single
+        bulk insert. Duplicate and empty ids are dropped first.
+        """
+        return cls.fan_out_many([(user_ids, type, title, message, game)])
+
+    @classmethod
+    def fan_out_many(cls, batches):
+        """
+        Like fan_out for several notifications at once: batches holds
+        (user_ids, type, title, message, game) tuples and every row of every
+        batch goes into the same bulk insert.
+        """
+        notifications = []
+        for user_ids, type, title, message, game in batches:
+            recipients = [user_id for user_id in dict.fromkeys(user_ids) if user_id is not None]
+            notifications.extend(
+                cls(
+                    user_id=user_id,
+                    type=type,
+                    title=title,
+                    message=message,
+                    game=game
+                )
+                for user_id in recipients
+            )
+        with transaction.atomic():
+            return cls.objects.bulk_create(notifications)
+
+class OutboxEvent(models.Model):
+    """
+    A side effect recorded in the same transaction as the write that caused
+    it, and applied later by the outbox worker (see notifications.outbox).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=100)  # e.g., 'game.notify'
+    payload = models.JSONField(default=dict)
+    # Producers that may fire twice pass a key so the duplicate is dropped
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
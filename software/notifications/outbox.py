@@ -0,0 +1,195 @@
+"""
+Transactional outbox. Request handlers call enqueue() inside the
+transaction that makes a change; the side effects (notification rows, chat
+system messages, chat membership) are applied afterwards by the worker in
+`manage.py run_outbox_worker`, so request latency no longer grows with the
+number of side effects a write produces.
+
+Each event is applied and marked done in one transaction, so a handler's
+database writes happen exactly once even if the worker retries or crashes.
+A handler that needs a slow call to another service registers a fetch
+function; it runs before the transaction opens and its result is passed
+to the handler, so no database lock is held while waiting on the network.
+
+Done events are kept for OUTBOX_RETENTION_DAYS and then deleted by
+prune(), which the worker runs between batches. Failed events are kept
+until someone looks at them.
+"""
+import logging
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+FETCHERS = {}
+
+MAX_ATTEMPTS = 5
+# A claimed event whose worker has not finished within this window is reclaimed
+CLAIM_LEASE = timezone.timedelta(minutes=5)
+
+def handler(kind, fetch=None):
+    """
+    Register the function that applies events of this kind. With fetch, the
+    handler is called as func(payload, fetch(payload)), fetch running outside
+    the transaction.
+    """
+    def register(func):
+        HANDLERS[kind] = func
+        if fetch is not None:
+            FETCHERS[kind] = fetch
+        return func
+    return register
+
+def _claimed(event, worker_id):
+    return event.status == 'processing' and event.claimed_by == worker_id
+
+def enqueue(kind, payload, key=None):
+    """
+    Record a side effect in the caller's transaction. A second event with the
+    same idempotency key is silently dropped.
+    """
+    if key is None:
+        return OutboxEvent.objects.create(kind=kind, payload=payload)
+    # get_or_create inserts in a savepoint and falls back to reading the row
+    # if a concurrent enqueue won the unique key, so the caller's transaction
+    # survives the race
+    event, created = OutboxEvent.objects.get_or_create(
+        idempotency_key=key, defaults={'kind': kind, 'payload': payload}
+    )
+    return event if created else None
+
+def claim_batch(batch_size, worker_id):
+    """Mark up to batch_size due events as ours and return their ids"""
+    now = timezone.now()
+    due = OutboxEvent.objects.filter(
+        Q(status='pending', available_at__lte=now) |
+        Q(status='processing', claimed_at__lt=now - CLAIM_LEASE)
+    ).order_by('id').values_list('id', flat=True)[:batch_size]
+
+    # The status guard makes concurrent workers split a batch instead of sharing it
+    OutboxEvent.objects.filter(id__in=list(due)).filter(
+        Q(status='pending') | Q(status='processing', claimed_at__lt=now - CLAIM_LEASE)
+    ).update(status='processing', claimed_by=worker_id, claimed_at=now)
+    return list(
+        OutboxEvent.objects.filter(status='processing', claimed_by=worker_id, claimed_at=now)
+        .values_list('id', flat=True)
+    )
+
+def process_event(event_id, worker_id, max_attempts=MAX_ATTEMPTS):
+    """Apply one claimed event; returns True when it is done"""
+    try:
+        event = OutboxEvent.objects.get(pk=event_id)
+        if not _claimed(event, worker_id):
+            return False  # Reclaimed by another worker
+        fetch = FETCHERS.get(event.kind)
+        fetched = fetch(event.payload) if fetch else None
+
+        with transaction.atomic():
+            event = OutboxEvent.objects.get(pk=event_id)
+            if not _claimed(event, worker_id):
+                return False
+            if fetch:
+                HANDLERS[event.kind](event.payload, fetched)
+            else:
+                HANDLERS[event.kind](event.payload)
+            event.status = 'done'
+            event.attempts += 1
+            event.processed_at = timezone.now()
+            event.save(update_fields=['status', 'attempts', 'processed_at'])
+        return True
+    except Exception as e:
+        logger.error(f"Outbox event {event_id} failed: {e}")
+        error = traceback.format_exc()
+        try:
+            _record_failure(event_id, error, max_attempts)
+        except Exception:
+            # The claim lease runs out and another pass picks the event up again
+            logger.exception(f"Could not record failure of outbox event {event_id}")
+        return False
+
+def _record_failure(event_id, error, max_attempts):
+    event = OutboxEvent.objects.get(pk=event_id)
+    event.attempts += 1
+    event.last_error = error
+    if event.attempts >= max_attempts:
+        event.status = 'failed'
+    else:
+        # Exponential backoff: 2s, 4s, 8s, ...
+        event.status = 'pending'
+        event.available_at = timezone.now() + timezone.timedelta(seconds=2 ** event.attempts)
+    event.save(update_fields=['attempts', 'last_error', 'status', 'available_at'])
+
+def _process_in_thread(event_id, worker_id, max_attempts):
+    try:
+        return process_event(event_id, worker_id, max_attempts)
+    finally:
+        connection.close()
+
+def drain(batch_size=100, workers=1, max_attempts=MAX_ATTEMPTS, max_batches=None):
+    """
+    Apply due events batch by batch until none are left (or max_batches).
+    workers > 1 applies each batch on a thread pool, one connection per
+    thread. Returns (events done, events that failed this round).
+    """
+    worker_id = uuid.uuid4().hex
+    done = failed = batches = 0
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while max_batches is None or batches < max_batches:
+            event_ids = claim_batch(batch_size, worker_id)
+            if not event_ids:
+                break
+            batches += 1
+            if pool:
+                results = list(pool.map(
+                    lambda event_id: _process_in_thread(event_id, worker_id, max_attempts),
+                    event_ids
+                ))
+            else:
+                results = [process_event(event_id, worker_id, max_attempts) for event_id in event_ids]
+            done += results.count(True)
+            failed += results.count(False)
+    finally:
+        if pool:
+            pool.shutdown()
+    return done, failed
+
+def prune(retention=None, batch_size=1000):
+    """
+    Delete events that were done more than retention ago (a timedelta,
+    OUTBOX_RETENTION_DAYS by default), batch_size rows per statement so no
+    long lock is held. Returns the number deleted.
+    """
+    if retention is None:
+        retention = timezone.timedelta(days=settings.OUTBOX_RETENTION_DAYS)
+    cutoff = timezone.now() - retention
+    deleted = 0
+    while True:
+        ids = list(
+            OutboxEvent.objects.filter(status='done', processed_at__lt=cutoff)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += OutboxEvent.objects.filter(id__in=ids).delete()[0]
+
+@handler('game.notify')
+def notify_game(payload):
+    from games.models import Game
+
+    game = Game.objects.filter(pk=payload['game_id']).first()
+    if game is not None:
+        game.create_game_notification(payload['type'], payload['title'], payload['message'])
+
+@handler('games.archived')
+def notify_archived_games(payload):
+    from games.models import Game
+
+    Game.create_status_notifications(payload['game_ids'])
@@ -0,0 +1,169 @@
+
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from backend.testing import make_game
+from chat.models import Chat, ChatMember
+from games.models import GamePlayer
+from . import outbox
+from .models import Notification, OutboxEvent
+
+
+class GameNotificationFanOutTests(TestCase):
+    def make_seated_game(self, players):
+        host = User.objects.create_user(username=f'host{players}')
+        game = make_game(host, slots=players + 1)
+        users = User.objects.bulk_create(
+            User(username=f'p{players}_{i}') for i in range(players)
+        )
+        GamePlayer.objects.bulk_create(GamePlayer(game=game, user=user) for user in users)
+        return game
+
+    def test_start_game_notifies_each_recipient_once(self):
+        game = self.make_seated_game(5)
+        game.start_game()
+        self.assertFalse(Notification.objects.filter(game=game).exists())
+        outbox.drain()
+
+        notifications = Notification.objects.filter(game=game)
+        self.assertEqual(notifications.count(), 6)
+        self.assertEqual(notifications.values('user').distinct().count(), 6)
+        self.assertEqual(set(notifications.values_list('type', flat=True)), {'GAME_STARTED'})
+
+    def test_host_without_a_seat_is_still_notified(self):
+        game = self.make_seated_game(3)
+        GamePlayer.objects.filter(game=game, user=game.host).delete()
+        game.end_game()
+        outbox.drain()
+        self.assertTrue(Notification.objects.filter(game=game, user=game.host).exists())
+
+    def test_fan_out_query_count_does_not_grow_with_players(self):
+        small, large = self.make_seated_game(10), self.make_seated_game(100)
+        with self.assertNumQueries(4):  # recipients, savepoint, insert, release
+            small.create_game_notification('GAME_STARTED', 'Game started!', 'now')
+        with self.assertNumQueries(4):
+            large.create_game_notification('GAME_STARTED', 'Game started!', 'now')
+
+    def test_fan_out_drops_duplicates(self):
+        user = User.objects.create_user(username='solo')
+        created = Notification.fan_out([user.id, user.id, None], 'TEST', 'Hi', 'there')
+        self.assertEqual(len(created), 1)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='host')
+        self.calls = []
+        outbox.HANDLERS['test.record'] = self.calls.append
+
+    def tearDown(self):
+        outbox.HANDLERS.pop('test.record', None)
+        outbox.HANDLERS.pop('test.explode', None)
+
+    def test_game_side_effects_wait_for_the_worker(self):
+        game = make_game(self.host)
+        player = User.objects.create_user(username='player')
+        game.reserve_seat(player)
+        self.assertFalse(Chat.objects.filter(game=game).exists())
+
+        done, failed = outbox.drain()
+        # chat, host seat, player seat, and the two seats in the suggestion index
+        self.assertEqual((done, failed), (5, 0))
+        chat = Chat.objects.get(game=game)
+        self.assertEqual(
+            set(ChatMember.objects.filter(chat=chat).values_list('user__username', flat=True)),
+            {'host', 'player'}
+        )
+        self.assertEqual(chat.messages.count(), 2)
+        self.assertEqual(outbox.drain(), (0, 0))
+
+    def test_events_roll_back_with_the_write(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                outbox.enqueue('test.record', {'n': 1})
+                raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_duplicate_idempotency_key_is_dropped(self):
+        outbox.enqueue('test.record', {'n': 1}, key='once')
+        self.assertIsNone(outbox.enqueue('test.record', {'n': 2}, key='once'))
+        outbox.drain()
+        self.assertEqual(self.calls, [{'n': 1}])
+
+    def test_losing_an_idempotency_race_keeps_the_callers_write(self):
+        def racing(method):
+            # A concurrent enqueue commits the same key right after our lookup
+            def lookup(queryset, *args, **kwargs):
+                try:
+                    return method(queryset, *args, **kwargs)
+                finally:
+                    if not OutboxEvent.objects.filter(idempotency_key='once').count():
+                        OutboxEvent.objects.bulk_create([
+                            OutboxEvent(kind='test.record', payload={'n': 1}, idempotency_key='once')
+                        ])
+            return lookup
+
+        with transaction.atomic():
+            User.objects.create_user(username='still-here')
+            with mock.patch.object(QuerySet, 'get', racing(QuerySet.get)), \
+                    mock.patch.object(QuerySet, 'exists', racing(QuerySet.exists)):
+                self.assertIsNone(outbox.enqueue('test.record', {'n': 2}, key='once'))
+        self.assertTrue(User.objects.filter(username='still-here').exists())
+        outbox.drain()
+        self.assertEqual(self.calls, [{'n': 1}])
+
+    def test_failures_back_off_then_give_up(self):
+        def explode(payload):
+            raise ValueError('boom')
+        outbox.HANDLERS['test.explode'] = explode
+        event = outbox.enqueue('test.explode', {})
+
+        self.assertEqual(outbox.drain(max_attempts=2), (0, 1))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertGreater(event.available_at, timezone.now())
+        self.assertIn('boom', event.last_error)
+
+        OutboxEvent.objects.filter(pk=event.pk).update(available_at=timezone.now())
+        outbox.drain(max_attempts=2)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('failed', 2))
+
+
+    def test_prune_deletes_only_old_done_events(self):
+        old = timezone.now() - timezone.timedelta(days=30)
+        kept = [
+            OutboxEvent.objects.create(kind='test.record', status='done', processed_at=timezone.now()),
+            OutboxEvent.objects.create(kind='test.record', status='failed', processed_at=old),
+            OutboxEvent.objects.create(kind='test.record'),
+        ]
+        OutboxEvent.objects.bulk_create(
+            OutboxEvent(kind='test.record', status='done', processed_at=old) for _ in range(3)
+        )
+        self.assertEqual(outbox.prune(batch_size=2), 3)
+        self.assertEqual(list(OutboxEvent.objects.all()), kept)
+
+
+class ThreadedOutboxWorkerTests(TransactionTestCase):
+    def test_thread_pool_applies_every_event_once(self):
+        host = User.objects.create_user(username='host')
+        games = [make_game(host, title=f'Game {i}') for i in range(20)]
+        for game in games:
+            game.status = 'in_progress'
+            game.save()
+
+        for _ in range(10):
+            outbox.drain(batch_size=16, workers=4)
+            if not OutboxEvent.objects.exclude(status='done').exists():
+                break
+            # SQLite lock contention is retried after a backoff; skip the wait
+            OutboxEvent.objects.filter(status='pending').update(available_at=timezone.now())
+
+        self.assertFalse(OutboxEvent.objects.exclude(status='done').exists())
+        self.assertEqual(Notification.objects.count(), 20)
+        self.assertEqual(Chat.objects.count(), 20)
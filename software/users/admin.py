@@ -1,10 +1,17 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import ClerkUser
+from .models import ClerkUser, ClerkWebhookEvent
 
 class ClerkUserAdmin(admin.ModelAdmin):
     list_display = ('user', 'clerk_id')
     search_fields = ('user__username', 'user__email', 'clerk_id')
 
 admin.site.register(ClerkUser, ClerkUserAdmin)
+
+class ClerkWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'type', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'type')
+    search_fields = ('event_id',)
+
+admin.site.register(ClerkWebhookEvent, ClerkWebhookEventAdmin)
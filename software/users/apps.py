@@ -7,3 +7,8 @@ class UsersConfig(AppConfig):
 
     def ready(self):
         import users.signals
+        import users.clerk_api  # Registers the 'users.enrich' outbox handler
+        from .tokens import public_key
+
+        # Parse the Clerk public key once at startup rather than per request
+        public_key()
@@ -1,102 +1,84 @@
 from django.contrib.auth.backends import BaseBackend
 from django.contrib.auth.models import User
-from .models import ClerkUser
+from .models import ClerkUser, Profile
+from .tokens import ClerkIdentity, REQUEST_IDENTITY_ATTR, request_identity, verify_token, cached_user
+from .clerk_api import schedule_enrichment
 import jwt
-import requests
-from django.conf import settings
-from datetime import datetime, timezone
+import logging
+from django.db import IntegrityError, transaction
+
+logger = logging.getLogger(__name__)
 
 class ClerkAuthBackend(BaseBackend):
+    """
+    The one place a Clerk bearer token is verified and mapped to a User.
+    The outcome is stored on the request, so ClerkAuthMiddleware and DRF's
+    ClerkAuthentication share a single verification per request.
+    """
     def authenticate(self, request, token=None):
         if not token:
             return None
 
-        try:
-            # First decode without verification to check timing
-            unverified = jwt.decode(
-                token,
-                options={"verify_signature": False}
-            )
-            
-            # Get current time and token's iat
-            current_time = datetime.now(timezone.utc).timestamp()
-            token_iat = unverified.get('iat', 0)
-            
-            # If token's iat is in the future, use it as current time
-            verification_time = max(current_time, token_iat)
-            
-            # Decode and verify the token
-            decoded = jwt.decode(
-                token,
-                settings.CLERK_PUBLIC_KEY,
-                algorithms=['RS256'],
-                audience=None,
-                issuer=settings.CLERK_ISSUER,
-                options={
-                    'verify_exp': True,
-                    'verify_iat': True,
-                    'verify_nbf': False,
-                },
-                leeway=60,
-                clock_skew=60,
-                current_time=verification_time
-            )
+        identity = request_identity(request, token) if request is not None else None
+        if identity is None:
+            identity = self.resolve(token)
+            if request is not None:
+                setattr(request, REQUEST_IDENTITY_ATTR, identity)
+        return identity.user
 
-            print("\n=== Token Contents ===")
-            print("Claims:", decoded)
+    def resolve(self, token):
+        try:
+            claims = verify_token(token)
+        except jwt.InvalidTokenError as e:
+            logger.warning(f"Authentication error: {e}")
+            return ClerkIdentity(token, None, None, e)
 
-            clerk_user_id = decoded['sub']
-            
-            try:
-                clerk_user = ClerkUser.objects.get(clerk_id=clerk_user_id)
-                return clerk_user.user
-            except ClerkUser.DoesNotExist:
-                # Fetch user data from Clerk API
-                headers = {
-                    'Authorization': f'Bearer {settings.CLERK_SECRET_KEY}',
-                }
-                response = requests.get(
-                    f'https://api.clerk.com/v1/users/{clerk_user_id}',
-                    headers=headers
+        try:
+            clerk_id = claims['sub']
+            user = cached_user(clerk_id)
+            if user is None:
+                user = self.provision_user(clerk_id, claims)
+            elif not hasattr(user, 'profile'):
+                Profile.objects.create(
+                    user=user,
+                    clerk_id=clerk_id,
+                    bio='',  # Empty bio by default
+                    profile_image_url=user.clerkuser.profile_image_url
                 )
-                
-                if not response.ok:
-                    print(f"Failed to fetch Clerk user data: {response.text}")
-                    raise Exception("Failed to fetch Clerk user data")
+            return ClerkIdentity(token, user, claims, None)
+        except Exception as e:
+            logger.exception(f"Authentication error: {e}")
+            return ClerkIdentity(token, None, claims, e)
 
-                clerk_data = response.json()
-                print("Clerk API response:", clerk_data)  # Debug line
-                
-                # Get the primary email address
-                email_addresses = clerk_data.get('email_addresses', [])
-                primary_email = next((email['email_address'] for email in email_addresses if email.get('id')), '')
-                
-                # Get the username from Clerk data
-                username = clerk_data.get('username') or primary_email.split('@')[0]
-                
-                # Create Django user
+    def provision_user(self, clerk_id, claims):
+        """
+        Create the User, ClerkUser and Profile for a clerk_id seen for the
+        first time from the token claims alone. The Clerk API details are
+        filled in later by the outbox worker, so login never waits on it.
+        """
+        email = claims.get('email', '')
+        try:
+            with transaction.atomic():
                 user = User.objects.create_user(
-                    username=username,
-                    email=primary_email
+                    username=f"user_{clerk_id.split('_')[1]}",
+                    email=email
                 )
-                
-                # Get profile image if available
-                image_url = clerk_data.get('image_url', None)
-                
-                ClerkUser.objects.create(
+                ClerkUser.objects.create(user=user, clerk_id=clerk_id)
+                Profile.objects.create(
                     user=user,
-                    clerk_id=clerk_user_id,
-                    profile_image_url=image_url
+                    clerk_id=clerk_id,
+                    bio=''  # Empty bio by default
                 )
-                
-                return user
-
-        except Exception as e:
-            print(f"Authentication error: {str(e)}")
-            return None
+                schedule_enrichment(clerk_id)
+        except IntegrityError:
+            # A concurrent first request provisioned the same user
+            user = cached_user(clerk_id)
+            if user is None:
+                raise
+        return user
 
     def get_user(self, user_id):
         try:
             return User.objects.get(pk=user_id)
         except User.DoesNotExist:
-            return None 
\ No newline at end of file
+            return None
@@ -0,0 +1,142 @@
+"""
+Client for the Clerk backend API. One pooled requests.Session is shared by
+the process, every call is bounded by CLERK_API_TIMEOUT and transient
+failures are retried with backoff. CLERK_API_URL points it at Clerk, or at
+a local stand-in in tests.
+
+Users are provisioned from their token claims at first login and enriched
+from the API afterwards by the outbox worker ('users.enrich' events), so a
+login never waits on Clerk. After that, profile fields change only when a
+webhook or the sync_profile endpoint reports new values (sync_clerk_profile).
+"""
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.db import transaction
+from notifications.outbox import enqueue, handler
+from .models import ClerkUser, Profile
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+class ClerkAPIError(Exception):
+    """The Clerk API could not be reached or did not return the resource"""
+
+class ClerkClient:
+    def __init__(self, base_url, secret_key, timeout, retries, pool_size):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {secret_key}'
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=['GET'],
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_user(self, clerk_id):
+        try:
+            response = self.session.get(f'{self.base_url}/users/{clerk_id}', timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ClerkAPIError(f'Clerk API request failed: {e}') from e
+        if not response.ok:
+            raise ClerkAPIError(f'Clerk API responded {response.status_code}: {response.text}')
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+def clerk_client():
+    """The process-wide ClerkClient, built from settings on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ClerkClient(
+                base_url=settings.CLERK_API_URL,
+                secret_key=settings.CLERK_SECRET_KEY,
+                timeout=settings.CLERK_API_TIMEOUT,
+                retries=settings.CLERK_API_RETRIES,
+                pool_size=settings.CLERK_API_POOL_SIZE,
+            )
+        return _client
+
+def reset_clerk_client():
+    """Drop the shared client, e.g. after CLERK_API_URL changes"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+def primary_email(clerk_data):
+    addresses = clerk_data.get('email_addresses', [])
+    primary_id = clerk_data.get('primary_email_address_id')
+    for address in addresses:
+        if address.get('id') == primary_id:
+            return address.get('email_address', '')
+    return addresses[0].get('email_address', '') if addresses else ''
+
+def schedule_enrichment(clerk_id):
+    """Queue a background refresh of a provisioned user from the Clerk API"""
+    enqueue('users.enrich', {'clerk_id': clerk_id}, key=f'users.enrich:{clerk_id}')
+
+def clerk_profile_fields(clerk_data):
+    """
+    (username, email, image url) from either a Clerk user object (API and
+    webhooks) or the flat payload the app posts to sync_profile
+    """
+    email = clerk_data.get('email') or primary_email(clerk_data)
+    image_url = clerk_data.get('image_url') or clerk_data.get('profile_image_url')
+    return clerk_data.get('username'), email, image_url
+
+def sync_clerk_profile(clerk_user, clerk_data):
+    """
+    Copy the username, email and avatar Clerk reports onto the User,
+    ClerkUser and Profile. Each row is written at most once, with only the
+    fields that differ, and not at all when nothing changed. Returns the
+    names of the changed fields.
+    """
+    username, email, image_url = clerk_profile_fields(clerk_data)
+    user = clerk_user.user
+    user_fields = []
+    if email and user.email != email:
+        user.email = email
+        user_fields.append('email')
+    if username and user.username != username and \
+            not type(user).objects.filter(username=username).exclude(pk=user.pk).exists():
+        user.username = username
+        user_fields.append('username')
+
+    image_changed = bool(image_url) and clerk_user.profile_image_url != image_url
+    with transaction.atomic():
+        if user_fields:
+            user.save(update_fields=user_fields)
+        if image_changed:
+            clerk_user.profile_image_url = image_url
+            clerk_user.save(update_fields=['profile_image_url'])
+            Profile.objects.filter(user=user).exclude(
+                profile_image_url=image_url
+            ).update(profile_image_url=image_url)
+    return user_fields + (['profile_image_url'] if image_changed else [])
+
+def fetch_clerk_user(payload):
+    # Runs outside the outbox transaction: with retries the call can take
+    # tens of seconds, and must not hold the database write lock meanwhile
+    if ClerkUser.objects.filter(clerk_id=payload['clerk_id']).exists():
+        return clerk_client().get_user(payload['clerk_id'])
+    return None
+
+@handler('users.enrich', fetch=fetch_clerk_user)
+def enrich_user(payload, clerk_data):
+    clerk_user = ClerkUser.objects.select_related('user').filter(clerk_id=payload['clerk_id']).first()
+    if clerk_user is not None and clerk_data is not None:
+        sync_clerk_profile(clerk_user, clerk_data)
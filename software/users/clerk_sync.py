@@ -0,0 +1,206 @@
+"""
+Bulk application of Clerk user data. Webhook deliveries land in
+ClerkWebhookEvent (see users.webhooks) and apply_webhook_events folds a
+batch of them into User, ClerkUser and Profile rows with a handful of bulk
+queries; `manage.py import_clerk_users` feeds an export file through the
+same upsert_clerk_users in chunks.
+"""
+import logging
+import traceback
+from collections import namedtuple
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from .clerk_api import primary_email
+from .models import ClerkUser, Profile, ClerkWebhookEvent
+from .tokens import forget_user
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+ClerkRecord = namedtuple('ClerkRecord', ['clerk_id', 'username', 'email', 'image_url'])
+
+def clerk_record(data):
+    """A ClerkRecord from a Clerk user object, a webhook payload or an export row"""
+    return ClerkRecord(
+        clerk_id=data['id'],
+        username=data.get('username') or None,
+        email=data.get('primary_email_address') or data.get('email') or primary_email(data),
+        image_url=data.get('image_url') or data.get('profile_image_url') or None,
+    )
+
+def _free_usernames(records, taken):
+    """Pick a unique username per new record; clashes fall back to user_<clerk id>"""
+    names = {}
+    for record in records:
+        fallback = f"user_{record.clerk_id.split('_', 1)[-1]}"
+        candidate = record.username or (record.email.split('@')[0] if record.email else '') or fallback
+        if candidate in taken:
+            candidate = fallback
+        taken.add(candidate)
+        names[record.clerk_id] = candidate
+    return names
+
+def upsert_clerk_users(records, batch_size=500):
+    """
+    Create or update the User, ClerkUser and Profile of every record with
+    bulk queries. The last record per clerk_id wins. Returns (created, updated).
+    """
+    records = list({record.clerk_id: record for record in records}.values())
+    if not records:
+        return 0, 0
+
+    with transaction.atomic():
+        existing = {
+            clerk_user.clerk_id: clerk_user
+            for clerk_user in ClerkUser.objects.select_related('user', 'user__profile').filter(
+                clerk_id__in=[record.clerk_id for record in records]
+            )
+        }
+        new = [record for record in records if record.clerk_id not in existing]
+
+        if new:
+            wanted = {record.username for record in new if record.username}
+            wanted |= {record.email.split('@')[0] for record in new if record.email}
+            wanted |= {f"user_{record.clerk_id.split('_', 1)[-1]}" for record in new}
+            taken = set(User.objects.filter(username__in=wanted).values_list('username', flat=True))
+            usernames = _free_usernames(new, taken)
+            unusable_password = make_password(None)
+            users = User.objects.bulk_create([
+                User(username=usernames[record.clerk_id], email=record.email or '', password=unusable_password)
+                for record in new
+            ], batch_size=batch_size)
+            ClerkUser.objects.bulk_create([
+                ClerkUser(user=user, clerk_id=record.clerk_id, profile_image_url=record.image_url)
+                for record, user in zip(new, users)
+            ], batch_size=batch_size)
+            Profile.objects.bulk_create([
+                Profile(user=user, clerk_id=record.clerk_id, bio='', profile_image_url=record.image_url)
+                for record, user in zip(new, users)
+            ], batch_size=batch_size)
+
+        changed_users, changed_clerk_users, changed_profiles = [], [], []
+        wanted = {record.username for record in records if record.clerk_id in existing and record.username}
+        taken = set(User.objects.filter(username__in=wanted).values_list('username', flat=True))
+        for record in records:
+            clerk_user = existing.get(record.clerk_id)
+            if clerk_user is None:
+                continue
+            user = clerk_user.user
+            user_changed = False
+            if record.email and user.email != record.email:
+                user.email = record.email
+                user_changed = True
+            if record.username and user.username != record.username and record.username not in taken:
+                taken.discard(user.username)
+                taken.add(record.username)
+                user.username = record.username
+                user_changed = True
+            if user_changed:
+                changed_users.append(user)
+            if record.image_url and clerk_user.profile_image_url != record.image_url:
+                clerk_user.profile_image_url = record.image_url
+                changed_clerk_users.append(clerk_user)
+                profile = getattr(user, 'profile', None)
+                if profile is not None:
+                    profile.profile_image_url = record.image_url
+                    changed_profiles.append(profile)
+
+        User.objects.bulk_update(changed_users, ['username', 'email'], batch_size=batch_size)
+        ClerkUser.objects.bulk_update(changed_clerk_users, ['profile_image_url'], batch_size=batch_size)
+        Profile.objects.bulk_update(changed_profiles, ['profile_image_url'], batch_size=batch_size)
+
+    # bulk_update skips post_save, so drop the cached auth lookups by hand
+    forget_user(*existing)
+    return len(new), len({user.pk for user in changed_users} | {c.user_id for c in changed_clerk_users})
+
+def delete_clerk_users(clerk_ids):
+    """Delete the users behind these clerk_ids; returns how many existed"""
+    user_ids = list(ClerkUser.objects.filter(clerk_id__in=clerk_ids).values_list('user_id', flat=True))
+    User.objects.filter(pk__in=user_ids).delete()
+    forget_user(*clerk_ids)
+    return len(user_ids)
+
+def _applied_up_to(clerk_ids):
+    """{clerk_id: occurred_at of the newest event already applied}"""
+    return dict(
+        ClerkWebhookEvent.objects.filter(clerk_id__in=clerk_ids, status='done')
+        .values('clerk_id').annotate(latest=Max('occurred_at'))
+        .values_list('clerk_id', 'latest')
+    )
+
+def _apply(events):
+    """
+    Fold a batch of events into the user tables: the newest event per
+    clerk_id wins, unless a newer one for that user was already applied.
+    """
+    latest = {}
+    for event in sorted(events, key=lambda event: (event.occurred_at is not None, event.occurred_at, event.id)):
+        data = event.payload.get('data', {})
+        if event.type in ('user.created', 'user.updated', 'user.deleted') and data.get('id'):
+            latest[data['id']] = (event.type, data, event.occurred_at)
+
+    applied = _applied_up_to(list(latest))
+    for clerk_id, (kind, _, occurred_at) in list(latest.items()):
+        if occurred_at and applied.get(clerk_id) and occurred_at < applied[clerk_id]:
+            logger.info(f"Skipping stale {kind} for {clerk_id}")
+            del latest[clerk_id]
+
+    upserts = [clerk_record(data) for kind, data, _ in latest.values() if kind != 'user.deleted']
+    deletes = [clerk_id for clerk_id, (kind, _, _) in latest.items() if kind == 'user.deleted']
+    upsert_clerk_users(upserts)
+    delete_clerk_users(deletes)
+
+def apply_webhook_events(batch_size=500, max_attempts=MAX_ATTEMPTS):
+    """
+    Apply up to batch_size due events. A batch that fails is retried event
+    by event so one bad payload cannot hold up the rest; an event that
+    still fails is retried with exponential backoff and marked failed after
+    max_attempts. Returns (events done, events failed).
+    """
+    events = list(
+        ClerkWebhookEvent.objects.filter(status='pending', available_at__lte=timezone.now())
+        .order_by('id')[:batch_size]
+    )
+    if not events:
+        return 0, 0
+
+    try:
+        with transaction.atomic():
+            _apply(events)
+            _mark_done(events)
+        return len(events), 0
+    except Exception as e:
+        logger.error(f"Webhook batch failed, applying events one by one: {e}")
+
+    done = failed = 0
+    for event in events:
+        try:
+            with transaction.atomic():
+                _apply([event])
+                _mark_done([event])
+            done += 1
+        except Exception:
+            failed += 1
+            _record_failure(event, traceback.format_exc(), max_attempts)
+    return done, failed
+
+def _record_failure(event, error, max_attempts):
+    event.attempts += 1
+    event.last_error = error
+    if event.attempts >= max_attempts:
+        event.status = 'failed'
+    else:
+        # Exponential backoff: 2s, 4s, 8s, ...
+        event.available_at = timezone.now() + timezone.timedelta(seconds=2 ** event.attempts)
+    event.save(update_fields=['attempts', 'last_error', 'status', 'available_at'])
+
+def _mark_done(events):
+    ClerkWebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+        status='done',
+        attempts=F('attempts') + 1,
+        processed_at=timezone.now(),
+    )
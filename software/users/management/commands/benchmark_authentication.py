@@ -0,0 +1,88 @@
+import time
+from datetime import timedelta
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from backend.benchmarks import RollbackBenchmark
+from users.authentication import ClerkAuthentication
+from users.models import ClerkUser, Profile
+from users.tokens import verified_tokens, forget_user
+
+def uncached_authenticate(token, public_pem):
+    """The old path: unverified and verified decode, PEM parse, lookup, profile probe"""
+    unverified = jwt.decode(token, options={"verify_signature": False})
+    decoded = jwt.decode(
+        token,
+        public_pem,
+        algorithms=['RS256'],
+        options={'verify_aud': False},
+        leeway=60
+    )
+    clerk_user = ClerkUser.objects.select_related('user').get(clerk_id=decoded['sub'])
+    hasattr(clerk_user.user, 'profile')
+    return clerk_user.user
+
+class Command(BaseCommand):
+    help = 'Compares per-request bearer token authentication cost with and without the caches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode()
+        clerk_id = f'user_bench{time.monotonic_ns()}'
+        now = timezone.now()
+        token = jwt.encode(
+            {'sub': clerk_id, 'iat': now, 'exp': now + timedelta(hours=1), 'iss': settings.CLERK_ISSUER},
+            private_key,
+            algorithm='RS256'
+        )
+        factory = RequestFactory()
+        authentication = ClerkAuthentication()
+
+        def cached_authenticate():
+            # A fresh request each time, as the identity resolved for one
+            # request is reused for the rest of it
+            request = Request(factory.get('/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+            return authentication.authenticate(request)
+
+        self.stdout.write(f"{'path':>8} {'requests':>9} {'queries':>8} {'us/request':>11}")
+        with override_settings(CLERK_PUBLIC_KEY=public_pem):
+            for name, authenticate in (
+                ('uncached', lambda: uncached_authenticate(token, public_pem)),
+                ('cached', cached_authenticate),
+            ):
+                queries, elapsed = self.measure(clerk_id, authenticate, options['requests'])
+                per_request = elapsed / options['requests'] * 1_000_000
+                self.stdout.write(f"{name:>8} {options['requests']:>9} {queries:>8} {per_request:>11.1f}")
+        verified_tokens.clear()
+        forget_user(clerk_id)
+
+    def measure(self, clerk_id, authenticate, requests):
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(username=clerk_id)
+                ClerkUser.objects.create(user=user, clerk_id=clerk_id)
+                Profile.objects.create(user=user, clerk_id=clerk_id)
+                verified_tokens.clear()
+                forget_user(clerk_id)
+                with CaptureQueriesContext(connection) as ctx:
+                    started = time.perf_counter()
+                    for _ in range(requests):
+                        authenticate()
+                    elapsed = time.perf_counter() - started
+                raise RollbackBenchmark((len(ctx.captured_queries), elapsed))
+        except RollbackBenchmark as result:
+            return result.args[0]
@@ -0,0 +1,47 @@
+import csv
+import json
+import time
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from users.clerk_sync import clerk_record, upsert_clerk_users
+
+def read_rows(path):
+    """Yield user dicts from a Clerk CSV export or a JSON Lines file, one at a time"""
+    with open(path, newline='', encoding='utf-8') as export:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(export)
+        else:
+            for line in export:
+                if line.strip():
+                    yield json.loads(line)
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+class Command(BaseCommand):
+    help = 'Imports a Clerk user export (.csv or .jsonl) in streaming chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Users read and upserted per transaction')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        created = updated = rows = 0
+        try:
+            for chunk in chunked(read_rows(options['path']), options['chunk_size']):
+                records = [clerk_record(row) for row in chunk if row.get('id')]
+                chunk_created, chunk_updated = upsert_clerk_users(records)
+                created += chunk_created
+                updated += chunk_updated
+                rows += len(chunk)
+                self.stdout.write(f'{rows} rows read, {created} created, {updated} updated')
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {options["path"]}: {e}')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows} rows in {elapsed:.1f}s ({created} created, {updated} updated)'
+        ))
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from users.clerk_sync import apply_webhook_events, MAX_ATTEMPTS
+
+class Command(BaseCommand):
+    help = 'Applies stored Clerk webhook events to users in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Apply what is pending and exit instead of polling')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when no events are pending')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+
+    def handle(self, *args, **options):
+        self.stdout.write('Clerk webhook worker started')
+        while True:
+            done, failed = apply_webhook_events(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts']
+            )
+            if done or failed:
+                self.stdout.write(f'Applied {done} events, {failed} failed')
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Clerk webhook worker stopped'))
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:19
+
+import hashlib
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def hash_phone(phone):
+    # Frozen copy of users.models.hash_phone as of this migration
+    digits = re.sub(r'\D', '', phone or '')
+    return hashlib.sha256(digits.encode()).hexdigest() if digits else ''
+
+
+def backfill_phone_hash(apps, schema_editor):
+    Profile = apps.get_model('users', 'Profile')
+    profiles = list(Profile.objects.exclude(phone='').only('pk', 'phone'))
+    for profile in profiles:
+        profile.phone_hash = hash_phone(profile.phone)
+    Profile.objects.bulk_update(profiles, ['phone_hash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_clerk_webhook_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='phone_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(backfill_phone_hash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(condition=models.Q(('phone_hash', ''), _negated=True), fields=['phone_hash'], name='profile_phone_hash_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:47
+
+from datetime import datetime, timezone
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_ordering(apps, schema_editor):
+    # Frozen copy of ClerkWebhookEvent.from_delivery as of this migration;
+    # the Svix timestamp was not stored, so received_at stands in for it
+    ClerkWebhookEvent = apps.get_model('users', 'ClerkWebhookEvent')
+    events = list(ClerkWebhookEvent.objects.all())
+    for event in events:
+        payload = event.payload if isinstance(event.payload, dict) else {}
+        data = payload.get('data')
+        data = data if isinstance(data, dict) else {}
+        millis = data.get('updated_at') or payload.get('timestamp')
+        event.clerk_id = str(data.get('id') or '')
+        event.occurred_at = event.received_at
+        if isinstance(millis, int):
+            event.occurred_at = datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+    ClerkWebhookEvent.objects.bulk_update(events, ['clerk_id', 'occurred_at'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_profile_phone_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clerkwebhookevent',
+            name='available_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='clerkwebhookevent',
+            name='clerk_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='clerkwebhookevent',
+            name='occurred_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='clerkwebhookevent',
+            index=models.Index(fields=['clerk_id', 'status', 'occurred_at'], name='clerk_webhook_user_idx'),
+        ),
+        migrations.RunPython(backfill_ordering, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,19 @@
+import hashlib
+import re
+from datetime import datetime, timezone as dt_timezone
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models import Count, Sum, Avg, F, Max
-from django.db.models.functions import Coalesce
-from decimal import Decimal
+from django.db.models import Q
+from django.utils import timezone
+
+def hash_phone(phone):
+    """
+    SHA-256 hex digest of the digits of phone, the form in which clients
+    upload their contacts for matching (see friends.contacts); '' when phone
+    has no digits
+    """
+    digits = re.sub(r'\D', '', phone or '')
+    return hashlib.sha256(digits.encode()).hexdigest() if digits else ''
 
 class ClerkUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -20,42 +31,92 @@ class Profile(models.Model):
     address = models.CharField(max_length=255, blank=True)
     age = models.IntegerField(null=True, blank=True)
     profile_image_url = models.URLField(max_length=500, blank=True, null=True)
+    # hash_phone(phone), kept in step by save()
+    phone_hash = models.CharField(max_length=64, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['phone_hash'],
+                name='profile_phone_hash_idx',
+                condition=~Q(phone_hash='')
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.phone_hash = hash_phone(self.phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_hash'}
+        super().save(*args, **kwargs)
 
     def get_poker_stats(self):
-        from games.models import GameStats  # Import here to avoid circular import
+        from games.models import UserStatsRollup  # Import here to avoid circular import
         
-        stats = GameStats.objects.filter(player=self.user)
+        # Totals are maintained incrementally on GameStats changes
+        try:
+            rollup = UserStatsRollup.objects.get(user_id=self.user_id)
+        except UserStatsRollup.DoesNotExist:
+            rollup = UserStatsRollup(user_id=self.user_id)
         
-        # Calculate total stats
-        total_stats = stats.aggregate(
-            total_games=Count('id'),
-            total_profit=Coalesce(Sum(F('cash_out') - F('buy_in')), Decimal('0')),
-            total_hours=Coalesce(Sum('hours_played'), Decimal('0')),
-            total_buy_in=Coalesce(Sum('buy_in'), Decimal('0')),
-            total_cash_out=Coalesce(Sum('cash_out'), Decimal('0'))
-        )
-        
-        # Calculate derived stats
-        total_games = total_stats['total_games']
-        total_profit = total_stats['total_profit']
-        total_hours = total_stats['total_hours']
-        total_buy_in = total_stats['total_buy_in']
-        
-        return {
-            'total_games': total_games,
-            'total_profit': float(total_profit),
-            'total_hours': float(total_hours),
-            'average_profit_per_game': float(total_profit / total_games) if total_games > 0 else 0,
-            'hourly_rate': float(total_profit / total_hours) if total_hours > 0 else 0,
-            'roi_percentage': float((total_profit / total_buy_in) * 100) if total_buy_in > 0 else 0,
-            'biggest_win': float(stats.filter(cash_out__gt=F('buy_in')).annotate(
-                profit=F('cash_out') - F('buy_in')
-            ).aggregate(max_profit=Coalesce(Max('profit'), 0))['max_profit']),
-            'biggest_loss': float(stats.filter(cash_out__lt=F('buy_in')).annotate(
-                loss=F('buy_in') - F('cash_out')
-            ).aggregate(max_loss=Coalesce(Max('loss'), 0))['max_loss']),
-            'win_rate': float(stats.filter(cash_out__gt=F('buy_in')).count() / total_games * 100) if total_games > 0 else 0
-        }
+        return rollup.as_poker_stats()
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
+
+class ClerkWebhookEvent(models.Model):
+    """
+    A verified Clerk webhook delivery, stored before it is applied. The Svix
+    message id is unique, so redeliveries of the same event are dropped.
+    users.clerk_sync applies pending events in batches. occurred_at orders
+    the events of one Clerk user, so one that arrives or is retried after
+    a newer one has been applied is skipped.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)  # e.g., 'user.updated'
+    payload = models.JSONField(default=dict)
+    clerk_id = models.CharField(max_length=255, blank=True)  # The user the event is about
+    occurred_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # Pushed back after a failure
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='clerk_webhook_pending_idx'),
+            models.Index(fields=['clerk_id', 'status', 'occurred_at'], name='clerk_webhook_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.event_id} ({self.status})"
+
+    @classmethod
+    def from_delivery(cls, event_id, payload, sent_at):
+        """
+        An unsaved event for a delivery Svix signed at sent_at (a datetime).
+        It is dated by the user's updated_at, else Clerk's event timestamp,
+        else sent_at; Clerk gives both in epoch milliseconds.
+        """
+        data = payload.get('data')
+        data = data if isinstance(data, dict) else {}
+        millis = data.get('updated_at') or payload.get('timestamp')
+        occurred_at = sent_at
+        if isinstance(millis, int):
+            occurred_at = datetime.fromtimestamp(millis / 1000, tz=dt_timezone.utc)
+        return cls(
+            event_id=event_id,
+            type=payload.get('type', ''),
+            payload=payload,
+            clerk_id=str(data.get('id') or ''),
+            occurred_at=occurred_at,
+        )
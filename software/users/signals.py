@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from .models import ClerkUser, Profile
+from .tokens import forget_user
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -18,16 +19,25 @@ def create_user_profile(sender, instance, created, **kwargs):
             )
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    if not hasattr(instance, 'profile'):
-        # Generate a special clerk_id for superusers
-        clerk_id = f"superuser_{instance.id}" if instance.is_superuser else None
-        
-        if clerk_id:
-            Profile.objects.create(
-                user=instance,
-                clerk_id=clerk_id,
-                bio="Admin account"
-            )
-    elif instance.profile:
-        instance.profile.save() 
\ No newline at end of file
+def save_user_profile(sender, instance, created, **kwargs):
+    # Only superusers get a profile here; the profile is not re-saved with
+    # every user save, that was an extra write per request
+    if not created and instance.is_superuser and not hasattr(instance, 'profile'):
+        Profile.objects.create(
+            user=instance,
+            clerk_id=f"superuser_{instance.id}",
+            bio="Admin account"
+        )
+
+@receiver(post_save, sender=ClerkUser)
+@receiver(post_delete, sender=ClerkUser)
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the authentication cache entry of the user behind this clerk_id"""
+    forget_user(instance.clerk_id)
+
+@receiver(post_save, sender=User)
+def invalidate_cached_clerk_user(sender, instance, created, **kwargs):
+    if not created:
+        forget_user(*ClerkUser.objects.filter(user_id=instance.pk).values_list('clerk_id', flat=True))
@@ -1,3 +1,445 @@
-from django.test import TestCase
+import base64
+import csv
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+
+from backend.testing import make_game
+from games.models import GameStats, UserStatsRollup
+from notifications import outbox
+from .authentication import ClerkAuthentication
+from .clerk_api import ClerkClient, reset_clerk_client
+from .clerk_sync import apply_webhook_events
+from .models import ClerkUser, ClerkWebhookEvent, Profile
+from .tokens import VerifiedTokenCache, verified_tokens
+
+PRIVATE_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+PUBLIC_PEM = PRIVATE_KEY.public_key().public_bytes(
+    serialization.Encoding.PEM,
+    serialization.PublicFormat.SubjectPublicKeyInfo
+).decode()
+
+
+def make_token(clerk_id, lifetime=timedelta(hours=1), **claims):
+    now = timezone.now()
+    payload = {'sub': clerk_id, 'iat': now, 'exp': now + lifetime, 'iss': settings.CLERK_ISSUER}
+    payload.update(claims)
+    return jwt.encode(payload, PRIVATE_KEY, algorithm='RS256')
+
+
+@override_settings(CLERK_PUBLIC_KEY=PUBLIC_PEM)
+class ClerkAuthenticationCacheTests(TestCase):
+    def setUp(self):
+        verified_tokens.clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='player')
+        ClerkUser.objects.create(user=self.user, clerk_id='user_abc')
+        Profile.objects.create(user=self.user, clerk_id='user_abc')
+        self.token = make_token('user_abc')
+
+    def authenticate(self, token=None):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token or self.token}')
+        return ClerkAuthentication().authenticate(Request(request))
+
+    def test_repeat_requests_skip_verification_and_queries(self):
+        with mock.patch('users.tokens.jwt.decode', wraps=jwt.decode) as decode:
+            with self.assertNumQueries(1):
+                user, _ = self.authenticate()
+            with self.assertNumQueries(0):
+                again, _ = self.authenticate()
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(again.pk, self.user.pk)
+        self.assertTrue(hasattr(again, 'profile'))
+
+    def test_saving_the_user_invalidates_the_cached_lookup(self):
+        self.authenticate()
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate()
+        self.assertEqual(user.first_name, 'Renamed')
+
+    def test_invalid_and_expired_tokens_are_rejected(self):
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(self.token[:-4] + 'abcd')
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(make_token('user_abc', lifetime=timedelta(minutes=-5)))
+        self.assertEqual(len(verified_tokens), 0)
+
+
+@override_settings(CLERK_PUBLIC_KEY=PUBLIC_PEM)
+class SingleVerificationPerRequestTests(TestCase):
+    def setUp(self):
+        verified_tokens.clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='player')
+        ClerkUser.objects.create(user=self.user, clerk_id='user_abc')
+        Profile.objects.create(user=self.user, clerk_id='user_abc')
+
+    def get_profile(self, token):
+        return self.client.get('/api/users/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_middleware_backend_and_drf_share_one_verification(self):
+        token = make_token('user_abc')
+        with mock.patch('users.tokens.jwt.decode', wraps=jwt.decode) as decode:
+            # The clerk_id lookup (profile included) is the only query the
+            # authentication layers make; the view then reads the stats rollup
+            with self.assertNumQueries(2):
+                response = self.get_profile(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.user.profile.id)
+        self.assertEqual(decode.call_count, 1)
+
+    def test_bad_token_is_rejected_after_one_attempt(self):
+        with mock.patch('users.tokens.jwt.decode', wraps=jwt.decode) as decode:
+            response = self.get_profile(make_token('user_abc', lifetime=timedelta(minutes=-5)))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(decode.call_count, 1)
+
+
+class FakeClerkHandler(BaseHTTPRequestHandler):
+    """Serves GET /v1/users/<id> from FakeClerkServer.users"""
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        if self.server.failures:
+            self.server.failures -= 1
+            return self.reply(503, {'errors': ['unavailable']})
+        user = self.server.users.get(self.path.rsplit('/', 1)[-1])
+        self.reply(200, user) if user else self.reply(404, {'errors': ['not found']})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeClerkServer(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeClerkHandler)
+        self.users = {}
+        self.hits = []
+        self.failures = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+
+@override_settings(CLERK_PUBLIC_KEY=PUBLIC_PEM)
+class ClerkProvisioningTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeClerkServer()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        verified_tokens.clear()
+        cache.clear()
+        self.server.hits.clear()
+        self.server.failures = 0
+        self.server.users['user_new'] = {
+            'id': 'user_new',
+            'username': 'shark',
+            'image_url': 'https://img.example.com/shark.png',
+            'primary_email_address_id': 'idn_2',
+            'email_addresses': [
+                {'id': 'idn_1', 'email_address': 'old@example.com'},
+                {'id': 'idn_2', 'email_address': 'shark@example.com'},
+            ],
+        }
+        settings_override = override_settings(CLERK_API_URL=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_clerk_client()
+        self.addCleanup(reset_clerk_client)
+
+    def login(self):
+        token = make_token('user_new', email='new@example.com')
+        return self.client.get('/api/users/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_first_login_does_not_wait_on_clerk(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.hits, [])
+        user = ClerkUser.objects.get(clerk_id='user_new').user
+        self.assertEqual((user.username, user.email), ('user_new', 'new@example.com'))
+
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertEqual(self.server.hits, ['/v1/users/user_new'])
+        user.refresh_from_db()
+        self.assertEqual((user.username, user.email), ('shark', 'shark@example.com'))
+        self.assertEqual(user.profile.profile_image_url, 'https://img.example.com/shark.png')
+
+        self.login()
+        self.assertEqual(ClerkUser.objects.filter(clerk_id='user_new').count(), 1)
+
+    def test_transient_clerk_errors_are_retried(self):
+        self.login()
+        self.server.failures = 2
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertEqual(len(self.server.hits), 3)
+
+    def test_clerk_is_called_outside_the_outbox_transaction(self):
+        self.login()
+        get_user, depths = ClerkClient.get_user, []
+
+        def recording_get_user(client, clerk_id):
+            depths.append(len(connection.atomic_blocks))
+            return get_user(client, clerk_id)
+
+        outer = len(connection.atomic_blocks)
+        with mock.patch.object(ClerkClient, 'get_user', recording_get_user):
+            self.assertEqual(outbox.drain(), (1, 0))
+        self.assertEqual(depths, [outer])
+        self.assertEqual(ClerkUser.objects.get(clerk_id='user_new').user.username, 'shark')
+
+
+def write_queries(ctx):
+    return [
+        query['sql'] for query in ctx.captured_queries
+        if query['sql'].split(' ', 1)[0] in ('INSERT', 'UPDATE', 'DELETE')
+    ]
+
+
+@override_settings(CLERK_PUBLIC_KEY=PUBLIC_PEM)
+class ProfileSyncTests(TestCase):
+    def setUp(self):
+        verified_tokens.clear()
+        cache.clear()
+        self.user = User.objects.create_user(username='player', email='player@example.com')
+        self.clerk_user = ClerkUser.objects.create(
+            user=self.user, clerk_id='user_abc', profile_image_url='https://img.example.com/a.png'
+        )
+        Profile.objects.create(user=self.user, clerk_id='user_abc')
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {make_token('user_abc')}"}
+
+    def sync(self, **clerk_data):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                '/api/users/sync_profile/',
+                {'clerk_data': dict({'id': 'user_abc'}, **clerk_data)},
+                content_type='application/json',
+                **self.auth
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['changed'], write_queries(ctx)
+
+    def test_read_requests_do_not_write(self):
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get('/api/users/profile/', **self.auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(write_queries(ctx), [])
+
+    def test_sync_writes_only_what_changed(self):
+        changed, writes = self.sync(username='player', email='player@example.com',
+                                    profile_image_url='https://img.example.com/a.png')
+        self.assertEqual((changed, writes), ([], []))
+
+        changed, writes = self.sync(username='shark', email='shark@example.com',
+                                    profile_image_url='https://img.example.com/b.png')
+        self.assertEqual(changed, ['email', 'username', 'profile_image_url'])
+        # One UPDATE each for the user, the ClerkUser and the profile
+        self.assertEqual(len(writes), 3)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.username, self.user.profile.profile_image_url),
+                         ('shark', 'https://img.example.com/b.png'))
+
+WEBHOOK_SECRET = 'whsec_' + base64.b64encode(b'test-webhook-secret').decode()
+
+
+def clerk_user_data(clerk_id, username=None, email=None, image_url=None, updated_at=None):
+    return {
+        'id': clerk_id,
+        'username': username,
+        'image_url': image_url,
+        'primary_email_address_id': 'idn_1',
+        'email_addresses': [{'id': 'idn_1', 'email_address': email}] if email else [],
+        'updated_at': updated_at,
+    }
+
+
+@override_settings(CLERK_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class ClerkWebhookInboxTests(TestCase):
+    def deliver(self, event_id, type, data, secret=WEBHOOK_SECRET, timestamp=None):
+        body = json.dumps({'type': type, 'data': data}).encode()
+        timestamp = str(timestamp or int(time.time()))
+        key = base64.b64decode(secret.split('_', 1)[1])
+        signature = base64.b64encode(
+            hmac.new(key, f'{event_id}.{timestamp}.'.encode() + body, hashlib.sha256).digest()
+        ).decode()
+        return self.client.post(
+            '/api/users/webhooks/clerk/', body, content_type='application/json',
+            HTTP_SVIX_ID=event_id, HTTP_SVIX_TIMESTAMP=timestamp,
+            HTTP_SVIX_SIGNATURE=f'v1,{signature}'
+        )
+
+    def test_unsigned_stale_and_duplicate_deliveries(self):
+        data = clerk_user_data('user_a', 'alice', 'alice@example.com')
+        forged = 'whsec_' + base64.b64encode(b'not-the-secret').decode()
+        self.assertEqual(self.deliver('msg_1', 'user.created', data, secret=forged).status_code, 400)
+        self.assertEqual(
+            self.deliver('msg_1', 'user.created', data, timestamp=int(time.time()) - 3600).status_code, 400
+        )
+        self.assertEqual(self.deliver('msg_1', 'user.created', data).status_code, 200)
+        self.assertEqual(self.deliver('msg_1', 'user.created', data).status_code, 200)
+        self.assertEqual(ClerkWebhookEvent.objects.count(), 1)
+
+    def test_worker_applies_a_batch_with_bulk_queries(self):
+        existing = User.objects.create_user(username='bob', email='bob@old.example.com')
+        ClerkUser.objects.create(user=existing, clerk_id='user_b')
+        Profile.objects.create(user=existing, clerk_id='user_b')
+        doomed = User.objects.create_user(username='carol')
+        ClerkUser.objects.create(user=doomed, clerk_id='user_c')
+
+        for i in range(50):
+            self.deliver(f'msg_new{i}', 'user.created', clerk_user_data(f'user_n{i}', f'new{i}'))
+        self.deliver('msg_b1', 'user.updated', clerk_user_data('user_b', 'bob', 'bob@example.com'))
+        self.deliver('msg_b2', 'user.updated', clerk_user_data('user_b', 'bobby', 'bob@example.com', 'https://img/b.png'))
+        self.deliver('msg_c', 'user.deleted', {'id': 'user_c', 'deleted': True})
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(apply_webhook_events(), (53, 0))
+        # One INSERT per table for all 50 new users; the rest is the user
+        # delete cascade and a fixed number of reads and bulk UPDATEs
+        inserts = [q for q in write_queries(ctx) if q.startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+        self.assertLess(len(ctx.captured_queries), 45)
+
+        self.assertEqual(ClerkUser.objects.filter(clerk_id__startswith='user_n').count(), 50)
+        self.assertEqual(Profile.objects.filter(clerk_id__startswith='user_n').count(), 50)
+        existing.refresh_from_db()
+        self.assertEqual((existing.username, existing.email), ('bobby', 'bob@example.com'))
+        self.assertEqual(existing.profile.profile_image_url, 'https://img/b.png')
+        self.assertFalse(User.objects.filter(pk=doomed.pk).exists())
+        self.assertEqual(apply_webhook_events(), (0, 0))
+
+    def test_deleting_a_player_with_game_stats(self):
+        host = User.objects.create_user(username='host')
+        player = User.objects.create_user(username='dana')
+        ClerkUser.objects.create(user=player, clerk_id='user_d')
+        game = make_game(host)
+        GameStats.objects.create(game=game, player=player, buy_in=20, cash_out=50, hours_played=2)
+        GameStats.objects.create(game=game, player=host, buy_in=20, cash_out=0, hours_played=2)
+
+        self.deliver('msg_d', 'user.deleted', {'id': 'user_d', 'deleted': True})
+        self.assertEqual(apply_webhook_events(max_attempts=1), (1, 0))
+        self.assertFalse(User.objects.filter(pk=player.pk).exists())
+        self.assertFalse(UserStatsRollup.objects.filter(user_id=player.pk).exists())
+        self.assertEqual(UserStatsRollup.objects.get(user=host).total_games, 1)
+
+    def test_bad_event_does_not_hold_up_the_batch(self):
+        self.deliver('msg_ok', 'user.created', clerk_user_data('user_ok', 'ok'))
+        ClerkWebhookEvent.objects.create(event_id='msg_bad', type='user.created', payload={'data': 'junk'})
+        self.assertEqual(apply_webhook_events(max_attempts=1), (1, 1))
+        self.assertEqual(ClerkWebhookEvent.objects.get(event_id='msg_bad').status, 'failed')
+        self.assertTrue(ClerkUser.objects.filter(clerk_id='user_ok').exists())
+
+    def test_failing_event_backs_off_then_gives_up(self):
+        event = ClerkWebhookEvent.objects.create(event_id='msg_bad', type='user.created', payload={'data': 'junk'})
+        self.assertEqual(apply_webhook_events(max_attempts=2), (0, 1))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertGreater(event.available_at, timezone.now())
+        self.assertEqual(apply_webhook_events(max_attempts=2), (0, 0))
+
+        ClerkWebhookEvent.objects.filter(pk=event.pk).update(available_at=timezone.now())
+        self.assertEqual(apply_webhook_events(max_attempts=2), (0, 1))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('failed', 2))
+
+    def test_stale_events_do_not_overwrite_newer_ones(self):
+        minute_ago = int(time.time() * 1000) - 60_000  # Clerk's updated_at is in ms
+        self.deliver('msg_2', 'user.updated', clerk_user_data('user_e', 'eve2', updated_at=minute_ago + 2))
+        self.deliver('msg_1', 'user.created', clerk_user_data('user_e', 'eve1', updated_at=minute_ago + 1))
+        # Out of order within one batch: the newer event wins
+        self.assertEqual(apply_webhook_events(), (2, 0))
+        self.assertEqual(ClerkUser.objects.get(clerk_id='user_e').user.username, 'eve2')
+
+        # Across batches too: a late update is skipped...
+        self.deliver('msg_late', 'user.updated', clerk_user_data('user_e', 'eve1', updated_at=minute_ago + 1))
+        self.assertEqual(apply_webhook_events(), (1, 0))
+        self.assertEqual(ClerkUser.objects.get(clerk_id='user_e').user.username, 'eve2')
+
+        # ...and so is one retried after the user was deleted (dated by the delivery)
+        self.deliver('msg_3', 'user.updated', clerk_user_data('user_e', 'eve3', updated_at=minute_ago + 3))
+        ClerkWebhookEvent.objects.filter(event_id='msg_3').update(available_at=timezone.now() + timezone.timedelta(hours=1))
+        self.deliver('msg_gone', 'user.deleted', {'id': 'user_e', 'deleted': True})
+        self.assertEqual(apply_webhook_events(), (1, 0))
+        ClerkWebhookEvent.objects.filter(event_id='msg_3').update(available_at=timezone.now())
+        self.assertEqual(apply_webhook_events(), (1, 0))
+        self.assertFalse(ClerkUser.objects.filter(clerk_id='user_e').exists())
+
+    def test_import_command_streams_chunks(self):
+        User.objects.create_user(username='player7')  # Taken, so user_p7 gets a fallback name
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as export:
+            writer = csv.writer(export)
+            writer.writerow(['id', 'username', 'primary_email_address'])
+            for i in range(250):
+                writer.writerow([f'user_p{i}', f'player{i}', f'player{i}@example.com'])
+        self.addCleanup(os.unlink, export.name)
+
+        out = StringIO()
+        call_command('import_clerk_users', export.name, '--chunk-size', '100', stdout=out)
+        self.assertIn('Imported 250 rows', out.getvalue())
+        self.assertEqual(ClerkUser.objects.filter(clerk_id__startswith='user_p').count(), 250)
+        self.assertEqual(ClerkUser.objects.get(clerk_id='user_p7').user.username, 'user_p7')
+
+        call_command('import_clerk_users', export.name, stdout=StringIO())
+        self.assertEqual(ClerkUser.objects.filter(clerk_id__startswith='user_p').count(), 250)
+
+
+class VerifiedTokenCacheTests(TestCase):
+    def test_entries_expire_with_the_token_and_are_bounded(self):
+        tokens = VerifiedTokenCache(max_size=2)
+        tokens.set('expired', {'exp': time.time() - 1})
+        self.assertIsNone(tokens.get('expired'))
+
+        for name in ('a', 'b', 'c'):
+            tokens.set(name, {'sub': name, 'exp': time.time() + 60})
+        self.assertIsNone(tokens.get('a'))
+        self.assertEqual(tokens.get('c')['sub'], 'c')
+        self.assertEqual(len(tokens), 2)
+
+    def test_benchmark_command_authenticates_each_request(self):
+        out = StringIO()
+        call_command('benchmark_authentication', '--requests', '5', stdout=out)
+        rows = {line.split()[0]: line.split()[1:] for line in out.getvalue().splitlines()[1:]}
+        self.assertEqual(rows['uncached'][:2], ['5', '10'])
+        # Only the first request looks the user up; the rest hit the caches
+        self.assertEqual(rows['cached'][:2], ['5', '1'])
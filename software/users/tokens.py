@@ -0,0 +1,137 @@
+"""
+Clerk session token verification with caching. The PEM public key is parsed
+once, verified claims are kept in a bounded in-process cache keyed by the
+token's digest until the token expires, and the clerk_id -> User lookup is
+cached in Django's cache and dropped whenever the user, its ClerkUser or its
+Profile is saved or deleted (see users.signals).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+import jwt
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from django.conf import settings
+from django.core.cache import cache
+from .models import ClerkUser
+
+USER_CACHE_PREFIX = 'clerk-user:'
+
+# The outcome of authenticating a request's bearer token, stored on the
+# HttpRequest so every layer that needs it reuses the one verification
+ClerkIdentity = namedtuple('ClerkIdentity', ['token', 'user', 'claims', 'error'])
+REQUEST_IDENTITY_ATTR = '_clerk_identity'
+
+def bearer_token(request):
+    """The token from an 'Authorization: Bearer <token>' header, or None"""
+    auth_header = request.META.get('HTTP_AUTHORIZATION')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return auth_header.split(' ')[1]
+
+def request_identity(request, token):
+    """The identity already resolved for this token on this request, if any"""
+    identity = getattr(request, REQUEST_IDENTITY_ATTR, None)
+    if identity is not None and identity.token == token:
+        return identity
+    return None
+
+@lru_cache(maxsize=4)
+def _load_public_key(pem):
+    return load_pem_public_key(pem.encode())
+
+def public_key():
+    """The parsed CLERK_PUBLIC_KEY, built on first use and reused afterwards"""
+    return _load_public_key(settings.CLERK_PUBLIC_KEY)
+
+class VerifiedTokenCache:
+    """
+    LRU map of token digest -> verified claims, bounded by max_size. An entry
+    is served until the token's exp claim, so expiry is never extended.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        key = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def set(self, token, claims):
+        expires_at = claims.get('exp')
+        if not expires_at:
+            return  # Without an expiry there is nothing safe to bound the entry by
+        key = self.digest(token)
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+verified_tokens = VerifiedTokenCache(getattr(settings, 'CLERK_TOKEN_CACHE_SIZE', 1024))
+
+def decode_token(token):
+    """Verify the token's RS256 signature and timing claims; raises jwt.InvalidTokenError"""
+    return jwt.decode(
+        token,
+        public_key(),
+        algorithms=['RS256'],
+        issuer=settings.CLERK_ISSUER,
+        options={
+            'verify_exp': True,
+            'verify_iat': True,
+            'verify_nbf': False,
+            'verify_aud': False  # Don't verify audience claim
+        },
+        leeway=60  # Tolerate 60 seconds of clock skew, including an iat in the future
+    )
+
+def verify_token(token):
+    """Verified claims for token, from the cache when it was seen before"""
+    claims = verified_tokens.get(token)
+    if claims is None:
+        claims = decode_token(token)
+        verified_tokens.set(token, claims)
+    return claims
+
+def user_cache_key(clerk_id):
+    return f'{USER_CACHE_PREFIX}{clerk_id}'
+
+def cached_user(clerk_id):
+    """The User (with its profile loaded) for clerk_id, or None if there is none"""
+    key = user_cache_key(clerk_id)
+    user = cache.get(key)
+    if user is None:
+        clerk_user = ClerkUser.objects.select_related('user__profile').filter(clerk_id=clerk_id).first()
+        if clerk_user is None:
+            return None
+        user = clerk_user.user
+        if hasattr(user, 'profile'):
+            # Only cache complete users; a missing profile gets created by the caller
+            cache.set(key, user, getattr(settings, 'CLERK_USER_CACHE_TIMEOUT', 300))
+    return user
+
+def forget_user(*clerk_ids):
+    cache.delete_many([user_cache_key(clerk_id) for clerk_id in clerk_ids if clerk_id])
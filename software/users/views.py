@@ -4,6 +4,7 @@ from django.urls import reverse_lazy
 from .forms import SignUpForm
 from django.contrib.auth.forms import UserChangeForm
 from .models import ClerkUser, Profile
+from .clerk_api import sync_clerk_profile
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
 from .serializers import ProfileSerializer
@@ -26,30 +27,16 @@ class UserEditView(generic.UpdateView):
     return self.request.user
 
 def sync_user_profile(user, clerk_data):
+    """Apply what the app reports from Clerk, writing only fields that changed"""
     try:
-        clerk_user = ClerkUser.objects.get(user=user)
-        
-        # Update profile image URL if provided
-        if clerk_data.get('profile_image_url'):
-            clerk_user.profile_image_url = clerk_data.get('profile_image_url')
-            clerk_user.save()
-
-        # Update username if changed
-        if clerk_data.get('username') and user.username != clerk_data.get('username'):
-            user.username = clerk_data.get('username')
-            user.save()
-
-        # Update email if provided
-        if clerk_data.get('email'):
-            user.email = clerk_data.get('email')
-            user.save()
-
+        clerk_user = ClerkUser.objects.select_related('user').get(user=user)
     except ClerkUser.DoesNotExist:
-        ClerkUser.objects.create(
+        clerk_user = ClerkUser.objects.create(
             user=user,
             clerk_id=clerk_data.get('id'),
             profile_image_url=clerk_data.get('profile_image_url')
         )
+    return sync_clerk_profile(clerk_user, clerk_data)
 
 class ProfileView(generics.RetrieveAPIView):
     serializer_class = ProfileSerializer
@@ -62,5 +49,5 @@ class ProfileView(generics.RetrieveAPIView):
 @permission_classes([IsAuthenticated])
 def sync_profile_view(request):
     clerk_data = request.data.get('clerk_data', {})
-    sync_user_profile(request.user, clerk_data)
-    return Response({'status': 'success'})
\ No newline at end of file
+    changed = sync_user_profile(request.user, clerk_data)
+    return Response({'status': 'success', 'changed': changed})
\ No newline at end of file
@@ -1,81 +1,77 @@
+import base64
+import hashlib
+import hmac
 import json
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.contrib.auth.models import User
-from .models import ClerkUser
-from django.conf import settings
-import hmac
-import hashlib
-import sys
-import logging
-from datetime import datetime
-import traceback
+from django.views.decorators.http import require_POST
+from .models import ClerkWebhookEvent
 
-# Set up logging
-logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Deliveries signed further than this from our clock are rejected as replays
+SIGNATURE_TOLERANCE = 5 * 60
+
+class InvalidSignature(Exception):
+    pass
+
+def verify_signature(headers, body, secret=None, now=None):
+    """
+    Check the Svix signature Clerk puts on every delivery: an HMAC-SHA256 of
+    "<svix-id>.<svix-timestamp>.<body>" keyed with the base64 part of the
+    whsec_ secret. Returns (svix-id, svix-timestamp as epoch seconds).
+    """
+    secret = secret or settings.CLERK_WEBHOOK_SECRET
+    message_id = headers.get('svix-id')
+    timestamp = headers.get('svix-timestamp')
+    signatures = headers.get('svix-signature')
+    if not (message_id and timestamp and signatures):
+        raise InvalidSignature('Missing svix headers')
+
+    try:
+        sent_at = int(timestamp)
+    except ValueError:
+        raise InvalidSignature('Bad timestamp')
+    if abs((now or time.time()) - sent_at) > SIGNATURE_TOLERANCE:
+        raise InvalidSignature('Timestamp outside the tolerance window')
+
+    key = base64.b64decode(secret.split('_', 1)[1] if secret.startswith('whsec_') else secret)
+    signed = f'{message_id}.{timestamp}.'.encode() + body
+    expected = base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+    for signature in signatures.split(' '):
+        version, _, value = signature.partition(',')
+        if version == 'v1' and hmac.compare_digest(value, expected):
+            return message_id, sent_at
+    raise InvalidSignature('No matching signature')
+
 @csrf_exempt
+@require_POST
 def clerk_webhook(request):
-    sys.stdout.write(f"\n=== WEBHOOK REQUEST RECEIVED AT {datetime.now()} ===\n")
-    sys.stdout.flush()
-    
+    """
+    Verify and store the delivery; `manage.py process_clerk_webhooks`
+    applies stored events in batches. Redeliveries are acknowledged and dropped.
+    """
+    try:
+        event_id, sent_at = verify_signature(request.headers, request.body)
+    except InvalidSignature as e:
+        logger.warning(f"Rejected Clerk webhook: {e}")
+        return HttpResponse(status=400)
+
     try:
         data = json.loads(request.body)
-        event_type = data.get('type')
-        
-        print(f"Event type: {event_type}", flush=True)
-        
-        if event_type == 'user.created':
-            user_data = data.get('data', {})
-            print(f"Processing user data: {json.dumps(user_data, indent=2)}", flush=True)
-            
-            # Get email from the first email address
-            email_addresses = user_data.get('email_addresses', [])
-            if not email_addresses:
-                print("No email addresses found!", flush=True)
-                return HttpResponse(status=400)
-            
-            email = email_addresses[0].get('email_address')
-            username = user_data.get('username')  # Get username from Clerk
-            clerk_id = user_data.get('id')
-            
-            if not username:
-                username = email.split('@')[0]  # Fallback to email prefix if no username
-            
-            print(f"Creating user with: username={username}, email={email}, clerk_id={clerk_id}", flush=True)
-            
-            try:
-                # Check if user already exists
-                if User.objects.filter(email=email).exists():
-                    print(f"User with email {email} already exists", flush=True)
-                    return HttpResponse(status=200)
-                
-                # Create Django user with minimal required fields
-                user = User.objects.create_user(
-                    username=username,
-                    email=email,
-                    password=None,  # No password needed as we're using Clerk
-                    first_name='',  # Empty string for first name
-                    last_name=''    # Empty string for last name
-                )
-                print(f"Created Django user: {user.username}", flush=True)
-                
-                # Create ClerkUser
-                clerk_user = ClerkUser.objects.create(
-                    user=user,
-                    clerk_id=clerk_id
-                )
-                print(f"Created ClerkUser: {clerk_user}", flush=True)
-                
-            except Exception as e:
-                print(f"Error creating user: {str(e)}", flush=True)
-                print(traceback.format_exc(), flush=True)
-                return HttpResponse(status=500)
-        
-        return HttpResponse(status=200)
-        
-    except Exception as e:
-        print(f"Error processing webhook: {str(e)}", flush=True)
-        print(traceback.format_exc(), flush=True)
-        return HttpResponse(status=500) 
\ No newline at end of file
+    except ValueError:
+        return HttpResponse(status=400)
+
+    try:
+        with transaction.atomic():
+            ClerkWebhookEvent.from_delivery(
+                event_id, data, datetime.fromtimestamp(sent_at, tz=dt_timezone.utc)
+            ).save()
+    except IntegrityError:
+        logger.info(f"Duplicate Clerk webhook {event_id} dropped")
+    return HttpResponse(status=200)